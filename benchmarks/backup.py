@@ -0,0 +1,136 @@
+"""
+Callback latency while an online backup runs.
+
+    python -m benchmarks.backup                              # default pacing grid
+    python -m benchmarks.backup --bets 1000000 --pacing 256:5 --pacing 1024:0
+    python -m benchmarks.backup --rate 400 --workers 16
+
+A temp database is seeded with --users users and --bets bets, then
+--workers tasks play rounds (start_active_round + resolve_active_round,
+the writes behind one blackjack callback) at --rate rounds per second in
+total. Latency is recorded once without a backup and then during one
+Database.backup per --pacing PAGES:SLEEP_MS, so the table shows what each
+pacing costs gameplay (p50/p99/max) and how long the backup takes.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services import clock  # noqa: E402
+from storage.db import Database  # noqa: E402
+
+DEFAULT_PACING = ["64:20", "256:5", "1024:1", "100000:0"]
+
+
+def seed(path: str, users: int, bets: int) -> None:
+    now = clock.now_ms()
+    with sqlite3.connect(path) as c:
+        c.executemany(
+            "INSERT INTO users (tg_id, username, balance, created_at) VALUES (?, ?, ?, ?)",
+            ((i + 1, f"user{i + 1}", 10**12, now) for i in range(users)),
+        )
+        rng = random.Random(1)
+        c.executemany(
+            "INSERT INTO bets (user_id, game, amount, result, delta, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            ((rng.randint(1, users), "blackjack", 10, "win", 10, now - (bets - i) * 1000) for i in range(bets)),
+        )
+    c.close()
+
+
+def _pct(sorted_ms: List[float], q: float) -> float:
+    return sorted_ms[min(len(sorted_ms) - 1, int(q * len(sorted_ms)))]
+
+
+async def play(db: Database, users: int, rate: float, workers: int, until: asyncio.Event) -> List[float]:
+    """Round latencies in ms until `until` is set."""
+    latencies: List[float] = []
+    interval = workers / rate
+    perf = time.perf_counter
+
+    async def worker(w: int):
+        rng = random.Random(w)
+        while not until.is_set():
+            tg = rng.randint(1, users)
+            t0 = perf()
+            if await db.start_active_round(tg, "blackjack", 10, "{}"):
+                await db.resolve_active_round(tg, "win", 20)
+            latencies.append((perf() - t0) * 1000)
+            await asyncio.sleep(max(0.0, interval - (perf() - t0)))
+
+    await asyncio.gather(*(worker(w) for w in range(workers)))
+    return latencies
+
+
+async def measure(db: Database, args, pacing: Optional[str], backup_dir: str) -> Dict[str, object]:
+    until = asyncio.Event()
+    players = asyncio.create_task(play(db, args.users, args.rate, args.workers, until))
+    info: Dict[str, object] = {}
+    if pacing is None:
+        await asyncio.sleep(args.idle_s)
+    else:
+        pages, _, sleep_ms = pacing.partition(":")
+        info = await db.backup(backup_dir, keep=1, pages=int(pages), step_sleep_s=float(sleep_ms or 0) / 1000)
+    until.set()
+    lat = sorted(await players)
+    return {
+        "rounds": len(lat),
+        "p50": statistics.median(lat) if lat else 0.0,
+        "p99": _pct(lat, 0.99) if lat else 0.0,
+        "max": lat[-1] if lat else 0.0,
+        "steps": info.get("steps", "-"),
+        "copy_s": info.get("copy_s", "-"),
+        "total_s": info.get("total_s", "-"),
+        "size_mb": round(info["bytes"] / 2**20, 1) if info else "-",
+    }
+
+
+async def run(args) -> None:
+    with tempfile.TemporaryDirectory(prefix="casinon-bench-backup-") as tmp:
+        path = os.path.join(tmp, "bench.db")
+        db = Database(path, starting_balance=10**12)
+        await db.init()
+        await db.close()
+        t0 = time.perf_counter()
+        seed(path, args.users, args.bets)
+        print(f"seeded {args.users} users / {args.bets} bets in {time.perf_counter() - t0:.1f}s "
+              f"({os.path.getsize(path) / 2**20:.1f} MB)")
+
+        db = Database(path, starting_balance=10**12)
+        await db.init()
+        try:
+            print(f"{'pacing (pages:ms)':<20}{'rounds':>8}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+                  f"{'steps':>8}{'copy s':>8}{'total s':>9}{'gz MB':>8}")
+            for pacing in [None] + (args.pacing or DEFAULT_PACING):
+                r = await measure(db, args, pacing, os.path.join(tmp, "backups"))
+                print(f"{pacing or 'no backup':<20}{r['rounds']:>8}{r['p50']:>9.2f}{r['p99']:>9.2f}{r['max']:>9.2f}"
+                      f"{r['steps']:>8}{r['copy_s']:>8}{r['total_s']:>9}{r['size_mb']:>8}")
+        finally:
+            await db.close()
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Casinon callback latency during online backups")
+    p.add_argument("--users", type=int, default=10_000)
+    p.add_argument("--bets", type=int, default=300_000)
+    p.add_argument("--rate", type=float, default=200, help="rounds per second, all workers together")
+    p.add_argument("--workers", type=int, default=8)
+    p.add_argument("--idle-s", type=float, default=2.0, help="length of the no-backup baseline")
+    p.add_argument("--pacing", action="append", metavar="PAGES:SLEEP_MS",
+                   help=f"backup pacing to measure (repeatable, default: {' '.join(DEFAULT_PACING)})")
+    asyncio.run(run(p.parse_args(argv)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""
+Benchmark cases for the hot paths of the game engines and the storage layer.
+
+Each case is registered with @case(name). A case is a factory that receives
+a setup context and returns the callable to time (sync function or coroutine
+function). Storage cases get a fresh Database on a temp file.
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+from typing import Any, Callable, Dict, List, Optional
+
+from games import blackjack, roulette, simple21
+from services import rng
+from services.cards import calculate_hand_value
+from storage.db import Database
+from storage.memory import MemoryStorage
+
+CASES: Dict[str, Dict[str, Any]] = {}
+
+
+def case(name: str, storage: bool = False):
+    def deco(factory: Callable[..., Callable]):
+        CASES[name] = {"factory": factory, "storage": storage}
+        return factory
+    return deco
+
+
+# ---------------- Cards / RNG ----------------
+
+@case("services.cards.calculate_hand_value")
+def bench_hand_value(ctx=None):
+    hands = [
+        ["A♠", "K♥"],
+        ["A♠", "A♥", "9♦"],
+        ["10♣", "6♦", "5♠"],
+        [("A", "♠"), ("7", "♥"), ("A", "♦"), ("2", "♣")],
+    ]
+
+    def run():
+        for h in hands:
+            calculate_hand_value(h)
+    return run
+
+
+@case("services.rng.shuffle")
+def bench_shuffle(ctx=None):
+    deck = blackjack.make_deck(shuffle=False)
+
+    def run():
+        rng.shuffle(deck)
+    return run
+
+
+# ---------------- Blackjack ----------------
+
+@case("games.blackjack.BlackjackState")
+def bench_bj_new(ctx=None):
+    def run():
+        blackjack.BlackjackState(100)
+    return run
+
+
+@case("games.blackjack.BlackjackState.to_json")
+def bench_bj_to_json(ctx=None):
+    st = blackjack.BlackjackState(100)
+
+    def run():
+        st.to_json()
+    return run
+
+
+@case("games.blackjack.BlackjackState.from_json")
+def bench_bj_from_json(ctx=None):
+    data = blackjack.BlackjackState(100).to_json()
+
+    def run():
+        blackjack.BlackjackState.from_json(data)
+    return run
+
+
+@case("games.blackjack.BlackjackState.evaluate")
+def bench_bj_evaluate(ctx=None):
+    st = blackjack.BlackjackState(100)
+    # Four split hands so every branch of evaluate() gets exercised.
+    st.state["player_hands"] = [["A♠", "K♥"], ["10♣", "9♦"], ["8♠", "8♥", "9♣"], ["5♦", "6♠"]]
+    st.state["bets"] = [100, 100, 100, 100]
+    st.state["doubled"] = [False] * 4
+    st.state["surrendered"] = [False, False, False, True]
+    st.state["dealer"] = ["10♠", "7♦"]
+
+    def run():
+        st.evaluate()
+    return run
+
+
+# ---------------- Roulette / Simple 21 ----------------
+
+@case("games.roulette.evaluate[200 bets]")
+def bench_roulette_evaluate(ctx=None):
+    state = roulette.base_state()
+    kinds = [
+        ("color", "red"), ("color", "black"), ("parity", "even"), ("parity", "odd"),
+        ("range", "low"), ("range", "high"), ("dozen", "1st12"), ("dozen", "2nd12"),
+        ("dozen", "3rd12"),
+    ]
+    for i in range(200):
+        if i % 4 == 0:
+            roulette.add_bet(state, "straight", str(i % 37), 5)
+        else:
+            t, v = kinds[i % len(kinds)]
+            roulette.add_bet(state, t, v, 10)
+    numbers = list(range(37))
+
+    def run():
+        for n in numbers:
+            roulette.evaluate(state, n)
+    return run
+
+
+@case("games.simple21.player_stand_logic")
+def bench_s21_stand(ctx=None):
+    base = simple21.new_round_state(100)
+    raw = json.dumps(base)
+
+    def run():
+        simple21.player_stand_logic(json.loads(raw))
+    return run
+
+
+# ---------------- Storage (temp file) ----------------
+
+POOL = 200
+
+
+class StorageContext:
+    """Temp-file Database (or MemoryStorage) plus a pool of pre-created users."""
+
+    def __init__(self, engine: str = "sqlite"):
+        self.tmpdir = tempfile.TemporaryDirectory(prefix="casinon-bench-")
+        self.path = os.path.join(self.tmpdir.name, "bench.db")
+        if engine == "memory":
+            self.db = MemoryStorage(starting_balance=10**12)
+        else:
+            self.db = Database(self.path, starting_balance=10**12)
+        self.counter = 0
+
+    async def setup(self):
+        await self.db.init()
+        for i in range(POOL):
+            await self.db.get_or_create_user(i + 1, f"user{i + 1}")
+
+    def next_id(self) -> int:
+        self.counter += 1
+        return (self.counter % POOL) + 1
+
+    async def close(self):
+        await self.db.close()
+        self.tmpdir.cleanup()
+
+
+@case("storage.Database.init", storage=True)
+def bench_db_init(ctx: StorageContext):
+    return ctx.db.init
+
+
+@case("storage.Database.get_or_create_user", storage=True)
+def bench_db_get_user(ctx: StorageContext):
+    async def run():
+        tg = ctx.next_id()
+        await ctx.db.get_or_create_user(tg, f"user{tg}")
+    return run
+
+
+@case("storage.Database.update_balance", storage=True)
+def bench_db_update_balance(ctx: StorageContext):
+    async def run():
+        await ctx.db.update_balance(ctx.next_id(), 1)
+    return run
+
+
+@case("storage.Database.record_bet", storage=True)
+def bench_db_record_bet(ctx: StorageContext):
+    async def run():
+        await ctx.db.record_bet(ctx.next_id(), "blackjack", 10, "win", 10)
+    return run
+
+
+@case("storage.Database.start_active_round+delete_active_round", storage=True)
+def bench_db_start_delete(ctx: StorageContext):
+    state = roulette.to_json(roulette.base_state())
+
+    async def run():
+        tg = ctx.next_id()
+        await ctx.db.start_active_round(tg, "roulette", 10, state)
+        await ctx.db.delete_active_round(tg)
+    return run
+
+
+@case("storage.Database.start_active_round+resolve_active_round", storage=True)
+def bench_db_start_resolve(ctx: StorageContext):
+    state = blackjack.BlackjackState(10).to_json()
+
+    async def run():
+        tg = ctx.next_id()
+        await ctx.db.start_active_round(tg, "blackjack", 10, state)
+        await ctx.db.resolve_active_round(tg, "win", 20)
+    return run
+
+
+@case("storage.Database.update_balance x32 concurrent", storage=True)
+def bench_db_update_balance_concurrent(ctx: StorageContext):
+    # 32 players at once: the writer commits them in a few batches
+    # instead of 32 transactions, so this should cost far less than 32x.
+    async def run():
+        await asyncio.gather(*(ctx.db.update_balance(ctx.next_id(), 1) for _ in range(32)))
+    return run
+
+
+class _RoundContext:
+    """Keeps one long-lived active round per pooled user."""
+
+    def __init__(self, ctx: StorageContext):
+        self.ctx = ctx
+        self.state = blackjack.BlackjackState(10).to_json()
+        self.ready = False
+
+    async def ensure(self):
+        if self.ready:
+            return
+        for i in range(POOL):
+            await self.ctx.db.start_active_round(i + 1, "blackjack", 10, self.state)
+        self.ready = True
+
+
+@case("storage.Database.adjust_active_round_bet", storage=True)
+def bench_db_adjust(ctx: StorageContext):
+    rounds = _RoundContext(ctx)
+
+    async def run():
+        await rounds.ensure()
+        await ctx.db.adjust_active_round_bet(ctx.next_id(), 1)
+    return run
+
+
+@case("storage.Database.get_active_round", storage=True)
+def bench_db_get_round(ctx: StorageContext):
+    rounds = _RoundContext(ctx)
+
+    async def run():
+        await rounds.ensure()
+        await ctx.db.get_active_round(ctx.next_id())
+    return run
+
+
+@case("storage.Database.update_active_round", storage=True)
+def bench_db_update_round(ctx: StorageContext):
+    rounds = _RoundContext(ctx)
+
+    async def run():
+        await rounds.ensure()
+        await ctx.db.update_active_round(ctx.next_id(), rounds.state)
+    return run
+
+
+# Same storage cases against the in-memory engine: the reference for pure
+# call overhead, so the SQLite numbers can be read as "cost of I/O".
+for _name, _spec in list(CASES.items()):
+    if _spec["storage"] and _name.startswith("storage.Database.") and _name != "storage.Database.init":
+        CASES[_name.replace("storage.Database.", "storage.MemoryStorage.")] = {**_spec, "storage": "memory"}
+
+
+def select(patterns: Optional[List[str]]) -> List[str]:
+    if not patterns:
+        return list(CASES)
+    return [name for name in CASES if any(p in name for p in patterns)]
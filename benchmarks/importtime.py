@@ -0,0 +1,143 @@
+"""
+Cold-start import budget check, based on `python -X importtime`.
+
+    python -m benchmarks.importtime                    # check all targets
+    python -m benchmarks.importtime bot --top 15       # one target, show offenders
+    python -m benchmarks.importtime --budget bot=120 --total-budget 1500
+
+Each target is imported in a fresh interpreter (best of --runs) without a
+bot token in the environment, which also proves it imports without
+settings. Three things are checked per target:
+
+- own time: self time of this project's modules (bot, config, storage,
+  services, middlewares, games, ui) must stay under the budget in ms.
+- total time, for targets that have a total budget (or all targets with
+  --total-budget): everything the import pulls in, third-party included.
+  For bot that is almost all aiogram (its types and methods are pydantic
+  models built at import, about 4-5 s on the reference container). That
+  cost is accepted: the Router and every handler filter are aiogram
+  objects, and processes that do not talk to Telegram import the storage
+  and services targets, which must not import aiogram at all. The bot
+  budget is there to catch a regression on top of it, not to push it down.
+- deferred modules: modules that must not be imported by the target
+  (game engines behind games.registry, aiogram below the bot layer).
+
+Exit status is 1 when any target is over budget or imports something it
+should defer.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+PROJECT_PACKAGES = ("bot", "config", "storage", "services", "middlewares", "games", "ui")
+
+# target module -> (own-time budget in ms, total budget in ms or None, module prefixes it must not import)
+TARGETS: Dict[str, Tuple[float, Optional[float], Tuple[str, ...]]] = {
+    "bot": (150, 7000, ("games.blackjack", "games.roulette", "games.simple21", "apscheduler")),
+    "storage.db": (60, None, ("aiogram", "apscheduler", "games.")),
+    "services.recovery": (60, None, ("aiogram", "games.blackjack", "games.roulette")),
+    "services.export": (40, None, ("aiogram",)),
+}
+
+# (module, self us, cumulative us, depth)
+Entry = Tuple[str, int, int, int]
+
+
+def measure(module: str) -> List[Entry]:
+    env = {k: v for k, v in os.environ.items() if k not in ("TELEGRAM_BOT_TOKEN", "BOT_TOKEN")}
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    entries: List[Entry] = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        raw = line.split(":", 1)[1].split("|")
+        name = raw[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(raw[0]), int(raw[1]), depth))
+    return entries
+
+
+def _children(entries: List[Entry], module: str) -> List[Entry]:
+    """Direct imports of `module` (importtime prints children before their parent)."""
+    idx = next((i for i, e in enumerate(entries) if e[0] == module and e[3] == 0), None)
+    out: List[Entry] = []
+    if idx is None:
+        return out
+    for e in reversed(entries[:idx]):
+        if e[3] == 0:
+            break
+        if e[3] == 1:
+            out.append(e)
+    return out
+
+
+def _is_project(name: str) -> bool:
+    return name.split(".", 1)[0] in PROJECT_PACKAGES
+
+
+def analyse(module: str, runs: int) -> Dict[str, object]:
+    best = None
+    for _ in range(max(1, runs)):
+        entries = measure(module)
+        total = next((cum for name, _s, cum, _d in entries if name == module), 0)
+        if best is None or total < best["total_us"]:
+            own = sum(s for name, s, _c, _d in entries if _is_project(name))
+            best = {"entries": entries, "total_us": total, "own_us": own}
+    return best
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Casinon cold-start import budget")
+    p.add_argument("targets", nargs="*", help=f"modules to check (default: {', '.join(TARGETS)})")
+    p.add_argument("--runs", type=int, default=3, help="fresh interpreters per target; best run counts")
+    p.add_argument("--budget", action="append", default=[], metavar="MOD=MS",
+                   help="override the own-time budget of a target")
+    p.add_argument("--total-budget", type=float,
+                   help="total-time budget in ms for every target (default: per target, bot only)")
+    p.add_argument("--top", type=int, default=5, help="show this many slowest direct imports")
+    args = p.parse_args(argv)
+
+    budgets = {name: spec[0] for name, spec in TARGETS.items()}
+    for item in args.budget:
+        name, _, ms = item.partition("=")
+        budgets[name] = float(ms)
+
+    failed = False
+    for module in args.targets or list(TARGETS):
+        res = analyse(module, args.runs)
+        own_ms = res["own_us"] / 1000
+        total_ms = res["total_us"] / 1000
+        budget = budgets.get(module)
+        total_budget = args.total_budget if args.total_budget is not None else TARGETS.get(module, (None, None))[1]
+        deferred = TARGETS.get(module, (None, None, ()))[2]
+        leaked = sorted({name for name, _s, _c, _d in res["entries"] if name.startswith(deferred)}) if deferred else []
+
+        over = budget is not None and own_ms > budget
+        over_total = total_budget is not None and total_ms > total_budget
+        status = "FAIL" if over or over_total or leaked else "ok"
+        failed |= status == "FAIL"
+        budget_txt = f"{budget:.0f}" if budget is not None else "-"
+        total_txt = f"{total_budget:.0f}" if total_budget is not None else "-"
+        print(f"{module:<20} own {own_ms:8.1f} ms (budget {budget_txt:>4})   "
+              f"total {total_ms:8.1f} ms (budget {total_txt:>5})   {status}")
+        for name in leaked:
+            print(f"    imports deferred module: {name}")
+        if args.top:
+            for name, _s, cum, _d in sorted(_children(res["entries"], module), key=lambda e: -e[2])[: args.top]:
+                print(f"    {cum / 1000:8.1f} ms  {name}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
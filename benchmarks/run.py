@@ -0,0 +1,155 @@
+"""
+Standalone microbenchmark runner.
+
+    python -m benchmarks.run                          # run everything, print table
+    python -m benchmarks.run -k roulette -k storage   # filter by substring
+    python -m benchmarks.run --out bench.json         # save results
+    python -m benchmarks.run --baseline bench.json    # compare, exit 1 on regression
+
+Each case is auto-calibrated to ~--min-time seconds per repeat; the reported
+figure is the median time per call over --repeat repeats. A case regresses
+when its median exceeds the baseline median by more than --threshold
+(relative, default 0.25 = 25%).
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.cases import CASES, StorageContext, select  # noqa: E402
+
+
+async def _call(fn: Callable, is_async: bool):
+    if is_async:
+        await fn()
+    else:
+        fn()
+
+
+async def _time_loop(fn: Callable, is_async: bool, number: int) -> float:
+    perf = time.perf_counter
+    if is_async:
+        start = perf()
+        for _ in range(number):
+            await fn()
+        return perf() - start
+    start = perf()
+    for _ in range(number):
+        fn()
+    return perf() - start
+
+
+async def measure(fn: Callable, repeat: int, min_time: float) -> Dict[str, Any]:
+    is_async = inspect.iscoroutinefunction(fn)
+    await _call(fn, is_async)  # warmup (also triggers lazy setup in cases)
+
+    number = 1
+    while True:
+        elapsed = await _time_loop(fn, is_async, number)
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+
+    samples = [await _time_loop(fn, is_async, number) / number for _ in range(repeat)]
+    return {
+        "number": number,
+        "repeat": repeat,
+        "median_s": statistics.median(samples),
+        "min_s": min(samples),
+        "max_s": max(samples),
+    }
+
+
+async def run_cases(names: List[str], repeat: int, min_time: float) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    for name in names:
+        spec = CASES[name]
+        ctx = None
+        try:
+            if spec["storage"]:
+                ctx = StorageContext("memory" if spec["storage"] == "memory" else "sqlite")
+                await ctx.setup()
+            fn = spec["factory"](ctx)
+            results[name] = await measure(fn, repeat, min_time)
+        finally:
+            if ctx:
+                await ctx.close()
+        print(f"  {name:<62} {_fmt(results[name]['median_s'])}", flush=True)
+    return results
+
+
+def compare(current: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float) -> List[str]:
+    regressions = []
+    print("\nComparison vs baseline:")
+    for name, res in current.items():
+        base = baseline.get(name)
+        if not base:
+            print(f"  {name:<62} (new)")
+            continue
+        ratio = res["median_s"] / base["median_s"] if base["median_s"] else 1.0
+        mark = ""
+        if ratio > 1 + threshold:
+            mark = "  REGRESSION"
+            regressions.append(name)
+        print(f"  {name:<62} {_fmt(base['median_s'])} -> {_fmt(res['median_s'])}  x{ratio:.2f}{mark}")
+    return regressions
+
+
+def _fmt(seconds: float) -> str:
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:9.3f} ms"
+    if seconds >= 1e-6:
+        return f"{seconds * 1e6:9.3f} µs"
+    return f"{seconds * 1e9:9.1f} ns"
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Casinon microbenchmarks")
+    p.add_argument("-k", dest="patterns", action="append", help="only run cases containing this substring")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--min-time", type=float, default=0.05, help="seconds per repeat (calibration target)")
+    p.add_argument("--out", help="write JSON results here")
+    p.add_argument("--baseline", help="JSON results to compare against")
+    p.add_argument("--threshold", type=float, default=0.25, help="allowed relative slowdown before failing")
+    p.add_argument("--list", action="store_true", help="list cases and exit")
+    args = p.parse_args(argv)
+
+    names = select(args.patterns)
+    if args.list:
+        print("\n".join(names))
+        return 0
+
+    print(f"Running {len(names)} benchmark(s)...")
+    results = asyncio.run(run_cases(names, args.repeat, args.min_time))
+
+    if args.out:
+        payload = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "results": results,
+        }
+        Path(args.out).write_text(json.dumps(payload, indent=2))
+        print(f"\nSaved results to {args.out}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) above {args.threshold:.0%}")
+            return 1
+        print("\n✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
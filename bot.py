@@ -3,51 +3,93 @@
 # - all cb.message.edit_text(...) replaced by await safe_edit(...)
 # Nothing else altered intentionally.
 
+from __future__ import annotations
+
 import asyncio
+import csv
+import datetime
+import io
 import json
+import logging
+import os
 import random
-from typing import Set
+import tempfile
+from dataclasses import dataclass
+from typing import Optional
 
-import aiosqlite
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.filters import Command
 from aiogram.types import (
     CallbackQuery,
+    FSInputFile,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     Message,
 )
 from aiogram.exceptions import TelegramBadRequest
 
-from config import get_settings
-from storage.db import Database
-from games import blackjack
-from games import roulette
-
-settings = get_settings()
-db = Database(settings.db_path, starting_balance=settings.starting_balance)
-router = Router()
+from config import Settings, get_settings
+from storage.base import Storage
+from storage.db import Database, ALL_GAMES
+from storage.sharded import ShardedStorage
+from services.balance_cache import BalanceCache
+from services.leaderboard import Leaderboard
+from services.user_directory import UserDirectory
+from services import clock, export
+from services.recovery import recover_rounds, reap_stale_rounds
+from services.scheduler import Scheduler
+from services.lifecycle import Lifecycle
+from middlewares import idempotency as idem
+from middlewares.idempotency import ActionTracker, CallbackDedupMiddleware, UpdateDedupMiddleware
+from middlewares.drain import DrainMiddleware
+from middlewares.throttling import RateLimiter, ThrottlingMiddleware, parse_limits
+from games import registry, strategy
+
+blackjack = registry.lazy("blackjack")
+roulette = registry.lazy("roulette")
+
+# Handlers are collected here and registered on a fresh Router by
+# create_app(), so every app gets its own. What they need besides the event
+# (settings, db, leaderboard, directory, balances, actions) is injected by
+# name from the dispatcher's workflow data.
+_HANDLERS: list = []
+
+def on_message(*filters):
+    def register(handler):
+        _HANDLERS.append(("message", handler, filters))
+        return handler
+    return register
+
+def on_callback(*filters):
+    def register(handler):
+        _HANDLERS.append(("callback_query", handler, filters))
+        return handler
+    return register
+
+def build_router() -> Router:
+    router = Router()
+    for observer, handler, filters in _HANDLERS:
+        getattr(router, observer).register(handler, *filters)
+    return router
 
 # =========================================================
 # admin kostil
 # =========================================================
 
-import aiosqlite  # if not already
-
 ADMIN_IDS = {945409731}  # your Telegram numeric ID(s)
 
 def is_admin(tg_id: int) -> bool:
     return tg_id in ADMIN_IDS
 
-@router.message(Command("me"))
+@on_message(Command("me"))
 async def cmd_me(msg: Message):
     await msg.reply(f"Your Telegram ID: {msg.from_user.id}")
 
 # /give <tg_id|@username> <amount>
-@router.message(Command("give"))
-async def cmd_give(msg: Message):
+@on_message(Command("give"))
+async def cmd_give(msg: Message, db: Storage, directory: UserDirectory, balances: BalanceCache):
     if not is_admin(msg.from_user.id):
         return await msg.reply("❌ Not authorized.")
     parts = msg.text.split()
@@ -57,15 +99,15 @@ async def cmd_give(msg: Message):
     if not amt_str.isdigit(): return await msg.reply("Amount must be integer.")
     amount = int(amt_str)
     if amount <= 0: return await msg.reply("Amount must be > 0.")
-    tg_id, username = await _get_user_id_and_username(target)
-    if tg_id is None: return await msg.reply("User not found.")
-    await db.get_or_create_user(tg_id, username)
-    new_balance = await db.update_balance(tg_id, amount)
+    urow = await directory.resolve(target, create=True)
+    if urow is None: return await msg.reply("User not found.")
+    new_balance = await db.update_balance(urow["tg_id"], amount, kind="admin", ref=msg.from_user.id)
+    balances.invalidate(urow["tg_id"])
     await msg.reply(f"✅ Added {amount}. New balance: {new_balance}")
 
 # /setbal <tg_id|@username> <amount>
-@router.message(Command("setbal"))
-async def cmd_setbal(msg: Message):
+@on_message(Command("setbal"))
+async def cmd_setbal(msg: Message, db: Storage, directory: UserDirectory, balances: BalanceCache):
     if not is_admin(msg.from_user.id):
         return await msg.reply("❌ Not authorized.")
     parts = msg.text.split()
@@ -75,85 +117,255 @@ async def cmd_setbal(msg: Message):
     if not amt_str.isdigit(): return await msg.reply("Amount must be integer.")
     amount = int(amt_str)
     if amount < 0: return await msg.reply("Amount must be >= 0.")
-    tg_id, username = await _get_user_id_and_username(target)
-    if tg_id is None: return await msg.reply("User not found.")
-    await db.get_or_create_user(tg_id, username)
-    # Get current
-    import aiosqlite
-    async with aiosqlite.connect(db.path) as conn:
-        conn.row_factory = aiosqlite.Row
-        cur = await conn.execute("SELECT balance FROM users WHERE tg_id = ?", (tg_id,))
-        row = await cur.fetchone()
-        cur_bal = row["balance"] if row else 0
-    delta = amount - cur_bal
-    await db.update_balance(tg_id, delta)
-    await msg.reply(f"✅ Set balance to {amount} (delta {delta:+}).")
+    urow = await directory.resolve(target, create=True)
+    if urow is None: return await msg.reply("User not found.")
+    old_balance = await db.set_balance(urow["tg_id"], amount, ref=msg.from_user.id)
+    balances.invalidate(urow["tg_id"])
+    if old_balance is None: return await msg.reply("User not found.")
+    await msg.reply(f"✅ Set balance to {amount} (delta {amount - old_balance:+}).")
+
+# /givebulk and /setbulk: one "<tg_id|@username> <amount>" per line or ';'
+# separated (CSV "target,amount" rows work too), either inline after the
+# command or as an attached CSV document with the command in the caption.
+BULK_MAX_ERRORS_SHOWN = 10
+
+def _parse_bulk(text: str):
+    """-> ([(target, amount)], [error lines])"""
+    items, errors = [], []
+    for n, row in enumerate(csv.reader(io.StringIO(text.replace(";", "\n"))), start=1):
+        cells = [c.strip() for c in row if c.strip()]
+        if len(cells) == 1 and " " in cells[0]:
+            cells = cells[0].split()
+        if not cells:
+            continue
+        if len(cells) != 2:
+            errors.append(f"line {n}: expected <target> <amount>")
+            continue
+        target, amt = cells
+        if not (amt.lstrip("-").isdigit()):
+            if n == 1:
+                continue  # CSV header
+            errors.append(f"line {n}: bad amount {amt!r}")
+            continue
+        if not (target.isdigit() or (target.startswith("@") and len(target) > 1)):
+            errors.append(f"line {n}: bad target {target!r}")
+            continue
+        items.append((target, int(amt)))
+    return items, errors
+
+async def _bulk_balances(db: Storage, balances: BalanceCache, msg: Message, mode: str):
+    if not is_admin(msg.from_user.id):
+        return await msg.reply("❌ Not authorized.")
+    if msg.document:
+        buf = await msg.bot.download(msg.document)
+        text = buf.read().decode("utf-8-sig", errors="replace")
+    else:
+        text = (msg.text or "").partition(" ")[2]
+    items, errors = _parse_bulk(text)
+    if mode == "give":
+        errors += [f"{t}: amount must be > 0" for t, a in items if a <= 0]
+        items = [(t, a) for t, a in items if a > 0]
+    else:
+        errors += [f"{t}: amount must be >= 0" for t, a in items if a < 0]
+        items = [(t, a) for t, a in items if a >= 0]
+    names = [t[1:] for t, _ in items if t.startswith("@")]
+    known = await db.resolve_usernames(names) if names else {}
+    resolved = []
+    for t, a in items:
+        if t.startswith("@"):
+            tg_id = known.get(t[1:].lower())
+            if tg_id is None:
+                errors.append(f"{t}: user not found")
+                continue
+            resolved.append((tg_id, a))
+        else:
+            resolved.append((int(t), a))
+    if not resolved:
+        return await msg.reply("Nothing to apply.\n" + "\n".join(errors[:BULK_MAX_ERRORS_SHOWN]))
+    res = await db.apply_admin_balances(msg.from_user.id, resolved, mode)
+    for tg_id, _ in resolved:
+        balances.invalidate(tg_id)
+    lines = [
+        f"✅ {'Credited' if mode == 'give' else 'Set'} {res['changes']} entries for {res['users']} users "
+        f"({res['created']} new accounts). Net change: {res['total_delta']:+}."
+    ]
+    if errors:
+        lines.append(f"⚠️ Skipped {len(errors)}:")
+        lines += errors[:BULK_MAX_ERRORS_SHOWN]
+        if len(errors) > BULK_MAX_ERRORS_SHOWN:
+            lines.append("…")
+    await msg.reply("\n".join(lines))
+
+@on_message(Command("givebulk"))
+async def cmd_givebulk(msg: Message, db: Storage, balances: BalanceCache):
+    await _bulk_balances(db, balances, msg, "give")
+
+@on_message(Command("setbulk"))
+async def cmd_setbulk(msg: Message, db: Storage, balances: BalanceCache):
+    await _bulk_balances(db, balances, msg, "set")
+
+# /recover — run the orphaned-round sweep now
+RECOVERY_GRACE_S = 30
+
+@on_message(Command("recover"))
+async def cmd_recover(msg: Message, settings: Settings, db: Storage):
+    if not is_admin(msg.from_user.id):
+        return await msg.reply("❌ Not authorized.")
+    c = await recover_rounds(db, settings.round_ttl_minutes * 60, grace_s=RECOVERY_GRACE_S)
+    await msg.reply(
+        f"🧹 Scanned {c['scanned']} rounds: settled {c['settled']}, refunded {c['refunded']}, kept {c['kept']}."
+    )
 
 # /user <tg_id|@username>
-@router.message(Command("user"))
-async def cmd_user(msg: Message):
+@on_message(Command("user"))
+async def cmd_user(msg: Message, db: Storage, directory: UserDirectory):
     if not is_admin(msg.from_user.id):
         return await msg.reply("❌ Not authorized.")
     parts = msg.text.split()
     if len(parts) != 2:
         return await msg.reply("Usage: /user <tg_id|@username>")
     target = parts[1]
-    tg_id, username = await _get_user_id_and_username(target)
-    if tg_id is None: return await msg.reply("User not found.")
-    urow = await db.get_or_create_user(tg_id, username)
-    active = await db.get_active_round(tg_id)
-    import aiosqlite
-    async with aiosqlite.connect(db.path) as conn:
-        conn.row_factory = aiosqlite.Row
-        cur = await conn.execute("""
-            SELECT game, amount, result, delta, created_at
-            FROM bets b
-            JOIN users u ON u.id = b.user_id
-            WHERE u.tg_id = ?
-            ORDER BY b.id DESC LIMIT 5
-        """, (tg_id,))
-        bets = await cur.fetchall()
+    urow = await directory.resolve(target)
+    if urow is None: return await msg.reply("User not found.")
+    tg_id = urow["tg_id"]
+    rounds = [r for r in [await db.get_active_round(tg_id, g) for g in registry.GAMES] if r]
+    bets = await db.recent_bets(tg_id, 5)
     bet_lines = [f"{b['game']} amt={b['amount']} res={b['result']} Δ={b['delta']}" for b in bets] or ["(no bets)"]
+    active_line = "Active: " + (", ".join(f"{r['game']} bet={r['bet']}" for r in rounds) or "None")
     await msg.reply(
         f"👤 {tg_id} ({urow.get('username')})\n"
-        f"Balance: {urow['balance']}\n"
-        f"Active: {active['game']} bet={active['bet']}" if active else "Active: None" + "\n"
+        f"Balance: {urow['balance']} (held {urow['held']}, available {urow['available']})\n"
+        f"{active_line}\n"
         f"Recent:\n" + "\n".join(bet_lines)
     )
 
-# /top (optional limit)
-@router.message(Command("top"))
-async def cmd_top(msg: Message):
+# /archive [retention_days]
+@on_message(Command("archive"))
+async def cmd_archive(msg: Message, settings: Settings, db: Storage):
     if not is_admin(msg.from_user.id):
         return await msg.reply("❌ Not authorized.")
     parts = msg.text.split()
+    days = settings.bet_retention_days
+    if len(parts) > 1:
+        if not parts[1].isdigit():
+            return await msg.reply("Usage: /archive [retention_days]")
+        days = int(parts[1])
+    moved = await db.archive_bets(days)
+    await msg.reply(f"🗄 Archived {moved} bets older than {days} days.")
+
+# /top [day|week] [game] [limit]
+@on_message(Command("top"))
+async def cmd_top(msg: Message, db: Storage, leaderboard: Leaderboard):
+    if not is_admin(msg.from_user.id):
+        return await msg.reply("❌ Not authorized.")
+    parts = msg.text.split()[1:]
     limit = 10
-    if len(parts) > 1 and parts[1].isdigit():
-        limit = min(50, max(1, int(parts[1])))
-    import aiosqlite
-    async with aiosqlite.connect(db.path) as conn:
-        conn.row_factory = aiosqlite.Row
-        cur = await conn.execute("SELECT tg_id, username, balance FROM users ORDER BY balance DESC LIMIT ?", (limit,))
-        rows = await cur.fetchall()
-    lines = [f"{i+1}. {r['username'] or r['tg_id']}: {r['balance']}" for i, r in enumerate(rows)]
-    await msg.reply("🏆 Top Balances\n" + "\n".join(lines))
-
-async def _get_user_id_and_username(identifier: str):
-    identifier = identifier.strip()
-    import aiosqlite
-    async with aiosqlite.connect(db.path) as conn:
-        conn.row_factory = aiosqlite.Row
-        if identifier.startswith("@"):
-            uname = identifier[1:]
-            cur = await conn.execute("SELECT tg_id, username FROM users WHERE username = ?", (uname,))
-            row = await cur.fetchone()
-            return (row["tg_id"], row["username"]) if row else (None, None)
-        if identifier.isdigit():
-            tg_id = int(identifier)
-            cur = await conn.execute("SELECT tg_id, username FROM users WHERE tg_id = ?", (tg_id,))
-            row = await cur.fetchone()
-            return (tg_id, row["username"] if row else None)
-    return (None, None)
+    period = None
+    game = ALL_GAMES
+    for p in parts:
+        if p.isdigit():
+            limit = min(50, max(1, int(p)))
+        elif p in ("day", "today"):
+            period = "day"
+        elif p == "week":
+            period = "week"
+        else:
+            game = p
+    if period is None:
+        rows = await leaderboard.get(db, limit)
+        lines = [f"{i+1}. {name or tg}: {bal}" for i, (tg, bal, name) in enumerate(rows)]
+        return await msg.reply("🏆 Top Balances\n" + ("\n".join(lines) or "(empty)"))
+    rows = await db.top_net(period, game, limit)
+    title = "today" if period == "day" else "this week"
+    scope = "all games" if game == ALL_GAMES else game
+    lines = [f"{i+1}. {r['username'] or r['tg_id']}: {r['net']:+} ({r['rounds']} rounds)" for i, r in enumerate(rows)]
+    await msg.reply(f"🏆 Top Net Winnings — {title}, {scope}\n" + ("\n".join(lines) or "(no rounds)"))
+
+# /stats [game] [window]   window: 1h, 24h, 7d, 30d, all (default 24h)
+STATS_WINDOWS = {"h": 3_600_000, "d": 86_400_000}
+
+def _parse_window(token: str):
+    """'24h' -> milliseconds, 'all' -> None. Raises ValueError on junk."""
+    if token == "all":
+        return None
+    unit = token[-1:]
+    if unit not in STATS_WINDOWS or not token[:-1].isdigit():
+        raise ValueError(token)
+    return int(token[:-1]) * STATS_WINDOWS[unit]
+
+@on_message(Command("stats"))
+async def cmd_stats(msg: Message, db: Storage):
+    if not is_admin(msg.from_user.id):
+        return await msg.reply("❌ Not authorized.")
+    game = None
+    window = "24h"
+    for p in msg.text.split()[1:]:
+        if p == "all" or p[:-1].isdigit():
+            window = p
+        else:
+            game = p
+    try:
+        span_ms = _parse_window(window)
+    except ValueError:
+        return await msg.reply("Usage: /stats [game] [1h|24h|7d|30d|all]")
+    since = None if span_ms is None else clock.now_ms() - span_ms
+    per_game = await db.game_stats(since, game)
+    if not per_game:
+        return await msg.reply(f"📊 No settled rounds ({window}).")
+    lines = [f"📊 Stats — {game or 'all games'}, {window}"]
+    for g, r in per_game.items():
+        rtp = 100.0 * r["paid"] / r["wagered"] if r["wagered"] else 0.0
+        lines.append(
+            f"\n<b>{g}</b>: {r['rounds']} rounds\n"
+            f"Wagered {r['wagered']} · Paid {r['paid']} · Net {r['net']:+}\n"
+            f"RTP {rtp:.2f}% · W/L/P {r['wins']}/{r['losses']}/{r['pushes']}"
+        )
+    await msg.reply("\n".join(lines), parse_mode=ParseMode.HTML)
+
+# /export [tg_id|@username|all] [from YYYY-MM-DD] [to YYYY-MM-DD] [csv|jsonl]
+EXPORT_MAX_BYTES = 50 * 1024 * 1024  # Telegram bot upload limit
+
+def _is_iso_date(text: str) -> bool:
+    try:
+        datetime.date.fromisoformat(text)
+    except ValueError:
+        return False
+    return True
+
+@on_message(Command("export"))
+async def cmd_export(msg: Message, db: Storage, directory: UserDirectory):
+    if not is_admin(msg.from_user.id):
+        return await msg.reply("❌ Not authorized.")
+    usage = "Usage: /export [tg_id|@username|all] [from YYYY-MM-DD] [to YYYY-MM-DD] [csv|jsonl]"
+    args = msg.text.split()[1:]
+    fmt = "csv"
+    if args and args[-1] in export.FORMATS:
+        fmt = args.pop()
+    target = args.pop(0) if args and not _is_iso_date(args[0]) else "all"
+    try:
+        dates = [datetime.date.fromisoformat(a) for a in args[:2]]
+    except ValueError:
+        return await msg.reply(usage)
+    since = dates[0].isoformat() if dates else None
+    until = (dates[1] + datetime.timedelta(days=1)).isoformat() if len(dates) > 1 else None
+    since_ms = clock.iso_to_ms(since) if since else None
+    until_ms = clock.iso_to_ms(until) if until else None
+    tg_id = None
+    if target != "all":
+        urow = await directory.resolve(target)
+        if urow is None:
+            return await msg.reply("User not found.")
+        tg_id = urow["tg_id"]
+    fd, path = tempfile.mkstemp(prefix="casinon-export-", suffix=f".{fmt}.gz")
+    os.close(fd)
+    try:
+        count = await export.export_bets(db, path, fmt, tg_id, since_ms, until_ms)
+        if os.path.getsize(path) > EXPORT_MAX_BYTES:
+            return await msg.reply(f"⚠️ Export has {count} rows but is too large to send; narrow the date range.")
+        name = f"bets-{target.lstrip('@')}-{since or 'start'}-{args[1] if len(args) > 1 else 'now'}.{fmt}.gz"
+        await msg.answer_document(FSInputFile(path, filename=name), caption=f"📤 {count} bets")
+    finally:
+        os.remove(path)
 
 # ---------- safe_edit helper (prevents 'message is not modified') ----------
 async def safe_edit(message, text: str, **kwargs):
@@ -204,56 +416,68 @@ def build_main_menu_text(balance: int) -> str:
         "🎰 <b>Casinon</b>\n"
         f"💰 <b>Balance:</b> {balance} credits\n\n"
         "🃏 <b>Blackjack</b>\n"
-        "Get cards totaling 21 or less, beat dealer’s hand. Split / Double / Surrender available.\n\n"
+        "Get cards totaling 21 or less, beat dealer’s hand. Split / Double / Surrender available, 💡 Hint suggests the basic-strategy play.\n\n"
         "🎡 <b>Roulette</b>\n"
         "Bet on numbers, colors, ranges, dozens — then spin the wheel.\n\n"
         "<b>Commands</b>:\n"
         "/balance – view balance\n"
+        "/bonus – claim daily bonus\n"
         "/cancel – cancel active round (refund)\n"
         "/forcecancel – force remove round (no refund)\n\n"
         "Select a game:"
     )
 
-@router.message(Command("start"))
-async def cmd_start(msg: Message):
-    user = await db.get_or_create_user(msg.from_user.id, msg.from_user.username)
-    await msg.answer(build_main_menu_text(user['balance']), reply_markup=main_menu_kb(), parse_mode=ParseMode.HTML)
-
-@router.message(Command("balance"))
-async def cmd_balance(msg: Message):
-    user = await db.get_or_create_user(msg.from_user.id, msg.from_user.username)
-    await msg.answer(f"💰 Balance: {user['balance']} credits", reply_markup=back_menu_kb())
+@on_message(Command("start"))
+async def cmd_start(msg: Message, balances: BalanceCache):
+    user = await balances.get_user(msg.from_user.id, msg.from_user.username)
+    await msg.answer(build_main_menu_text(user['available']), reply_markup=main_menu_kb(), parse_mode=ParseMode.HTML)
+
+@on_message(Command("balance"))
+async def cmd_balance(msg: Message, balances: BalanceCache):
+    user = await balances.get_user(msg.from_user.id, msg.from_user.username)
+    await msg.answer(f"💰 Balance: {user['available']} credits", reply_markup=back_menu_kb())
+
+@on_message(Command("bonus"))
+async def cmd_bonus(msg: Message, settings: Settings, db: Storage):
+    res = await db.claim_bonus(msg.from_user.id, settings.daily_bonus_amount, settings.daily_bonus_cooldown_hours)
+    if res["balance"] is None:
+        await db.get_or_create_user(msg.from_user.id, msg.from_user.username)
+        res = await db.claim_bonus(msg.from_user.id, settings.daily_bonus_amount, settings.daily_bonus_cooldown_hours)
+    if res["ok"]:
+        return await msg.answer(
+            f"🎁 Daily bonus: +{settings.daily_bonus_amount} credits!\n💰 Balance: {res['balance']} credits",
+            reply_markup=back_menu_kb()
+        )
+    wait_min = max(1, (res["next_at"] - clock.now_ms()) // 60_000)
+    await msg.answer(
+        f"⏳ Bonus already claimed. Next one in {wait_min // 60}h {wait_min % 60}m.\n"
+        f"💰 Balance: {res['balance']} credits",
+        reply_markup=back_menu_kb()
+    )
 
-@router.callback_query(F.data == "nav:menu")
-async def nav_menu(cb: CallbackQuery):
-    user = await db.get_or_create_user(cb.from_user.id, cb.from_user.username)
-    await safe_edit(cb.message, build_main_menu_text(user['balance']), reply_markup=main_menu_kb(), parse_mode=ParseMode.HTML)
+@on_callback(F.data == "nav:menu")
+async def nav_menu(cb: CallbackQuery, balances: BalanceCache):
+    user = await balances.get_user(cb.from_user.id, cb.from_user.username)
+    await safe_edit(cb.message, build_main_menu_text(user['available']), reply_markup=main_menu_kb(), parse_mode=ParseMode.HTML)
     await cb.answer()
 
 # Cancel utilities
-async def _cancel_active_round(tg_id: int, refund: bool = True) -> bool:
-    active = await db.get_active_round(tg_id)
-    if not active:
-        return False
-    bet = active["bet"]
-    await db.delete_active_round(tg_id)
-    if refund and bet:
-        await db.update_balance(tg_id, bet)
-    return True
-
-@router.message(Command("cancel"))
-async def cmd_cancel(msg: Message):
-    if await _cancel_active_round(msg.from_user.id, refund=True):
-        user = await db.get_or_create_user(msg.from_user.id, msg.from_user.username)
-        await msg.answer(f"✅ Round canceled. Refunded. Balance: {user['balance']}")
+async def _cancel_active_round(db: Storage, tg_id: int, refund: bool = True) -> bool:
+    return await db.cancel_active_round(tg_id, refund) is not None
+
+@on_message(Command("cancel"))
+async def cmd_cancel(msg: Message, db: Storage, balances: BalanceCache):
+    if await _cancel_active_round(db, msg.from_user.id, refund=True):
+        user = await balances.get_user(msg.from_user.id, msg.from_user.username)
+        await msg.answer(f"✅ Round canceled. Refunded. Balance: {user['available']}")
     else:
         await msg.answer("ℹ️ No active round.")
 
-@router.message(Command("forcecancel"))
-async def cmd_forcecancel(msg: Message):
-    if await _cancel_active_round(msg.from_user.id, refund=False):
-        user = await db.get_or_create_user(msg.from_user.id, msg.from_user.username)
-        await msg.answer(f"🛑 Force-canceled. Balance: {user['balance']}")
+@on_message(Command("forcecancel"))
+async def cmd_forcecancel(msg: Message, db: Storage, balances: BalanceCache):
+    if await _cancel_active_round(db, msg.from_user.id, refund=False):
+        user = await balances.get_user(msg.from_user.id, msg.from_user.username)
+        await msg.answer(f"🛑 Force-canceled. Balance: {user['available']}")
     else:
         await msg.answer("ℹ️ No active round.")
 
@@ -289,35 +513,43 @@ def bj_bet_builder_kb(current: int, balance: int, min_bet: int, max_bet: int) ->
     row5 = [InlineKeyboardButton(text="⬅️ Menu", callback_data="nav:menu")]
     return InlineKeyboardMarkup(inline_keyboard=[row1, row2, row3, row4, row5])
 
-async def _bj_show_bet_builder(cb: CallbackQuery, current: int = None):
-    user = await db.get_or_create_user(cb.from_user.id, cb.from_user.username)
+async def _bj_show_bet_builder(settings: Settings, balances: BalanceCache, cb: CallbackQuery, current: int = None):
+    user = await balances.get_user(cb.from_user.id, cb.from_user.username)
     if current is None:
         current = settings.min_bet
-    current = min(current, user["balance"], settings.max_bet)
+    current = min(current, user["available"], settings.max_bet)
     await safe_edit(
         cb.message,
         "🃏 <b>Blackjack Bet Setup</b>\n"
-        f"💰 Balance: {user['balance']} credits\n"
+        f"💰 Balance: {user['available']} credits\n"
         f"🎯 Current Bet: {current}\n\n"
         "Add chips or adjust, then Confirm to start.",
-        reply_markup=bj_bet_builder_kb(current, user["balance"], settings.min_bet, settings.max_bet),
+        reply_markup=bj_bet_builder_kb(current, user["available"], settings.min_bet, settings.max_bet),
         parse_mode=ParseMode.HTML
     )
 
-def build_blackjack_actions_kb(can_double: bool, can_split: bool) -> InlineKeyboardMarkup:
+def build_blackjack_actions_kb(can_double: bool, can_split: bool, tag: str = "", hint: str = "") -> InlineKeyboardMarkup:
     row = [
-        InlineKeyboardButton(text="🃏 Hit", callback_data="blackjack:hit"),
-        InlineKeyboardButton(text="🛑 Stand", callback_data="blackjack:stand"),
+        InlineKeyboardButton(text="🃏 Hit", callback_data=f"blackjack:hit{tag}"),
+        InlineKeyboardButton(text="🛑 Stand", callback_data=f"blackjack:stand{tag}"),
     ]
     if can_double:
-        row.append(InlineKeyboardButton(text="💰 Double", callback_data="blackjack:double"))
+        row.append(InlineKeyboardButton(text="💰 Double", callback_data=f"blackjack:double{tag}"))
     rows = [row]
     if can_split:
-        rows.append([InlineKeyboardButton(text="🔀 Split", callback_data="blackjack:split")])
-    rows.append([InlineKeyboardButton(text="⚠️ Surrender", callback_data="blackjack:surrender")])
+        rows.append([InlineKeyboardButton(text="🔀 Split", callback_data=f"blackjack:split{tag}")])
+    rows.append([InlineKeyboardButton(text="⚠️ Surrender", callback_data=f"blackjack:surrender{tag}")])
+    if hint:
+        # Read-only: carries the games.strategy key instead of an action tag.
+        rows[-1].append(InlineKeyboardButton(text="💡 Hint", callback_data=f"blackjack:hint:{hint}"))
     rows.append([InlineKeyboardButton(text="⬅️ Menu", callback_data="nav:menu")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
+def _bj_actions_kb(state_obj: blackjack.BlackjackState) -> InlineKeyboardMarkup:
+    can_double, can_split = state_obj.can_double(), state_obj.can_split()
+    hint = strategy.situation(state_obj.current_hand(), state_obj.state["dealer_visible"][0], can_double, can_split)
+    return build_blackjack_actions_kb(can_double, can_split, idem.tag(state_obj.state), hint)
+
 def build_blackjack_result_kb(original_bet: int, balance: int) -> InlineKeyboardMarkup:
     rows = []
     if original_bet <= balance:
@@ -326,17 +558,23 @@ def build_blackjack_result_kb(original_bet: int, balance: int) -> InlineKeyboard
     rows.append([InlineKeyboardButton(text="📋 Menu", callback_data="nav:menu")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
-def _overall_flag(flags: Set[str]) -> str:
-    if "win" in flags and "loss" not in flags:
-        return "win"
-    if "loss" in flags and "win" not in flags:
-        return "loss"
-    if flags == {"push"}:
-        return "push"
-    return "mixed"
-
-async def _save_bj_state(user_id: int, state_obj: blackjack.BlackjackState):
-    await db.update_active_round(user_id, state_obj.to_json())
+# Round saves are compare-and-swap on active_rounds.version. Blackjack moves
+# don't commute, so a save that lost the race is refused like an outdated
+# button; roulette chip/bet edits merge and are re-applied to the fresh state.
+ROUND_SAVE_RETRIES = 3
+
+async def _save_bj_state(db: Storage, user_id: int, state_obj: blackjack.BlackjackState, stake: int = 0) -> dict:
+    res = await db.save_active_round(user_id, state_obj.to_json(), state_obj.version, stake, game="blackjack")
+    if res["ok"]:
+        state_obj.version = res["version"]
+    return res
+
+async def _bj_refused(actions: ActionTracker, cb: CallbackQuery, state_obj: blackjack.BlackjackState, res: dict):
+    if res["reason"] == "funds":
+        # Nothing was saved, so the keyboard on screen is still current.
+        actions.unbump(cb.from_user.id, state_obj.state)
+        return await cb.answer("Balance low.", show_alert=True)
+    return await cb.answer("This button is outdated.")
 
 def _decorate_hand_line(idx: int, hand: list[str], state=None) -> str:
     from games.blackjack import calculate_hand_value
@@ -350,29 +588,29 @@ def _decorate_hand_line(idx: int, hand: list[str], state=None) -> str:
     flag_txt = " " + "".join(flags) if flags else ""
     return f"Hand {idx+1}:{flag_txt} {' '.join(hand)} (total {total}, bet {state['bets'][idx]})"
 
-async def _resolve_bj(cb: CallbackQuery, state_obj: blackjack.BlackjackState):
+async def _resolve_bj(db: Storage, balances: BalanceCache, cb: CallbackQuery, state_obj: blackjack.BlackjackState):
     eval_res = state_obj.evaluate()
     total_payout = sum(p for (_t, p, _m) in eval_res["results"])
-    flags = {t for (t, _p, _m) in eval_res["results"]}
-    overall = _overall_flag(flags)
-    await db.resolve_active_round(cb.from_user.id, overall, total_payout)
-    user = await db.get_or_create_user(cb.from_user.id, cb.from_user.username)
+    overall = blackjack.overall_flag(eval_res["results"])
+    await db.resolve_active_round(cb.from_user.id, overall, total_payout, game="blackjack")
+    user = await balances.get_user(cb.from_user.id, cb.from_user.username)
     final_txt = "🃏 <b>Blackjack — Round Complete</b>\n"
     for i, (hand, (_t, payout, msg)) in enumerate(zip(state_obj.state["player_hands"], eval_res["results"])):
         final_txt += f"\n{_decorate_hand_line(i, hand, state_obj.state)}\n   ➜ {msg} (payout {payout})"
     from games.blackjack import format_hand_with_total
     final_txt += f"\n\n🀫 Dealer: {format_hand_with_total(state_obj.state['dealer'])}\n"
-    final_txt += f"\n💰 Balance: {user['balance']} credits"
+    final_txt += f"\n💰 Balance: {user['available']} credits"
     await safe_edit(
         cb.message,
         final_txt,
-        reply_markup=build_blackjack_result_kb(state_obj.state["original_bet"], user["balance"]),
+        reply_markup=build_blackjack_result_kb(state_obj.state["original_bet"], user["available"]),
         parse_mode=ParseMode.HTML
     )
 
-async def _bj_finish(cb: CallbackQuery, state_obj: blackjack.BlackjackState):
+async def _bj_finish(db: Storage, balances: BalanceCache, cb: CallbackQuery, state_obj: blackjack.BlackjackState):
     state_obj.reveal_dealer()
-    await _save_bj_state(cb.from_user.id, state_obj)
+    if not (await _save_bj_state(db, cb.from_user.id, state_obj))["ok"]:
+        return await cb.answer("This round was closed.", show_alert=True)
     inter_lines = []
     for i, h in enumerate(state_obj.state["player_hands"]):
         inter_lines.append(_decorate_hand_line(i, h, state_obj.state))
@@ -381,25 +619,27 @@ async def _bj_finish(cb: CallbackQuery, state_obj: blackjack.BlackjackState):
     await cb.answer()
     await asyncio.sleep(0.6)
     while state_obj.dealer_play_step():
-        await _save_bj_state(cb.from_user.id, state_obj)
+        if not (await _save_bj_state(db, cb.from_user.id, state_obj))["ok"]:
+            return
         draw_txt = "🃏 <b>Blackjack</b>\n" + "\n".join(inter_lines) + "\n\n🀫 Dealer draws..."
         await safe_edit(cb.message, draw_txt, parse_mode=ParseMode.HTML)
         await asyncio.sleep(0.45)
-    await _resolve_bj(cb, state_obj)
+    await _resolve_bj(db, balances, cb, state_obj)
 
-async def _start_blackjack(cb: CallbackQuery, bet: int):
-    user = await db.get_or_create_user(cb.from_user.id, cb.from_user.username)
-    if bet < settings.min_bet or bet > settings.max_bet or bet > user["balance"]:
+async def _start_blackjack(settings: Settings, db: Storage, balances: BalanceCache, cb: CallbackQuery, bet: int):
+    user = await balances.get_user(cb.from_user.id, cb.from_user.username)
+    if bet < settings.min_bet or bet > settings.max_bet or bet > user["available"]:
         return await cb.answer("Invalid bet.", show_alert=True)
     state_obj = blackjack.BlackjackState(bet)
+    idem.init_tag(state_obj.state)
     if not await db.start_active_round(cb.from_user.id, "blackjack", bet, state_obj.to_json()):
-        active = await db.get_active_round(cb.from_user.id)
-        if active and active["game"] == "blackjack":
-            await _resume_blackjack(cb, active)
+        active = await db.get_active_round(cb.from_user.id, "blackjack")
+        if active:
+            await _resume_blackjack(db, balances, cb, active)
             return
         return await cb.answer("Could not start.", show_alert=True)
     if state_obj.is_blackjack(state_obj.state["player_hands"][0]) or state_obj.is_blackjack(state_obj.state["dealer"]):
-        await _bj_finish(cb, state_obj)
+        await _bj_finish(db, balances, cb, state_obj)
         return
     lines = []
     for i, h in enumerate(state_obj.state["player_hands"]):
@@ -408,15 +648,15 @@ async def _start_blackjack(cb: CallbackQuery, bet: int):
     await safe_edit(
         cb.message,
         txt,
-        reply_markup=build_blackjack_actions_kb(state_obj.can_double(), state_obj.can_split()),
+        reply_markup=_bj_actions_kb(state_obj),
         parse_mode=ParseMode.HTML
     )
     await cb.answer("Blackjack started!")
 
-async def _resume_blackjack(cb: CallbackQuery, active_row: dict):
-    state_obj = blackjack.BlackjackState.from_json(active_row["state_json"])
+async def _resume_blackjack(db: Storage, balances: BalanceCache, cb: CallbackQuery, active_row: dict):
+    state_obj = blackjack.BlackjackState.from_json(active_row["state_json"], active_row["version"])
     if state_obj.state["current_hand"] >= len(state_obj.state["player_hands"]):
-        await _bj_finish(cb, state_obj)
+        await _bj_finish(db, balances, cb, state_obj)
         return
     lines = []
     for i, h in enumerate(state_obj.state["player_hands"]):
@@ -427,26 +667,26 @@ async def _resume_blackjack(cb: CallbackQuery, active_row: dict):
     await safe_edit(
         cb.message,
         txt,
-        reply_markup=build_blackjack_actions_kb(state_obj.can_double(), state_obj.can_split()),
+        reply_markup=_bj_actions_kb(state_obj),
         parse_mode=ParseMode.HTML
     )
     await cb.answer("Resumed.")
 
-@router.callback_query(F.data == "game:blackjack")
-async def blackjack_entry(cb: CallbackQuery):
-    active = await db.get_active_round(cb.from_user.id)
-    if active and active["game"] == "blackjack":
-        await _resume_blackjack(cb, active)
+@on_callback(F.data == "game:blackjack")
+async def blackjack_entry(cb: CallbackQuery, settings: Settings, db: Storage, balances: BalanceCache):
+    active = await db.get_active_round(cb.from_user.id, "blackjack")
+    if active:
+        await _resume_blackjack(db, balances, cb, active)
         return
-    await _bj_show_bet_builder(cb)
+    await _bj_show_bet_builder(settings, balances, cb)
 
-@router.callback_query(F.data.func(lambda d: d.startswith("bjbet:")))
-async def blackjack_bet_builder(cb: CallbackQuery):
+@on_callback(F.data.func(lambda d: d.startswith("bjbet:")))
+async def blackjack_bet_builder(cb: CallbackQuery, settings: Settings, db: Storage, balances: BalanceCache):
     parts = cb.data.split(":")
     action = parts[1]
     if action == "noop":
         return await cb.answer()
-    user = await db.get_or_create_user(cb.from_user.id, cb.from_user.username)
+    user = await balances.get_user(cb.from_user.id, cb.from_user.username)
     current_raw = parts[-1] if parts[-1] else str(settings.min_bet)
     try:
         current = int(current_raw)
@@ -462,33 +702,42 @@ async def blackjack_bet_builder(cb: CallbackQuery):
     elif action == "half":
         current //= 2
     elif action == "max":
-        current = min(user["balance"], max_bet)
+        current = min(user["available"], max_bet)
     elif action == "clear":
         current = 0
     elif action == "confirm":
-        await _start_blackjack(cb, current)
+        await _start_blackjack(settings, db, balances, cb, current)
         return
 
-    current = max(0, min(current, user["balance"], max_bet))
-    await _bj_show_bet_builder(cb, current)
+    current = max(0, min(current, user["available"], max_bet))
+    await _bj_show_bet_builder(settings, balances, cb, current)
 
-@router.callback_query(F.data.func(lambda d: d.startswith("blackjack:same:")))
-async def blackjack_same(cb: CallbackQuery):
+@on_callback(F.data.func(lambda d: d.startswith("blackjack:same:")))
+async def blackjack_same(cb: CallbackQuery, settings: Settings, db: Storage, balances: BalanceCache):
     try:
         bet = int(cb.data.split(":")[-1])
     except:
         return await cb.answer("Bad bet.", show_alert=True)
-    await _start_blackjack(cb, bet)
+    await _start_blackjack(settings, db, balances, cb, bet)
+
+@on_callback(F.data.func(lambda d: d.startswith("blackjack:hint:")))
+async def blackjack_hint(cb: CallbackQuery):
+    # Table lookup on the key in the button; the round is not loaded.
+    await cb.answer(strategy.hint(cb.data.split(":", 2)[2]), show_alert=True)
 
-@router.callback_query(F.data == "blackjack:hit")
-async def blackjack_hit(cb: CallbackQuery):
-    active = await db.get_active_round(cb.from_user.id)
-    if not active or active["game"] != "blackjack":
+@on_callback(F.data == "blackjack:hit")
+async def blackjack_hit(cb: CallbackQuery, db: Storage, balances: BalanceCache, actions: ActionTracker, action_tag=None):
+    active = await db.get_active_round(cb.from_user.id, "blackjack")
+    if not active:
         return await cb.answer("No round.", show_alert=True)
-    state_obj = blackjack.BlackjackState.from_json(active["state_json"])
+    state_obj = blackjack.BlackjackState.from_json(active["state_json"], active["version"])
+    if not idem.tag_matches(state_obj.state, action_tag):
+        return await cb.answer("This button is outdated.")
     hand = state_obj.current_hand()
     hand.append(state_obj.draw())
-    await _save_bj_state(cb.from_user.id, state_obj)
+    actions.bump(cb.from_user.id, state_obj.state)
+    if not (await _save_bj_state(db, cb.from_user.id, state_obj))["ok"]:
+        return await cb.answer("This button is outdated.")
     lines = []
     for i, h in enumerate(state_obj.state["player_hands"]):
         marker = "👉 " if i == state_obj.state["current_hand"] else ""
@@ -498,13 +747,14 @@ async def blackjack_hit(cb: CallbackQuery):
     await safe_edit(
         cb.message,
         txt,
-        reply_markup=build_blackjack_actions_kb(state_obj.can_double(), state_obj.can_split()),
+        reply_markup=_bj_actions_kb(state_obj),
         parse_mode=ParseMode.HTML
     )
     from games.blackjack import calculate_hand_value
     if calculate_hand_value(hand) > 21:
         state_obj.state["current_hand"] += 1
-        await _save_bj_state(cb.from_user.id, state_obj)
+        if not (await _save_bj_state(db, cb.from_user.id, state_obj))["ok"]:
+            return await cb.answer()
         if state_obj.state["current_hand"] < len(state_obj.state["player_hands"]):
             lines = []
             for i, h in enumerate(state_obj.state["player_hands"]):
@@ -515,21 +765,25 @@ async def blackjack_hit(cb: CallbackQuery):
             await safe_edit(
                 cb.message,
                 bust_txt,
-                reply_markup=build_blackjack_actions_kb(state_obj.can_double(), state_obj.can_split()),
+                reply_markup=_bj_actions_kb(state_obj),
                 parse_mode=ParseMode.HTML
             )
         else:
-            await _bj_finish(cb, state_obj)
+            await _bj_finish(db, balances, cb, state_obj)
     await cb.answer()
 
-@router.callback_query(F.data == "blackjack:stand")
-async def blackjack_stand(cb: CallbackQuery):
-    active = await db.get_active_round(cb.from_user.id)
-    if not active or active["game"] != "blackjack":
+@on_callback(F.data == "blackjack:stand")
+async def blackjack_stand(cb: CallbackQuery, db: Storage, balances: BalanceCache, actions: ActionTracker, action_tag=None):
+    active = await db.get_active_round(cb.from_user.id, "blackjack")
+    if not active:
         return await cb.answer("No round.", show_alert=True)
-    state_obj = blackjack.BlackjackState.from_json(active["state_json"])
+    state_obj = blackjack.BlackjackState.from_json(active["state_json"], active["version"])
+    if not idem.tag_matches(state_obj.state, action_tag):
+        return await cb.answer("This button is outdated.")
     state_obj.state["current_hand"] += 1
-    await _save_bj_state(cb.from_user.id, state_obj)
+    actions.bump(cb.from_user.id, state_obj.state)
+    if not (await _save_bj_state(db, cb.from_user.id, state_obj))["ok"]:
+        return await cb.answer("This button is outdated.")
     if state_obj.state["current_hand"] < len(state_obj.state["player_hands"]):
         lines = []
         for i, h in enumerate(state_obj.state["player_hands"]):
@@ -540,31 +794,33 @@ async def blackjack_stand(cb: CallbackQuery):
         await safe_edit(
             cb.message,
             txt,
-            reply_markup=build_blackjack_actions_kb(state_obj.can_double(), state_obj.can_split()),
+            reply_markup=_bj_actions_kb(state_obj),
             parse_mode=ParseMode.HTML
         )
         return await cb.answer("Next hand.")
-    await _bj_finish(cb, state_obj)
+    await _bj_finish(db, balances, cb, state_obj)
 
-@router.callback_query(F.data == "blackjack:double")
-async def blackjack_double(cb: CallbackQuery):
-    active = await db.get_active_round(cb.from_user.id)
-    if not active or active["game"] != "blackjack":
+@on_callback(F.data == "blackjack:double")
+async def blackjack_double(cb: CallbackQuery, db: Storage, balances: BalanceCache, actions: ActionTracker, action_tag=None):
+    active = await db.get_active_round(cb.from_user.id, "blackjack")
+    if not active:
         return await cb.answer("No round.", show_alert=True)
-    state_obj = blackjack.BlackjackState.from_json(active["state_json"])
+    state_obj = blackjack.BlackjackState.from_json(active["state_json"], active["version"])
+    if not idem.tag_matches(state_obj.state, action_tag):
+        return await cb.answer("This button is outdated.")
     ci = state_obj.state["current_hand"]
     hand = state_obj.current_hand()
     if len(hand) != 2:
         return await cb.answer("Need 2 cards.", show_alert=True)
     original_bet = state_obj.state["bets"][ci]
-    if not await db.adjust_active_round_bet(cb.from_user.id, original_bet):
-        return await cb.answer("Balance low.", show_alert=True)
+    actions.bump(cb.from_user.id, state_obj.state)
     state_obj.state["bets"][ci] = original_bet * 2
     state_obj.state["doubled"][ci] = True
     hand.append(state_obj.draw())
-    await _save_bj_state(cb.from_user.id, state_obj)
     state_obj.state["current_hand"] += 1
-    await _save_bj_state(cb.from_user.id, state_obj)
+    res = await _save_bj_state(db, cb.from_user.id, state_obj, stake=original_bet)
+    if not res["ok"]:
+        return await _bj_refused(actions, cb, state_obj, res)
     if state_obj.state["current_hand"] < len(state_obj.state["player_hands"]):
         lines = []
         for i, h in enumerate(state_obj.state["player_hands"]):
@@ -576,26 +832,27 @@ async def blackjack_double(cb: CallbackQuery):
         await safe_edit(
             cb.message,
             txt,
-            reply_markup=build_blackjack_actions_kb(state_obj.can_double(), state_obj.can_split()),
+            reply_markup=_bj_actions_kb(state_obj),
             parse_mode=ParseMode.HTML
         )
         return await cb.answer("Doubled.")
-    await _bj_finish(cb, state_obj)
+    await _bj_finish(db, balances, cb, state_obj)
 
-@router.callback_query(F.data == "blackjack:split")
-async def blackjack_split(cb: CallbackQuery):
-    active = await db.get_active_round(cb.from_user.id)
-    if not active or active["game"] != "blackjack":
+@on_callback(F.data == "blackjack:split")
+async def blackjack_split(cb: CallbackQuery, db: Storage, actions: ActionTracker, action_tag=None):
+    active = await db.get_active_round(cb.from_user.id, "blackjack")
+    if not active:
         return await cb.answer("No round.", show_alert=True)
-    state_obj = blackjack.BlackjackState.from_json(active["state_json"])
+    state_obj = blackjack.BlackjackState.from_json(active["state_json"], active["version"])
+    if not idem.tag_matches(state_obj.state, action_tag):
+        return await cb.answer("This button is outdated.")
     if not state_obj.can_split():
         return await cb.answer("Cannot split.", show_alert=True)
     ci = state_obj.state["current_hand"]
     hand = state_obj.current_hand()
     c1, c2 = hand
     bet_amount = state_obj.state["bets"][ci]
-    if not await db.adjust_active_round_bet(cb.from_user.id, bet_amount):
-        return await cb.answer("Balance low.", show_alert=True)
+    actions.bump(cb.from_user.id, state_obj.state)
     new1 = [c1, state_obj.draw()]
     new2 = [c2, state_obj.draw()]
     state_obj.state["player_hands"][ci] = new1
@@ -604,7 +861,9 @@ async def blackjack_split(cb: CallbackQuery):
     state_obj.state["doubled"].insert(ci + 1, False)
     state_obj.state["surrendered"].insert(ci + 1, False)
     state_obj.state["split_count"] = state_obj.state.get("split_count", 0) + 1
-    await _save_bj_state(cb.from_user.id, state_obj)
+    res = await _save_bj_state(db, cb.from_user.id, state_obj, stake=bet_amount)
+    if not res["ok"]:
+        return await _bj_refused(actions, cb, state_obj, res)
     lines = []
     for i, h in enumerate(state_obj.state["player_hands"]):
         marker = "👉 " if i == state_obj.state["current_hand"] else ""
@@ -615,23 +874,27 @@ async def blackjack_split(cb: CallbackQuery):
     await safe_edit(
         cb.message,
         txt,
-        reply_markup=build_blackjack_actions_kb(state_obj.can_double(), state_obj.can_split()),
+        reply_markup=_bj_actions_kb(state_obj),
         parse_mode=ParseMode.HTML
     )
     await cb.answer("Split done.")
 
-@router.callback_query(F.data == "blackjack:surrender")
-async def blackjack_surrender(cb: CallbackQuery):
-    active = await db.get_active_round(cb.from_user.id)
-    if not active or active["game"] != "blackjack":
+@on_callback(F.data == "blackjack:surrender")
+async def blackjack_surrender(cb: CallbackQuery, db: Storage, balances: BalanceCache, actions: ActionTracker, action_tag=None):
+    active = await db.get_active_round(cb.from_user.id, "blackjack")
+    if not active:
         return await cb.answer("No round.", show_alert=True)
-    state_obj = blackjack.BlackjackState.from_json(active["state_json"])
+    state_obj = blackjack.BlackjackState.from_json(active["state_json"], active["version"])
+    if not idem.tag_matches(state_obj.state, action_tag):
+        return await cb.answer("This button is outdated.")
     ci = state_obj.state["current_hand"]
     while len(state_obj.state["surrendered"]) <= ci:
         state_obj.state["surrendered"].append(False)
     state_obj.state["surrendered"][ci] = True
     state_obj.state["current_hand"] += 1
-    await _save_bj_state(cb.from_user.id, state_obj)
+    actions.bump(cb.from_user.id, state_obj.state)
+    if not (await _save_bj_state(db, cb.from_user.id, state_obj))["ok"]:
+        return await cb.answer("This button is outdated.")
     if state_obj.state["current_hand"] < len(state_obj.state["player_hands"]):
         lines = []
         for i, h in enumerate(state_obj.state["player_hands"]):
@@ -643,11 +906,11 @@ async def blackjack_surrender(cb: CallbackQuery):
         await safe_edit(
             cb.message,
             txt,
-            reply_markup=build_blackjack_actions_kb(state_obj.can_double(), state_obj.can_split()),
+            reply_markup=_bj_actions_kb(state_obj),
             parse_mode=ParseMode.HTML
         )
         return await cb.answer("Surrendered.")
-    await _bj_finish(cb, state_obj)
+    await _bj_finish(db, balances, cb, state_obj)
 
 # =========================================================
 # Roulette
@@ -656,45 +919,47 @@ async def blackjack_surrender(cb: CallbackQuery):
 ROULETTE_CHIPS = [1,5,10,25,50,100,250,500]
 
 def roulette_main_kb(state: dict, can_spin: bool) -> InlineKeyboardMarkup:
+    tag = idem.tag(state)
     def chip_btn(val: int):
         return InlineKeyboardButton(text=f"+{val}", callback_data=f"roul:chip:{val}")
     rows = [
         [chip_btn(c) for c in ROULETTE_CHIPS[:4]],
         [chip_btn(c) for c in ROULETTE_CHIPS[4:]],
         [
-            InlineKeyboardButton(text="🔴 Red", callback_data="roul:add:color:red"),
-            InlineKeyboardButton(text="⚫ Black", callback_data="roul:add:color:black"),
-            InlineKeyboardButton(text="○ Even", callback_data="roul:add:parity:even"),
-            InlineKeyboardButton(text="● Odd", callback_data="roul:add:parity:odd"),
+            InlineKeyboardButton(text="🔴 Red", callback_data=f"roul:add:color:red{tag}"),
+            InlineKeyboardButton(text="⚫ Black", callback_data=f"roul:add:color:black{tag}"),
+            InlineKeyboardButton(text="○ Even", callback_data=f"roul:add:parity:even{tag}"),
+            InlineKeyboardButton(text="● Odd", callback_data=f"roul:add:parity:odd{tag}"),
         ],
         [
-            InlineKeyboardButton(text="⬇ 1-18", callback_data="roul:add:range:low"),
-            InlineKeyboardButton(text="⬆ 19-36", callback_data="roul:add:range:high"),
-            InlineKeyboardButton(text="1st12", callback_data="roul:add:dozen:1st12"),
-            InlineKeyboardButton(text="2nd12", callback_data="roul:add:dozen:2nd12"),
+            InlineKeyboardButton(text="⬇ 1-18", callback_data=f"roul:add:range:low{tag}"),
+            InlineKeyboardButton(text="⬆ 19-36", callback_data=f"roul:add:range:high{tag}"),
+            InlineKeyboardButton(text="1st12", callback_data=f"roul:add:dozen:1st12{tag}"),
+            InlineKeyboardButton(text="2nd12", callback_data=f"roul:add:dozen:2nd12{tag}"),
         ],
         [
-            InlineKeyboardButton(text="3rd12", callback_data="roul:add:dozen:3rd12"),
+            InlineKeyboardButton(text="3rd12", callback_data=f"roul:add:dozen:3rd12{tag}"),
             InlineKeyboardButton(text="🎯 Num", callback_data="roul:numbers"),
-            InlineKeyboardButton(text="🧹 CLR", callback_data="roul:clear"),
-            InlineKeyboardButton(text="❌ CXL", callback_data="roul:cancel"),
+            InlineKeyboardButton(text="🧹 CLR", callback_data=f"roul:clear{tag}"),
+            InlineKeyboardButton(text="❌ CXL", callback_data=f"roul:cancel{tag}"),
         ],
         [
             InlineKeyboardButton(
                 text="🎡 SPIN" if can_spin else "➕ Add bets",
-                callback_data="roul:spin" if can_spin else "roul:noop"
+                callback_data=f"roul:spin{tag}" if can_spin else "roul:noop"
             ),
             InlineKeyboardButton(text="⬅️ Menu", callback_data="nav:menu")
         ]
     ]
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
-def roulette_numbers_kb() -> InlineKeyboardMarkup:
-    rows = [[InlineKeyboardButton(text="0", callback_data="roul:num:0")]]
+def roulette_numbers_kb(state: dict) -> InlineKeyboardMarkup:
+    tag = idem.tag(state)
+    rows = [[InlineKeyboardButton(text="0", callback_data=f"roul:num:0{tag}")]]
     for start in range(1, 37, 6):
         row = []
         for n in range(start, min(start + 6, 37)):
-            row.append(InlineKeyboardButton(text=str(n), callback_data=f"roul:num:{n}"))
+            row.append(InlineKeyboardButton(text=str(n), callback_data=f"roul:num:{n}{tag}"))
         rows.append(row)
     rows.append([InlineKeyboardButton(text="⬅️ Back", callback_data="roul:back")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
@@ -712,35 +977,63 @@ async def _render_roulette(cb: CallbackQuery, state: dict, balance: int):
         parse_mode=ParseMode.HTML
     )
 
-@router.callback_query(F.data == "game:roulette")
-async def roulette_entry(cb: CallbackQuery):
-    active = await db.get_active_round(cb.from_user.id)
-    user = await db.get_or_create_user(cb.from_user.id, cb.from_user.username)
-    if active and active["game"] == "roulette":
+async def _roulette_save(db: Storage, actions: ActionTracker, cb: CallbackQuery, active: dict, edit, stake: int = 0):
+    """
+    Apply edit(state) and save it with compare-and-swap, holding stake in
+    the same write. Chip changes and bets merge, so after a version
+    conflict the edit is re-applied to the fresh state. Returns (state, result).
+    """
+    for _ in range(ROUND_SAVE_RETRIES):
+        state = roulette.from_json(active["state_json"])
+        edit(state)
+        res = await db.save_active_round(cb.from_user.id, roulette.to_json(state), active["version"], stake,
+                                        game="roulette")
+        if res["ok"] or res["reason"] != "conflict":
+            break
+        active = await db.get_active_round(cb.from_user.id, "roulette")
+        if not active or roulette.from_json(active["state_json"]).get("spun"):
+            res = {"ok": False, "reason": "missing"}
+            break
+    if res.get("reason") == "funds":
+        actions.unbump(cb.from_user.id, state)
+    return state, res
+
+async def _roulette_refused(cb: CallbackQuery, res: dict):
+    if res["reason"] == "funds":
+        return await cb.answer("Low balance.", show_alert=True)
+    if res["reason"] == "missing":
+        return await cb.answer("No roulette session.", show_alert=True)
+    return await cb.answer("Busy, try again.")
+
+@on_callback(F.data == "game:roulette")
+async def roulette_entry(cb: CallbackQuery, db: Storage, balances: BalanceCache):
+    active = await db.get_active_round(cb.from_user.id, "roulette")
+    user = await balances.get_user(cb.from_user.id, cb.from_user.username)
+    if active:
         state = roulette.from_json(active["state_json"])
         if state.get("spun"):
             await cb.answer("Round finished. Start new from menu.", show_alert=True)
             return
-        await _render_roulette(cb, state, user["balance"])
+        await _render_roulette(cb, state, user["available"])
         return
     state = roulette.base_state()
+    idem.init_tag(state)
     if not await db.start_active_round(cb.from_user.id, "roulette", 0, roulette.to_json(state)):
-        other = await db.get_active_round(cb.from_user.id)
-        if other:
-            await cb.answer("Another game active. /cancel to free.", show_alert=True)
-            return
-    await _render_roulette(cb, state, user["balance"])
+        return await cb.answer("Could not start.", show_alert=True)
+    await _render_roulette(cb, state, user["available"])
     await cb.answer("Roulette session started.")
 
-@router.callback_query(F.data.func(lambda d: d.startswith("roul:")))
-async def roulette_actions(cb: CallbackQuery):
+@on_callback(F.data.func(lambda d: d.startswith("roul:")))
+async def roulette_actions(cb: CallbackQuery, db: Storage, balances: BalanceCache, actions: ActionTracker, action_tag=None):
     data = cb.data.split(":")
     action = data[1]
-    active = await db.get_active_round(cb.from_user.id)
-    if not active or active["game"] != "roulette":
+    active = await db.get_active_round(cb.from_user.id, "roulette")
+    if not active:
         return await cb.answer("No roulette session.", show_alert=True)
     state = roulette.from_json(active["state_json"])
-    user = await db.get_or_create_user(cb.from_user.id, cb.from_user.username)
+    if not idem.tag_matches(state, action_tag):
+        return await cb.answer("This button is outdated.")
+    user = await balances.get_user(cb.from_user.id, cb.from_user.username)
 
     if state.get("spun") and action not in ("cancel", "noop"):
         return await cb.answer("Round done.", show_alert=True)
@@ -750,9 +1043,10 @@ async def roulette_actions(cb: CallbackQuery):
 
     if action == "chip":
         chip = int(data[2])
-        state["last_chip"] = chip
-        await db.update_active_round(cb.from_user.id, roulette.to_json(state))
-        await _render_roulette(cb, state, user["balance"])
+        state, res = await _roulette_save(db, actions, cb, active, lambda s: s.update(last_chip=chip))
+        if not res["ok"]:
+            return await _roulette_refused(cb, res)
+        await _render_roulette(cb, state, user["available"])
         return await cb.answer(f"Chip {chip}")
 
     if action == "add":
@@ -761,55 +1055,56 @@ async def roulette_actions(cb: CallbackQuery):
         amt = state["last_chip"]
         if amt <= 0:
             return await cb.answer("Set chip > 0.")
-        if user["balance"] < amt:
+        if user["available"] < amt:
             return await cb.answer("Low balance.", show_alert=True)
-        if not await db.adjust_active_round_bet(cb.from_user.id, amt):
-            return await cb.answer("Failed lock.", show_alert=True)
-        roulette.add_bet(state, bet_type, value, amt)
-        await db.update_active_round(cb.from_user.id, roulette.to_json(state))
-        user = await db.get_or_create_user(cb.from_user.id, cb.from_user.username)
-        await _render_roulette(cb, state, user["balance"])
+
+        def add(s):
+            actions.bump(cb.from_user.id, s)
+            roulette.add_bet(s, bet_type, value, amt)
+        state, res = await _roulette_save(db, actions, cb, active, add, stake=amt)
+        if not res["ok"]:
+            return await _roulette_refused(cb, res)
+        await _render_roulette(cb, state, res["balance"])
         return await cb.answer("Bet added.")
 
     if action == "numbers":
-        await safe_edit(cb.message, "🎯 Select a number:", reply_markup=roulette_numbers_kb())
+        await safe_edit(cb.message, "🎯 Select a number:", reply_markup=roulette_numbers_kb(state))
         return await cb.answer()
 
     if action == "num":
         n = data[2]
         amt = state["last_chip"]
-        if user["balance"] < amt:
+        if user["available"] < amt:
             return await cb.answer("Low balance.", show_alert=True)
-        if not await db.adjust_active_round_bet(cb.from_user.id, amt):
-            return await cb.answer("Failed lock.", show_alert=True)
-        roulette.add_bet(state, "straight", n, amt)
-        await db.update_active_round(cb.from_user.id, roulette.to_json(state))
-        user = await db.get_or_create_user(cb.from_user.id, cb.from_user.username)
-        await _render_roulette(cb, state, user["balance"])
+
+        def add(s):
+            actions.bump(cb.from_user.id, s)
+            roulette.add_bet(s, "straight", n, amt)
+        state, res = await _roulette_save(db, actions, cb, active, add, stake=amt)
+        if not res["ok"]:
+            return await _roulette_refused(cb, res)
+        await _render_roulette(cb, state, res["balance"])
         return await cb.answer(f"Bet #{n}")
 
     if action == "back":
-        await _render_roulette(cb, state, user["balance"])
+        await _render_roulette(cb, state, user["available"])
         return await cb.answer()
 
     if action == "clear":
-        refund = sum(b["amount"] for b in state["bets"])
-        await db.delete_active_round(cb.from_user.id)
-        user_balance = await db.update_balance(cb.from_user.id, refund)
         new_state = roulette.base_state()
-        await db.start_active_round(cb.from_user.id, "roulette", 0, roulette.to_json(new_state))
+        idem.init_tag(new_state)
+        user_balance = await db.reset_active_round(cb.from_user.id, roulette.to_json(new_state), game="roulette")
+        if user_balance is None:
+            return await cb.answer("No active roulette round.", show_alert=True)
         await _render_roulette(cb, new_state, user_balance)
         return await cb.answer("Cleared.")
 
     if action == "cancel":
-        refund = sum(b["amount"] for b in state["bets"])
-        await db.delete_active_round(cb.from_user.id)
-        if refund:
-            await db.update_balance(cb.from_user.id, refund)
-        user = await db.get_or_create_user(cb.from_user.id, cb.from_user.username)
+        await db.cancel_active_round(cb.from_user.id, game="roulette")
+        user = await balances.get_user(cb.from_user.id, cb.from_user.username)
         await safe_edit(
             cb.message,
-            build_main_menu_text(user['balance']),
+            build_main_menu_text(user['available']),
             reply_markup=main_menu_kb(),
             parse_mode=ParseMode.HTML
         )
@@ -819,7 +1114,10 @@ async def roulette_actions(cb: CallbackQuery):
         if not state["bets"]:
             return await cb.answer("Add bets first.", show_alert=True)
         state["spun"] = True
-        await db.update_active_round(cb.from_user.id, roulette.to_json(state))
+        actions.bump(cb.from_user.id, state)
+        res = await db.save_active_round(cb.from_user.id, roulette.to_json(state), active["version"], game="roulette")
+        if not res["ok"]:
+            return await cb.answer("This button is outdated.")
         sequence_len = 10
         for i in range(sequence_len):
             temp_num = random.randint(0, 36)
@@ -833,9 +1131,12 @@ async def roulette_actions(cb: CallbackQuery):
         final = roulette.spin_result()
         state["result"] = final
         payout = roulette.evaluate(state, final)
-        await db.update_active_round(cb.from_user.id, roulette.to_json(state))
-        await db.resolve_active_round(cb.from_user.id, "win" if payout > 0 else "loss", payout)
-        user = await db.get_or_create_user(cb.from_user.id, cb.from_user.username)
+        res = await db.save_active_round(cb.from_user.id, roulette.to_json(state), res["version"], game="roulette")
+        if not res["ok"]:
+            # Canceled while spinning: the hold was released, nothing to settle.
+            return await cb.answer("Round canceled.")
+        await db.resolve_active_round(cb.from_user.id, "win" if payout > 0 else "loss", payout, game="roulette")
+        user = await balances.get_user(cb.from_user.id, cb.from_user.username)
         color = "🔴" if final in roulette.RED_NUMBERS else "⚫" if final in roulette.BLACK_NUMBERS else "🟢"
         total_bet = sum(b["amount"] for b in state["bets"])
         net = payout - total_bet
@@ -847,7 +1148,7 @@ async def roulette_actions(cb: CallbackQuery):
             f"Total Bet: {total_bet}\n"
             f"Payout: {payout}\n"
             f"Net: {'+' if net>=0 else ''}{net}\n"
-            f"💰 Balance: {user['balance']} credits"
+            f"💰 Balance: {user['available']} credits"
         )
         await safe_edit(
             cb.message,
@@ -865,12 +1166,140 @@ async def roulette_actions(cb: CallbackQuery):
 # Entrypoint
 # =========================================================
 
-async def main():
-    await db.init()
+def build_scheduler(bot: Bot, settings: Settings, db: Storage, balances: BalanceCache) -> Scheduler:
+    async def notify(tg_id: int, text: str):
+        await bot.send_message(tg_id, text)
+
+    async def reap():
+        await reap_stale_rounds(
+            db, settings.round_ttl_minutes * 60, notify=notify if settings.reaper_notify else None
+        )
+
+    async def compact_rollups():
+        await db.compact_rollups(settings.rollup_hourly_keep_days)
+        await db.prune_user_rollups()
+
+    async def compact_ledger():
+        result = await db.compact_ledger(settings.ledger_keep_days)
+        if result["mismatches"]:
+            logging.warning("ledger: %d account(s) disagree with their ledger", result["mismatches"])
+
+    async def archive_bets():
+        await db.archive_bets(settings.bet_retention_days)
+
+    async def reconcile_balances():
+        counts = await balances.reconcile()
+        if counts["drift"]:
+            logging.warning("balance cache: %d cached balance(s) drifted from storage", counts["drift"])
+
+    async def backup():
+        result = await db.backup(settings.backup_dir, settings.backup_keep, settings.backup_pages_per_step,
+                                 settings.backup_step_sleep_ms / 1000)
+        logging.info("backup: %s", result)
+
+    sched = Scheduler(jitter_s=settings.scheduler_jitter_seconds)
+    sched.every(settings.reaper_interval_seconds, "reap_stale_rounds", reap)
+    sched.every(settings.rollup_compact_interval_minutes * 60, "compact_rollups", compact_rollups)
+    sched.every(settings.ledger_compact_interval_minutes * 60, "compact_ledger", compact_ledger)
+    sched.every(settings.archive_interval_hours * 3600, "archive_bets", archive_bets)
+    sched.every(settings.checkpoint_interval_minutes * 60, "wal_checkpoint", db.checkpoint)
+    sched.every(settings.balance_cache_reconcile_minutes * 60, "reconcile_balances", reconcile_balances)
+    if settings.backup_interval_hours > 0:
+        sched.every(settings.backup_interval_hours * 3600, "backup", backup)
+    if settings.daily_bonus_scheduled:
+        async def grant_bonus():
+            n = await db.grant_bonus_to_active(
+                settings.daily_bonus_amount, settings.daily_bonus_cooldown_hours, settings.daily_bonus_active_days
+            )
+            logging.info("scheduled daily bonus: %d users credited", n)
+        # Hourly: each active user is credited once their own cooldown expires.
+        sched.every(3600, "daily_bonus", grant_bonus)
+    return sched
+
+def build_throttling(bot: Bot, settings: Settings) -> ThrottlingMiddleware:
+    async def report(tg_id: int, data: str, strikes: int):
+        text = f"🚨 Possible bot: user {tg_id} was throttled {strikes} times in " \
+               f"{settings.throttle_abuse_window_seconds}s (last: {data})"
+        for admin_id in ADMIN_IDS:
+            await bot.send_message(admin_id, text)
+
+    limiter = RateLimiter(
+        parse_limits(settings.throttle_limits),
+        abuse_strikes=settings.throttle_abuse_strikes,
+        abuse_window_s=settings.throttle_abuse_window_seconds,
+    )
+    return ThrottlingMiddleware(limiter, on_abuse=report, exempt=ADMIN_IDS)
+
+@dataclass
+class App:
+    settings: Settings
+    db: Storage
+    leaderboard: Leaderboard
+    directory: UserDirectory
+    balances: BalanceCache
+    actions: ActionTracker
+    bot: Bot
+    dp: Dispatcher
+    scheduler: Scheduler
+    lifecycle: Lifecycle
+
+    async def run(self) -> None:
+        await self.db.init()
+        # Nothing is in flight yet, so decided rounds can be settled without a grace period.
+        counts = await recover_rounds(self.db, self.settings.round_ttl_minutes * 60)
+        logging.info("startup recovery: %s", counts)
+        await self.leaderboard.rebuild(self.db)
+        self.scheduler.start()
+        self.lifecycle.stop_on_signals(self.dp.stop_polling)
+        try:
+            await self.dp.start_polling(self.bot, handle_signals=False)
+        finally:
+            self.scheduler.shutdown()
+
+def create_app(app_settings: Optional[Settings] = None) -> App:
+    """
+    Wire storage, services, middlewares and a router of its own for one bot.
+    Everything lives on the returned App (and the dispatcher's workflow data),
+    so several apps can be built in one process. Nothing touches the network
+    or the database until App.run().
+    """
+    settings = app_settings or get_settings()
+    pools = dict(read_pool=settings.db_read_pool, write_batch=settings.db_write_batch,
+                 analytics_pool=settings.db_analytics_pool, analytics_cache_kib=settings.db_analytics_cache_kib,
+                 analytics_max_query_ms=settings.db_analytics_max_query_ms)
+    if settings.db_shards > 1:
+        db = ShardedStorage(settings.db_path, settings.db_shards, settings.starting_balance, settings.archive_dir,
+                            **pools)
+    else:
+        db = Database(settings.db_path, starting_balance=settings.starting_balance, archive_dir=settings.archive_dir,
+                      **pools)
+    leaderboard = Leaderboard(capacity=100)
+    db.balance_listeners.append(leaderboard.update)
+    directory = UserDirectory(db)
+    balances = BalanceCache(db, capacity=settings.balance_cache_size)
+
     bot = Bot(token=settings.bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher()
-    dp.include_router(router)
-    await dp.start_polling(bot)
+    scheduler = build_scheduler(bot, settings, db, balances)
+    lifecycle = Lifecycle(deadline_s=settings.shutdown_grace_seconds)
+    actions = ActionTracker()
+    dp = Dispatcher(settings=settings, db=db, leaderboard=leaderboard, directory=directory, balances=balances,
+                    actions=actions)
+    dp.update.outer_middleware(DrainMiddleware(lifecycle))
+    dp.update.outer_middleware(UpdateDedupMiddleware())
+    dp.callback_query.outer_middleware(CallbackDedupMiddleware(actions=actions))
+    dp.callback_query.outer_middleware(build_throttling(bot, settings))
+    dp.include_router(build_router())
+
+    # Runs after polling has stopped but before the bot session is closed,
+    # so in-flight handlers can still edit their messages while draining.
+    async def on_shutdown():
+        await lifecycle.shutdown(db, scheduler)
+
+    dp.shutdown.register(on_shutdown)
+    return App(settings, db, leaderboard, directory, balances, actions, bot, dp, scheduler, lifecycle)
+
+async def main():
+    await create_app().run()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -15,6 +15,46 @@ class Settings:
     daily_bonus_cooldown_hours: int
     min_bet: int
     max_bet: int
+    rollup_compact_interval_minutes: int = 60
+    rollup_hourly_keep_days: int = 14
+    ledger_compact_interval_minutes: int = 60
+    ledger_keep_days: int = 90
+    archive_dir: str = "data/archive"
+    bet_retention_days: int = 90
+    archive_interval_hours: int = 24
+    round_ttl_minutes: int = 60
+    reaper_interval_seconds: int = 60
+    reaper_notify: bool = False
+    checkpoint_interval_minutes: int = 5
+    backup_dir: str = "data/backups"
+    backup_interval_hours: int = 6
+    backup_keep: int = 8
+    backup_pages_per_step: int = 256
+    backup_step_sleep_ms: int = 5
+    scheduler_jitter_seconds: int = 10
+    daily_bonus_scheduled: bool = False
+    daily_bonus_active_days: int = 7
+    throttle_limits: str = "bjbet:add=8/2,roul:add=8/2,roul:num=8/2,*=25/5"
+    throttle_abuse_strikes: int = 30
+    throttle_abuse_window_seconds: int = 60
+    shutdown_grace_seconds: int = 20
+    db_shards: int = 1
+    db_read_pool: int = 4
+    db_write_batch: int = 64
+    db_analytics_pool: int = 2
+    db_analytics_cache_kib: int = 16384
+    db_analytics_max_query_ms: int = 10000
+    balance_cache_size: int = 50000
+    balance_cache_reconcile_minutes: int = 10
+
+    def __post_init__(self):
+        # compact_rollups re-derives hourly rollups from bets back to
+        # rollup_hourly_keep_days; those bets must not be archived yet.
+        if self.rollup_hourly_keep_days >= self.bet_retention_days:
+            raise ValueError(
+                f"ROLLUP_HOURLY_KEEP_DAYS ({self.rollup_hourly_keep_days}) must be less than "
+                f"BET_RETENTION_DAYS ({self.bet_retention_days})"
+            )
 
 def _get_int(name: str, default: int) -> int:
     try:
@@ -22,6 +62,12 @@ def _get_int(name: str, default: int) -> int:
     except (TypeError, ValueError):
         return default
 
+def _get_bool(name: str, default: bool) -> bool:
+    val = os.getenv(name)
+    if val is None or val == "":
+        return default
+    return val.strip().lower() in ("1", "true", "yes", "on")
+
 def get_settings() -> Settings:
     token = os.getenv("TELEGRAM_BOT_TOKEN") or os.getenv("BOT_TOKEN") or ""
     if not token:
@@ -40,4 +86,35 @@ def get_settings() -> Settings:
         daily_bonus_cooldown_hours=_get_int("DAILY_BONUS_COOLDOWN_HOURS", 24),
         min_bet=_get_int("MIN_BET", 10),
         max_bet=_get_int("MAX_BET", 100000),
+        rollup_compact_interval_minutes=_get_int("ROLLUP_COMPACT_INTERVAL_MINUTES", 60),
+        rollup_hourly_keep_days=_get_int("ROLLUP_HOURLY_KEEP_DAYS", 14),
+        ledger_compact_interval_minutes=_get_int("LEDGER_COMPACT_INTERVAL_MINUTES", 60),
+        ledger_keep_days=_get_int("LEDGER_KEEP_DAYS", 90),
+        archive_dir=os.getenv("ARCHIVE_DIR") or str(Path(db_path).parent / "archive"),
+        bet_retention_days=_get_int("BET_RETENTION_DAYS", 90),
+        archive_interval_hours=_get_int("ARCHIVE_INTERVAL_HOURS", 24),
+        round_ttl_minutes=_get_int("ROUND_TTL_MINUTES", 60),
+        reaper_interval_seconds=_get_int("REAPER_INTERVAL_SECONDS", 60),
+        reaper_notify=_get_bool("REAPER_NOTIFY", False),
+        checkpoint_interval_minutes=_get_int("CHECKPOINT_INTERVAL_MINUTES", 5),
+        backup_dir=os.getenv("BACKUP_DIR") or str(Path(db_path).parent / "backups"),
+        backup_interval_hours=_get_int("BACKUP_INTERVAL_HOURS", 6),
+        backup_keep=_get_int("BACKUP_KEEP", 8),
+        backup_pages_per_step=max(1, _get_int("BACKUP_PAGES_PER_STEP", 256)),
+        backup_step_sleep_ms=max(0, _get_int("BACKUP_STEP_SLEEP_MS", 5)),
+        scheduler_jitter_seconds=_get_int("SCHEDULER_JITTER_SECONDS", 10),
+        daily_bonus_scheduled=_get_bool("DAILY_BONUS_SCHEDULED", False),
+        daily_bonus_active_days=_get_int("DAILY_BONUS_ACTIVE_DAYS", 7),
+        throttle_limits=os.getenv("THROTTLE_LIMITS") or Settings.throttle_limits,
+        throttle_abuse_strikes=_get_int("THROTTLE_ABUSE_STRIKES", 30),
+        throttle_abuse_window_seconds=_get_int("THROTTLE_ABUSE_WINDOW_SECONDS", 60),
+        shutdown_grace_seconds=_get_int("SHUTDOWN_GRACE_SECONDS", 20),
+        db_shards=max(1, _get_int("DB_SHARDS", 1)),
+        db_read_pool=max(1, _get_int("DB_READ_POOL", 4)),
+        db_write_batch=max(1, _get_int("DB_WRITE_BATCH", 64)),
+        db_analytics_pool=max(1, _get_int("DB_ANALYTICS_POOL", 2)),
+        db_analytics_cache_kib=_get_int("DB_ANALYTICS_CACHE_KIB", 16384),
+        db_analytics_max_query_ms=_get_int("DB_ANALYTICS_MAX_QUERY_MS", 10000),
+        balance_cache_size=max(1, _get_int("BALANCE_CACHE_SIZE", 50000)),
+        balance_cache_reconcile_minutes=max(1, _get_int("BALANCE_CACHE_RECONCILE_MINUTES", 10)),
     )
@@ -7,6 +7,9 @@ from typing import List, Dict, Any
 MAX_SPLIT_HANDS = 4
 ALLOW_10_VALUE_FAMILY = False
 ALLOW_RE_SPLIT = True
+DEALER_STANDS_ON = 17   # soft totals included: the dealer stands on all 17s
+BLACKJACK_PAYS = 1.5    # any two-card 21, split hands included
+# Rules above are baked into games/strategy_table.py: rerun python -m games.strategy_gen after changing them.
 
 try:
     from services.cards import (
@@ -72,14 +75,17 @@ class BlackjackState:
             "original_bet": bet,
             "split_count": 0,
         }
+        # active_rounds.version this state was loaded at (not serialized).
+        self.version = 0
 
     def to_json(self) -> str:
         return json.dumps(self.state)
 
     @classmethod
-    def from_json(cls, data: str) -> "BlackjackState":
+    def from_json(cls, data: str, version: int = 0) -> "BlackjackState":
         obj = cls(1)
         obj.state = json.loads(data)
+        obj.version = version
         return obj
 
     def draw(self) -> str:
@@ -120,7 +126,7 @@ class BlackjackState:
         self.state["dealer_visible"] = self.state["dealer"].copy()
 
     def dealer_play_step(self) -> bool:
-        if calculate_hand_value(self.state["dealer"]) < 17:
+        if calculate_hand_value(self.state["dealer"]) < DEALER_STANDS_ON:
             c = self.draw()
             self.state["dealer"].append(c)
             self.state["dealer_visible"].append(c)
@@ -143,7 +149,7 @@ class BlackjackState:
                 if self.is_blackjack(self.state["dealer"]):
                     results.append(("push", bet, f"🤝 Hand {i+1} push (both BJ)"))
                 else:
-                    extra = math.floor(1.5 * bet)
+                    extra = math.floor(BLACKJACK_PAYS * bet)
                     payout = bet + extra
                     results.append(("win", payout, f"🏆 Hand {i+1} Blackjack +{extra}"))
                 continue
@@ -161,6 +167,25 @@ class BlackjackState:
         return {"dealer_total": dealer_total, "results": results}
 
 
+def overall_flag(results: List[Any]) -> str:
+    """Single history flag for a (possibly split) round from evaluate()["results"]."""
+    flags = {t for (t, _p, _m) in results}
+    if "win" in flags and "loss" not in flags:
+        return "win"
+    if "loss" in flags and "win" not in flags:
+        return "loss"
+    if flags == {"push"}:
+        return "push"
+    return "mixed"
+
+def play_out(state_obj: "BlackjackState") -> Dict[str, Any]:
+    """Reveal, let the dealer draw to 17 and evaluate. Deterministic: draws come from the saved deck."""
+    state_obj.reveal_dealer()
+    while state_obj.dealer_play_step():
+        pass
+    return state_obj.evaluate()
+
+
 def format_hand(cards: List[str]) -> str:
     return " ".join(cards)
 
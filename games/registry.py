@@ -0,0 +1,56 @@
+"""
+Game registry: maps game names to their modules, imported on first use.
+
+    blackjack = registry.lazy("blackjack")
+    blackjack.BlackjackState(...)   # games.blackjack is imported here
+
+Keeps `import bot` (and worker processes) from paying for game modules
+that a given process may never touch.
+"""
+
+import importlib
+from types import ModuleType
+from typing import Any, Dict
+
+GAMES: Dict[str, str] = {
+    "blackjack": "games.blackjack",
+    "roulette": "games.roulette",
+    "simple21": "games.simple21",
+}
+
+
+def register(name: str, module_path: str) -> None:
+    GAMES[name] = module_path
+
+
+def load(name: str) -> ModuleType:
+    try:
+        path = GAMES[name]
+    except KeyError:
+        raise KeyError(f"unknown game: {name}") from None
+    return importlib.import_module(path)
+
+
+class LazyGame:
+    """Module proxy that imports the game on first attribute access."""
+
+    __slots__ = ("_name", "_module")
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr: str) -> Any:
+        if self._module is None:
+            self._module = load(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy game {self._name!r} ({state})>"
+
+
+def lazy(name: str) -> LazyGame:
+    if name not in GAMES:
+        raise KeyError(f"unknown game: {name}")
+    return LazyGame(name)
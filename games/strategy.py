@@ -0,0 +1,77 @@
+"""
+Blackjack basic-strategy hints: constant-time lookups in the tables that
+python -m games.strategy_gen precomputes for the rules of games.blackjack
+(games/strategy_table.py).
+
+    key = strategy.situation(hand, dealer_up, can_double, can_split)   # "h16.T", "p8.6.dp", ...
+    strategy.hint(key)  # "Hard 16 vs T: Surrender"
+
+The key holds everything the lookup needs, so a button can carry it in its
+callback_data and be answered without loading the round.
+"""
+
+from typing import List, Optional
+
+from games.strategy_table import HARD, PAIRS, SOFT, UPCARDS
+
+ACTIONS = {"H": "Hit", "S": "Stand", "R": "Surrender", "D": "Double", "P": "Split"}
+# Codes that double when allowed -> what to do otherwise
+NO_DOUBLE = {"D": "H", "d": "S", "r": "R"}
+TEN_RANKS = ("10", "J", "Q", "K")
+
+
+def _rank(card: str) -> str:
+    rank = card[:-1]
+    return "T" if rank in TEN_RANKS else rank
+
+
+def situation(hand: List[str], dealer_up: str, can_double: bool, can_split: bool) -> str:
+    """
+    Lookup key for the hand being played: "<h|s><total>.<up>" or, for a
+    splittable pair, "p<rank>.<up>", followed by ".d" / ".dp" / ".p" for the
+    actions the table may suggest besides hit, stand and surrender.
+    """
+    up = _rank(dealer_up)
+    flags = ("d" if can_double else "") + ("p" if can_split else "")
+    if can_split:
+        kind = "p" + _rank(hand[0])
+    else:
+        hard = sum(1 if r == "A" else 10 if r == "T" else int(r) for r in map(_rank, hand))
+        soft = "A" in map(_rank, hand) and hard + 10 <= 21
+        kind = f"s{hard + 10}" if soft else f"h{hard}"
+    return f"{kind}.{up}.{flags}" if flags else f"{kind}.{up}"
+
+
+def advise(key: str) -> Optional[str]:
+    """Best action for a situation() key ("Hit", "Stand", ...); None for a busted hand or a malformed key."""
+    kind, _, rest = key.partition(".")
+    up, _, flags = rest.partition(".")
+    col = UPCARDS.find(up) if len(up) == 1 else -1
+    if col < 0 or len(kind) < 2:
+        return None
+    if kind[0] == "p":
+        pair = kind[1:]
+        if pair not in PAIRS:
+            return None
+        if "p" in flags and PAIRS[pair][col] == "P":
+            return ACTIONS["P"]
+        # not split: play the pair as its total
+        kind = "s12" if pair == "A" else f"h{20 if pair == 'T' else 2 * int(pair)}"
+    table = {"h": HARD, "s": SOFT}.get(kind[0])
+    row = table.get(kind[1:]) if table else None
+    if row is None:
+        return None
+    code = row[col]
+    if code in NO_DOUBLE:
+        code = "D" if "d" in flags else NO_DOUBLE[code]
+    return ACTIONS[code]
+
+
+def hint(key: str) -> str:
+    action = advise(key)
+    if action is None:
+        return "No hint for this hand."
+    kind, up = key.split(".")[:2]
+    hand = {"h": "Hard", "s": "Soft"}.get(kind[0])
+    label = f"{hand} {kind[1:]}" if hand else f"Pair of {kind[1:].replace('T', '10')}s"
+    return f"💡 {label} vs {up.replace('T', '10')}: {action}"
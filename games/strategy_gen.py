@@ -0,0 +1,237 @@
+"""
+Offline basic-strategy generator for games.blackjack.
+
+    python -m games.strategy_gen            # rewrite games/strategy_table.py
+    python -m games.strategy_gen --check    # exit 1 if the table is out of date
+
+Reads the rules from games.blackjack (MAX_SPLIT_HANDS, ALLOW_RE_SPLIT,
+ALLOW_10_VALUE_FAMILY, DEALER_STANDS_ON, BLACKJACK_PAYS) and computes the
+expected value of every action for every (hand, dealer up-card), then
+writes the best ones as the lookup tables games.strategy reads. Rerun it
+whenever those rules change.
+
+Model of the game as the bot deals it:
+- cards are drawn with the probabilities of one 52-card deck (infinite-deck
+  approximation: the few cards already seen are not removed)
+- a dealer blackjack ends the round before the player acts, so the dealer's
+  hole card is conditioned on "no blackjack" under an A or 10 up-card
+- double on any two cards (also after a split), one card, then stand
+- surrender any time, half the bet back
+- split pairs into up to MAX_SPLIT_HANDS hands; a two-card 21 after a split
+  pays BLACKJACK_PAYS. Resplits are valued by sharing the remaining splits
+  evenly between the two new hands.
+"""
+
+import argparse
+import sys
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from games import blackjack
+
+TABLE_PATH = Path(__file__).with_name("strategy_table.py")
+
+UPCARDS = "23456789TA"  # table columns; T is any ten-value card
+SURRENDER_EV = -0.5
+
+# Best action, then what to do instead when doubling is not allowed.
+CODES = {("H", None): "H", ("S", None): "S", ("R", None): "R",
+         ("D", "H"): "D", ("D", "S"): "d", ("D", "R"): "r"}
+
+
+def rules() -> Dict[str, object]:
+    return {
+        "max_split_hands": blackjack.MAX_SPLIT_HANDS,
+        "allow_re_split": blackjack.ALLOW_RE_SPLIT,
+        "ten_value_pairs": blackjack.ALLOW_10_VALUE_FAMILY,
+        "dealer_stands_on": blackjack.DEALER_STANDS_ON,
+        "blackjack_pays": blackjack.BLACKJACK_PAYS,
+    }
+
+
+def _value(rank: str) -> int:
+    """Hard value of a rank (ace = 1)."""
+    if rank == "A":
+        return 1
+    return 10 if rank in ("10", "J", "Q", "K") else int(rank)
+
+
+def _key(rank: str) -> str:
+    return "T" if _value(rank) == 10 else rank
+
+
+# (rank, probability), one entry per rank of the deck
+DRAWS: List[Tuple[str, float]] = [(r, 1 / len(blackjack.RANKS)) for r in blackjack.RANKS]
+# hard value -> probability
+VALUES: Dict[int, float] = {}
+for _rank, _p in DRAWS:
+    VALUES[_value(_rank)] = VALUES.get(_value(_rank), 0) + _p
+
+
+def _total(hard: int, ace: bool) -> int:
+    return hard + 10 if ace and hard + 10 <= 21 else hard
+
+
+@lru_cache(maxsize=None)
+def _dealer_from(hard: int, ace: bool) -> Tuple[float, ...]:
+    """Dealer's final total distribution from (hard, ace): index 0..4 = 17..21, 5 = bust."""
+    total = _total(hard, ace)
+    if total > 21:
+        return (0, 0, 0, 0, 0, 1)
+    if total >= blackjack.DEALER_STANDS_ON:
+        out = [0.0] * 6
+        out[total - 17] = 1.0
+        return tuple(out)
+    out = [0.0] * 6
+    for v, p in VALUES.items():
+        for i, q in enumerate(_dealer_from(hard + v, ace or v == 1)):
+            out[i] += p * q
+    return tuple(out)
+
+
+@lru_cache(maxsize=None)
+def dealer_outcomes(up: str) -> Tuple[float, ...]:
+    """Final total distribution for an up-card, given the dealer has no blackjack."""
+    u = 1 if up == "A" else 10 if up == "T" else int(up)
+    out = [0.0] * 6
+    norm = 0.0
+    for v, p in VALUES.items():
+        if {u, v} == {1, 10}:
+            continue  # blackjack: the round ended before any decision
+        norm += p
+        for i, q in enumerate(_dealer_from(u + v, u == 1 or v == 1)):
+            out[i] += p * q
+    return tuple(x / norm for x in out)
+
+
+def stand_ev(total: int, up: str) -> float:
+    if total > 21:
+        return -1.0
+    dealer = dealer_outcomes(up)
+    ev = dealer[5]
+    for final, p in zip(range(17, 22), dealer):
+        ev += p if total > final else -p if total < final else 0
+    return ev
+
+
+@lru_cache(maxsize=None)
+def hit_ev(hard: int, ace: bool, up: str) -> float:
+    ev = 0.0
+    for v, p in VALUES.items():
+        h, a = hard + v, ace or v == 1
+        ev += p * (-1.0 if _total(h, a) > 21 else best_ev(h, a, up))
+    return ev
+
+
+def best_ev(hard: int, ace: bool, up: str) -> float:
+    """Value of a hand that can no longer double or split."""
+    return max(stand_ev(_total(hard, ace), up), hit_ev(hard, ace, up), SURRENDER_EV)
+
+
+def double_ev(hard: int, ace: bool, up: str) -> float:
+    return 2 * sum(p * stand_ev(_total(hard + v, ace or v == 1), up) for v, p in VALUES.items())
+
+
+def _choices(hard: int, ace: bool, up: str) -> Dict[str, float]:
+    return {"S": stand_ev(_total(hard, ace), up), "H": hit_ev(hard, ace, up), "R": SURRENDER_EV,
+            "D": double_ev(hard, ace, up)}
+
+
+def two_card_ev(hard: int, ace: bool, up: str) -> float:
+    return max(_choices(hard, ace, up).values())
+
+
+def _is_pair(a: str, b: str) -> bool:
+    return a == b or (blackjack.ALLOW_10_VALUE_FAMILY and _value(a) == _value(b) == 10)
+
+
+@lru_cache(maxsize=None)
+def split_hand_ev(rank: str, splits_left: int, up: str) -> float:
+    """One hand started from a split card, which may split again up to splits_left more times."""
+    v0 = _value(rank)
+    ev = 0.0
+    for r, p in DRAWS:
+        hard, ace = v0 + _value(r), v0 == 1 or r == "A"
+        if _total(hard, ace) == 21:
+            ev += p * blackjack.BLACKJACK_PAYS
+            continue
+        best = two_card_ev(hard, ace, up)
+        if splits_left and blackjack.ALLOW_RE_SPLIT and _is_pair(rank, r):
+            rest = splits_left - 1
+            best = max(best, split_hand_ev(rank, rest // 2, up) + split_hand_ev(rank, rest - rest // 2, up))
+        ev += p * best
+    return ev
+
+
+def split_ev(rank: str, up: str) -> float:
+    extra = max(blackjack.MAX_SPLIT_HANDS - 2, 0)
+    return split_hand_ev(rank, extra // 2, up) + split_hand_ev(rank, extra - extra // 2, up)
+
+
+def _code(hard: int, ace: bool, up: str) -> str:
+    ev = _choices(hard, ace, up)
+    plain = max("SHR", key=lambda a: ev[a])
+    return CODES[("D", plain)] if ev["D"] > ev[plain] else CODES[(plain, None)]
+
+
+def build() -> Dict[str, Dict[str, str]]:
+    """{"hard": {total: row}, "soft": {total: row}, "pairs": {rank: row}}; one code per UPCARDS column."""
+    hard = {str(t): "".join(_code(t, False, up) for up in UPCARDS) for t in range(4, 22)}
+    # soft t = an ace counted as 11 plus hard t - 11 of other cards
+    soft = {str(t): "".join(_code(t - 10, True, up) for up in UPCARDS) for t in range(12, 22)}
+    pairs = {}
+    if blackjack.MAX_SPLIT_HANDS >= 2:
+        for rank in ("A", "2", "3", "4", "5", "6", "7", "8", "9", "10"):
+            v = _value(rank)
+            pairs[_key(rank)] = "".join(
+                "P" if split_ev(rank, up) > two_card_ev(2 * v, v == 1, up) else "-" for up in UPCARDS
+            )
+    return {"hard": hard, "soft": soft, "pairs": pairs}
+
+
+def render(tables: Dict[str, Dict[str, str]]) -> str:
+    lines = [
+        '"""',
+        "Basic-strategy tables for games.blackjack (read by games.strategy).",
+        "",
+        "Generated by python -m games.strategy_gen for RULES below; do not edit,",
+        "change the rules in games/blackjack.py and rerun the generator.",
+        "",
+        "Columns follow UPCARDS (T = any ten-value card). Codes: H hit, S stand,",
+        "R surrender, D double (else hit), d double (else stand), r double (else",
+        'surrender); pairs: P split, - play the hard/soft total."""',
+        "",
+        f"RULES = {rules()!r}",
+        "",
+        f"UPCARDS = {UPCARDS!r}",
+    ]
+    for name, rows in tables.items():
+        lines += ["", f"{name.upper()} = {{"]
+        lines += [f"    {k!r}: {row!r}," for k, row in rows.items()]
+        lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Generate the blackjack basic-strategy lookup tables.")
+    p.add_argument("--out", default=str(TABLE_PATH), help="table module to write (default: %(default)s)")
+    p.add_argument("--check", action="store_true", help="only compare with the existing file")
+    args = p.parse_args(argv)
+
+    text = render(build())
+    out = Path(args.out)
+    if args.check:
+        current = out.read_text(encoding="utf-8") if out.exists() else ""
+        if current != text:
+            print(f"{out} is out of date; run python -m games.strategy_gen")
+            return 1
+        print(f"{out} is up to date")
+        return 0
+    out.write_text(text, encoding="utf-8")
+    print(f"wrote {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
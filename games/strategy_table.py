@@ -0,0 +1,60 @@
+"""
+Basic-strategy tables for games.blackjack (read by games.strategy).
+
+Generated by python -m games.strategy_gen for RULES below; do not edit,
+change the rules in games/blackjack.py and rerun the generator.
+
+Columns follow UPCARDS (T = any ten-value card). Codes: H hit, S stand,
+R surrender, D double (else hit), d double (else stand), r double (else
+surrender); pairs: P split, - play the hard/soft total."""
+
+RULES = {'max_split_hands': 4, 'allow_re_split': True, 'ten_value_pairs': False, 'dealer_stands_on': 17, 'blackjack_pays': 1.5}
+
+UPCARDS = '23456789TA'
+
+HARD = {
+    '4': 'HHHHHHHHHH',
+    '5': 'HHHHHHHHHH',
+    '6': 'HHHHHHHHHH',
+    '7': 'HHHHHHHHHH',
+    '8': 'HHHHHHHHHH',
+    '9': 'HDDDDHHHHH',
+    '10': 'DDDDDDDDHH',
+    '11': 'DDDDDDDDDH',
+    '12': 'HHSSSHHHHH',
+    '13': 'SSSSSHHHHH',
+    '14': 'SSSSSHHHHH',
+    '15': 'SSSSSHHHRH',
+    '16': 'SSSSSHHRRR',
+    '17': 'SSSSSSSSSS',
+    '18': 'SSSSSSSSSS',
+    '19': 'SSSSSSSSSS',
+    '20': 'SSSSSSSSSS',
+    '21': 'SSSSSSSSSS',
+}
+
+SOFT = {
+    '12': 'HHHHHHHHHH',
+    '13': 'HHHHDHHHHH',
+    '14': 'HHHDDHHHHH',
+    '15': 'HHHDDHHHHH',
+    '16': 'HHDDDHHHHH',
+    '17': 'HDDDDHHHHH',
+    '18': 'SddddSSHHH',
+    '19': 'SSSSSSSSSS',
+    '20': 'SSSSSSSSSS',
+    '21': 'SSSSSSSSSS',
+}
+
+PAIRS = {
+    'A': 'PPPPPPPPPP',
+    '2': 'PPPPPP----',
+    '3': 'PPPPPP----',
+    '4': '---PP-----',
+    '5': '----------',
+    '6': 'PPPPP-----',
+    '7': 'PPPPPP----',
+    '8': 'PPPPPPPPPP',
+    '9': 'PPPPP-PP--',
+    'T': '----------',
+}
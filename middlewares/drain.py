@@ -0,0 +1,33 @@
+"""
+In-flight tracking for graceful shutdown (services.lifecycle).
+
+Registered as the outermost update middleware so every handler is counted.
+Once a stop signal has flipped `draining`, callbacks still being dispatched
+that would open a new round are answered without touching the database;
+actions on rounds already open still go through so they can finish.
+"""
+
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+NEW_ROUND_PREFIXES: Tuple[str, ...] = ("bjbet:confirm", "blackjack:same:", "game:")
+
+
+class DrainMiddleware(BaseMiddleware):
+    def __init__(self, lifecycle, new_round_prefixes: Tuple[str, ...] = NEW_ROUND_PREFIXES):
+        self.lifecycle = lifecycle
+        self.new_round_prefixes = new_round_prefixes
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        cb = event.callback_query if isinstance(event, Update) else None
+        if self.lifecycle.draining and cb is not None and (cb.data or "").startswith(self.new_round_prefixes):
+            return await cb.answer("The bot is restarting, try again in a moment.", show_alert=True)
+        async with self.lifecycle.track():
+            return await handler(event, data)
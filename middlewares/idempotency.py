@@ -0,0 +1,184 @@
+"""
+Idempotent update / callback processing.
+
+1. UpdateDedupMiddleware drops re-delivered updates (same update_id).
+2. CallbackDedupMiddleware drops repeated callback_query ids and checks the
+   per-round action tag on state-changing buttons.
+
+Action tags: state-changing callback_data gets a "~<rid>.<seq>" suffix, where
+rid is a random id of the round and seq the round's action counter (both
+kept in the round state). The middleware strips the suffix before filters
+and handlers run, so handlers keep matching "blackjack:hit" etc., and hands
+the tag over as the `action_tag` handler argument.
+
+Each app owns one ActionTracker (see bot.create_app): the middleware reads
+it and handlers bump it, received as the `actions` handler argument.
+
+A tag is rejected without touching the database when it is older than the
+latest seq seen for that user/round, or when the very same tag is already
+being processed (double tap). After a restart the in-memory view is empty;
+handlers then compare the tag with the state they load (tag_matches) and
+still refuse stale actions before writing anything.
+"""
+
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject, Update
+
+TAG_SEP = "~"
+
+Tag = Tuple[str, int]
+
+
+class TTLCache:
+    """Bounded set of recently seen keys with expiry (insertion ordered)."""
+
+    def __init__(self, maxsize: int = 10_000, ttl_s: float = 600,
+                 clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self.clock = clock
+        self._items: "OrderedDict[Any, float]" = OrderedDict()
+
+    def add(self, key: Any) -> bool:
+        """Remember key; False if it was already present and not expired."""
+        now = self.clock()
+        while self._items:
+            oldest, ts = next(iter(self._items.items()))
+            if now - ts < self.ttl_s:
+                break
+            self._items.popitem(last=False)
+        if key in self._items:
+            return False
+        # make room only for a new key, so a full cache still catches its oldest entry
+        while len(self._items) >= self.maxsize:
+            self._items.popitem(last=False)
+        self._items[key] = now
+        return True
+
+
+# ---------------- Round action tags ----------------
+
+def init_tag(state: Dict[str, Any]) -> None:
+    """Give a fresh round state its id and action counter."""
+    state["rid"] = secrets.token_hex(3)
+    state["seq"] = 0
+
+
+def tag(state: Dict[str, Any]) -> str:
+    """Suffix for callback_data of state-changing buttons ('' for legacy states)."""
+    if "rid" not in state:
+        return ""
+    return f"{TAG_SEP}{state['rid']}.{state['seq']}"
+
+
+def tag_matches(state: Dict[str, Any], action_tag: Optional[Tag]) -> bool:
+    if action_tag is None or "rid" not in state:
+        return True
+    return action_tag == (state["rid"], state["seq"])
+
+
+def parse_tag(data: str) -> Tuple[str, Optional[Tag]]:
+    base, sep, raw = data.rpartition(TAG_SEP)
+    if not sep:
+        return data, None
+    rid, _, seq = raw.partition(".")
+    if not rid or not seq.isdigit():
+        return data, None
+    return base, (rid, int(seq))
+
+
+class ActionTracker:
+    """Latest known (rid, seq) per user plus tags currently being handled."""
+
+    def __init__(self, maxsize: int = 50_000):
+        self.maxsize = maxsize
+        self._latest: "OrderedDict[int, Tag]" = OrderedDict()
+        self._inflight: Set[Tuple[int, Tag]] = set()
+
+    def advance(self, tg_id: int, state: Dict[str, Any]) -> None:
+        if "rid" not in state:
+            return
+        self._latest[tg_id] = (state["rid"], state["seq"])
+        self._latest.move_to_end(tg_id)
+        if len(self._latest) > self.maxsize:
+            self._latest.popitem(last=False)
+
+    def is_stale(self, tg_id: int, action_tag: Tag) -> bool:
+        latest = self._latest.get(tg_id)
+        return latest is not None and latest[0] == action_tag[0] and action_tag[1] < latest[1]
+
+    def claim(self, tg_id: int, action_tag: Tag) -> bool:
+        key = (tg_id, action_tag)
+        if key in self._inflight:
+            return False
+        self._inflight.add(key)
+        return True
+
+    def release(self, tg_id: int, action_tag: Tag) -> None:
+        self._inflight.discard((tg_id, action_tag))
+
+    def bump(self, tg_id: int, state: Dict[str, Any]) -> None:
+        """Advance the round's action counter after an accepted state change."""
+        if "rid" not in state:
+            return
+        state["seq"] += 1
+        self.advance(tg_id, state)
+
+    def unbump(self, tg_id: int, state: Dict[str, Any]) -> None:
+        """Undo bump() when the state change it announced was not saved."""
+        if "rid" not in state:
+            return
+        state["seq"] -= 1
+        self.advance(tg_id, state)
+
+
+# ---------------- Middlewares ----------------
+
+class UpdateDedupMiddleware(BaseMiddleware):
+    def __init__(self, cache: Optional[TTLCache] = None):
+        self.seen = cache or TTLCache()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if isinstance(event, Update) and not self.seen.add(event.update_id):
+            return None
+        return await handler(event, data)
+
+
+class CallbackDedupMiddleware(BaseMiddleware):
+    def __init__(self, cache: Optional[TTLCache] = None, actions: Optional[ActionTracker] = None):
+        self.seen = cache or TTLCache()
+        self.actions = actions or ActionTracker()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, CallbackQuery):
+            return await handler(event, data)
+        if not self.seen.add(event.id):
+            return None
+        base, action_tag = parse_tag(event.data or "")
+        if action_tag is None:
+            return await handler(event, data)
+        tg_id = event.from_user.id
+        if self.actions.is_stale(tg_id, action_tag):
+            return await event.answer("This button is outdated.")
+        if not self.actions.claim(tg_id, action_tag):
+            return await event.answer()
+        try:
+            data["action_tag"] = action_tag
+            return await handler(event.model_copy(update={"data": base}), data)
+        finally:
+            self.actions.release(tg_id, action_tag)
@@ -0,0 +1,169 @@
+"""
+Per-user callback rate limiting and abuse flagging.
+
+Every (user, rule) pair gets a sliding-window counter made of a fixed ring
+of buckets: the window is split into `buckets` slots, each slot remembers
+which time bucket it belongs to, and the rate is the sum of slots that are
+still inside the window. Memory per tracked pair is two small int arrays,
+and idle pairs are evicted LRU-style once `max_keys` is reached.
+
+Rules are matched on the callback_data prefix (longest wins), e.g.
+
+    bjbet:add=8/2, roul:add=8/2, *=25/5
+
+means at most 8 presses per 2 seconds on chip buttons and 25 per 5 seconds
+on anything else. Over-rate presses are answered with a short toast and
+never reach the handlers, so they cost no database access.
+
+Users that keep hitting the limit ("strikes" within the abuse window) are
+reported once per cooldown through the on_abuse callback.
+"""
+
+import logging
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+
+log = logging.getLogger(__name__)
+
+# (prefix, max events, window seconds)
+Rule = Tuple[str, int, float]
+AbuseHandler = Callable[[int, str, int], Awaitable[None]]
+
+
+def parse_limits(spec: str) -> List[Rule]:
+    """Parse "prefix=count/seconds, ..." into rules, longest prefix first."""
+    rules: List[Rule] = []
+    for part in spec.replace(";", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        prefix, _, limit = part.rpartition("=")
+        count, _, window = limit.partition("/")
+        try:
+            rule = (prefix.strip(), int(count), float(window))
+        except ValueError:
+            raise ValueError(f"bad throttle rule: {part!r}") from None
+        if not rule[0] or rule[1] <= 0 or rule[2] <= 0:
+            raise ValueError(f"bad throttle rule: {part!r}")
+        rules.append(rule)
+    rules.sort(key=lambda r: (r[0] == "*", -len(r[0])))
+    return rules
+
+
+class SlidingWindow:
+    """Event count over the last `window_s` seconds, kept in `buckets` ring slots."""
+
+    __slots__ = ("counts", "stamps")
+
+    def __init__(self, buckets: int):
+        self.counts = array("l", [0] * buckets)
+        self.stamps = array("q", [-1] * buckets)
+
+    def hit(self, bucket: int) -> int:
+        """Record one event in absolute time bucket `bucket`; returns the windowed count."""
+        n = len(self.counts)
+        slot = bucket % n
+        if self.stamps[slot] != bucket:
+            self.stamps[slot] = bucket
+            self.counts[slot] = 0
+        self.counts[slot] += 1
+        return self.count(bucket)
+
+    def count(self, bucket: int) -> int:
+        n = len(self.counts)
+        return sum(c for c, s in zip(self.counts, self.stamps) if bucket - s < n)
+
+
+class _Strikes:
+    __slots__ = ("window", "flagged_at")
+
+    def __init__(self, buckets: int):
+        self.window = SlidingWindow(buckets)
+        self.flagged_at = float("-inf")
+
+
+class RateLimiter:
+    def __init__(self, rules: Iterable[Rule], buckets: int = 10, max_keys: int = 50_000,
+                 abuse_strikes: int = 30, abuse_window_s: float = 60,
+                 abuse_cooldown_s: float = 600,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rules = list(rules)
+        self.buckets = buckets
+        self.max_keys = max_keys
+        self.abuse_strikes = abuse_strikes
+        self.abuse_window_s = abuse_window_s
+        self.abuse_cooldown_s = abuse_cooldown_s
+        self.clock = clock
+        self._windows: "OrderedDict[Tuple[int, str], SlidingWindow]" = OrderedDict()
+        self._strikes: "OrderedDict[int, _Strikes]" = OrderedDict()
+
+    def rule_for(self, data: str) -> Optional[Rule]:
+        for rule in self.rules:
+            if rule[0] == "*" or data.startswith(rule[0]):
+                return rule
+        return None
+
+    def _touch(self, table: "OrderedDict", key, factory):
+        item = table.get(key)
+        if item is None:
+            item = table[key] = factory()
+            if len(table) > self.max_keys:
+                table.popitem(last=False)
+        else:
+            table.move_to_end(key)
+        return item
+
+    def allow(self, tg_id: int, data: str) -> bool:
+        """Count one press; False if the user is over the limit for its rule."""
+        rule = self.rule_for(data)
+        if rule is None:
+            return True
+        prefix, limit, window_s = rule
+        bucket = int(self.clock() * self.buckets / window_s)
+        win = self._touch(self._windows, (tg_id, prefix), lambda: SlidingWindow(self.buckets))
+        return win.hit(bucket) <= limit
+
+    def strike(self, tg_id: int) -> Optional[int]:
+        """Record a throttled press; returns the strike count when the user should be flagged."""
+        now = self.clock()
+        st = self._touch(self._strikes, tg_id, lambda: _Strikes(self.buckets))
+        strikes = st.window.hit(int(now * self.buckets / self.abuse_window_s))
+        if strikes < self.abuse_strikes or now - st.flagged_at < self.abuse_cooldown_s:
+            return None
+        st.flagged_at = now
+        return strikes
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, limiter: RateLimiter, on_abuse: Optional[AbuseHandler] = None,
+                 exempt: Iterable[int] = ()):
+        self.limiter = limiter
+        self.on_abuse = on_abuse
+        self.exempt = set(exempt)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, CallbackQuery) or event.from_user.id in self.exempt:
+            return await handler(event, data)
+        tg_id = event.from_user.id
+        cb_data = event.data or ""
+        if self.limiter.allow(tg_id, cb_data):
+            return await handler(event, data)
+        strikes = self.limiter.strike(tg_id)
+        if strikes is not None:
+            log.warning("throttle: user %s hit the limit %s times (last: %s)", tg_id, strikes, cb_data)
+            if self.on_abuse:
+                try:
+                    await self.on_abuse(tg_id, cb_data, strikes)
+                except Exception:
+                    log.warning("throttle: abuse report for %s failed", tg_id)
+        return await event.answer("Slow down.")
@@ -0,0 +1,125 @@
+"""
+In-process cache of user rows for read-mostly balance renders.
+
+Handlers render the balance on nearly every callback (bet builder chips,
+roulette chips, results). get_user() serves those from memory and only
+goes to storage on a miss or when the username changed (so renames and
+account creation still run through Storage.get_or_create_user). Only
+"available" (what the user can stake, the value balance listeners carry)
+and username are kept current in a cached row; read anything else
+(balance, held, last_bonus_at, ...) from storage.
+
+Write-through: every committed balance change in storage fires
+Storage.balance_listeners, and update() applies it to the cached row.
+Every mutation path of the engines already notifies, so the cache
+needs no hooks of its own in storage.
+
+Races: a miss reads the row from storage while a write may be
+committing. Changes notified while the read is in flight are applied to
+the row it returns before it is cached (notifications arrive in commit
+order, so the last one is the newest committed value); an invalidate()
+during the read keeps the row out of the cache.
+
+Admin commands call invalidate(); reconcile() periodically compares
+cached available balances against storage, fixes and counts any drift
+(e.g. rows edited with the bot stopped, or a bug in a write path).
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+
+class BalanceCache:
+    def __init__(self, db, capacity: int = 50_000):
+        self.db = db
+        self.capacity = capacity
+        # tg_id -> [row, seq]; seq counts notified changes, for reconcile().
+        self._rows: "OrderedDict[int, List[Any]]" = OrderedDict()
+        # tg_id -> {"readers", "available", "username", "dropped"} while a miss reads storage
+        self._inflight: Dict[int, Dict[str, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+        db.balance_listeners.append(self.update)
+
+    def update(self, tg_id: int, available: int, username: Optional[str] = None) -> None:
+        """Balance listener: write-through for cached users."""
+        flight = self._inflight.get(tg_id)
+        if flight:
+            flight["available"] = available
+            if username:
+                flight["username"] = username
+        entry = self._rows.get(tg_id)
+        if entry is not None:
+            entry[0]["available"] = available
+            if username:
+                entry[0]["username"] = username
+            entry[1] += 1
+
+    def invalidate(self, tg_id: Optional[int] = None) -> None:
+        """Drop one user (or everyone); the next get_user reads storage."""
+        if tg_id is None:
+            self._rows.clear()
+            for flight in self._inflight.values():
+                flight["dropped"] = True
+            return
+        self._rows.pop(tg_id, None)
+        flight = self._inflight.get(tg_id)
+        if flight:
+            flight["dropped"] = True
+
+    def _store(self, tg_id: int, row: Dict[str, Any]) -> None:
+        self._rows[tg_id] = [dict(row), 0]
+        self._rows.move_to_end(tg_id)
+        if len(self._rows) > self.capacity:
+            self._rows.popitem(last=False)
+
+    async def get_user(self, tg_id: int, username: Optional[str]) -> Dict[str, Any]:
+        """Same contract as Storage.get_or_create_user, served from memory when possible."""
+        entry = self._rows.get(tg_id)
+        if entry is not None and (not username or username == entry[0]["username"]):
+            self._rows.move_to_end(tg_id)
+            self.hits += 1
+            return dict(entry[0])
+        self.misses += 1
+        flight = self._inflight.setdefault(
+            tg_id, {"readers": 0, "available": None, "username": None, "dropped": False}
+        )
+        flight["readers"] += 1
+        try:
+            row = await self.db.get_or_create_user(tg_id, username)
+        finally:
+            flight["readers"] -= 1
+            if not flight["readers"]:
+                self._inflight.pop(tg_id, None)
+        if flight["available"] is not None:
+            row["available"] = flight["available"]
+        if flight["username"]:
+            row["username"] = flight["username"]
+        if not flight["dropped"]:
+            self._store(tg_id, row)
+        return row
+
+    async def reconcile(self, chunk: int = 500) -> Dict[str, int]:
+        """Compare every cached available balance with storage; fix and count drift."""
+        counts = {"checked": 0, "drift": 0, "evicted": 0}
+        ids = list(self._rows)
+        for i in range(0, len(ids), chunk):
+            part = ids[i:i + chunk]
+            seqs = {tg: self._rows[tg][1] for tg in part if tg in self._rows}
+            stored = await self.db.get_balances(list(seqs))
+            for tg, seq in seqs.items():
+                entry = self._rows.get(tg)
+                if entry is None or entry[1] != seq:
+                    continue  # changed while we read; the listener has the newer value
+                counts["checked"] += 1
+                if tg not in stored:
+                    del self._rows[tg]
+                    counts["evicted"] += 1
+                elif stored[tg] != entry[0]["available"]:
+                    log.warning("balance cache: %s had %s, storage has %s", tg, entry[0]["available"], stored[tg])
+                    entry[0]["available"] = stored[tg]
+                    counts["drift"] += 1
+        return counts
@@ -0,0 +1,61 @@
+"""
+The process-wide wall clock, in epoch milliseconds (UTC).
+
+Storage stamps (created_at / updated_at), rollup buckets, bonus
+cooldowns, TTL reaping and /stats windows all read now_ms() from here, so
+tests and simulations move time for the whole process at once:
+
+    with clock.frozen(1_700_000_000_000) as t:
+        ...                 # every now_ms() returns the frozen value
+        t.advance(60_000)   # one minute later, everywhere
+
+The source is looked up once per call and nothing is formatted: stamps
+are plain ints, and ISO strings only exist at the edges (exports, old
+archive blocks, the *_iso compatibility views).
+"""
+
+import datetime
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+_source: Callable[[], int] = time.time_ns
+_frozen: Optional[int] = None
+
+
+def now_ms() -> int:
+    return _frozen if _frozen is not None else _source() // 1_000_000
+
+
+class _Frozen:
+    def advance(self, ms: int) -> int:
+        global _frozen
+        _frozen += ms
+        return _frozen
+
+    def set(self, ms: int) -> None:
+        global _frozen
+        _frozen = ms
+
+
+@contextmanager
+def frozen(at_ms: Optional[int] = None) -> Iterator[_Frozen]:
+    """Stop the clock at at_ms (default: now) until the block exits."""
+    global _frozen
+    previous = _frozen
+    _frozen = now_ms() if at_ms is None else at_ms
+    try:
+        yield _Frozen()
+    finally:
+        _frozen = previous
+
+
+def iso_to_ms(iso: str) -> int:
+    """'2025-03-14T10:00:00.123456' (naive UTC) -> epoch ms."""
+    dt = datetime.datetime.fromisoformat(iso).replace(tzinfo=datetime.timezone.utc)
+    return round(dt.timestamp() * 1000)
+
+
+def ms_to_iso(ms: int) -> str:
+    """Epoch ms -> naive UTC ISO string, the format rows used before epoch-ms columns."""
+    return datetime.datetime.fromtimestamp(ms / 1000, datetime.timezone.utc).replace(tzinfo=None).isoformat()
@@ -0,0 +1,89 @@
+"""
+Streaming bet-history export to gzip'd CSV or JSONL.
+
+Archived rows (storage.archive segments) are written first, then live rows
+page by page via Database.iter_bets, so memory stays constant no matter how
+large the history is. With storage.sharded the same is done shard by shard.
+created_at is written as an ISO string (UTC), as before the epoch-ms columns.
+"""
+
+import asyncio
+import csv
+import gzip
+import io
+import json
+from typing import Any, Dict, Iterable, List, Optional
+
+from services.clock import ms_to_iso
+from storage import archive
+
+FIELDS = ["id", "tg_id", "username", "game", "amount", "result", "delta", "created_at"]
+FORMATS = ("csv", "jsonl")
+ARCHIVE_CHUNK = 5000
+
+
+class _Writer:
+    def __init__(self, path: str, fmt: str):
+        self.fmt = fmt
+        self.f = gzip.open(path, "wt", encoding="utf-8", newline="")
+        self.count = 0
+        if fmt == "csv":
+            self.csv = csv.DictWriter(self.f, fieldnames=FIELDS, extrasaction="ignore")
+            self.csv.writeheader()
+
+    def write(self, rows: Iterable[Dict[str, Any]]) -> None:
+        if self.fmt == "csv":
+            for r in rows:
+                self.csv.writerow({**r, "created_at": ms_to_iso(r["created_at"])})
+                self.count += 1
+            return
+        buf = io.StringIO()
+        for r in rows:
+            out = {k: r.get(k) for k in FIELDS}
+            out["created_at"] = ms_to_iso(out["created_at"])
+            buf.write(json.dumps(out, ensure_ascii=False))
+            buf.write("\n")
+            self.count += 1
+        self.f.write(buf.getvalue())
+
+    def close(self) -> None:
+        self.f.close()
+
+
+def _export_archive(writer: _Writer, archive_dir: str, tg_id: Optional[int],
+                    since_ms: Optional[int], until_ms: Optional[int]) -> None:
+    chunk: List[Dict[str, Any]] = []
+    for row in archive.iter_archived_bets(archive_dir, tg_id):
+        if since_ms is not None and row["created_at"] < since_ms:
+            continue
+        if until_ms is not None and row["created_at"] >= until_ms:
+            continue
+        chunk.append(row)
+        if len(chunk) >= ARCHIVE_CHUNK:
+            writer.write(chunk)
+            chunk = []
+    writer.write(chunk)
+
+
+async def export_bets(db, path: str, fmt: str = "csv", tg_id: Optional[int] = None,
+                      since_ms: Optional[int] = None, until_ms: Optional[int] = None) -> int:
+    """
+    Write matching bets (created_at in [since_ms, until_ms)) to a gzip file
+    at path. Returns the number of rows written.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format: {fmt}")
+    writer = _Writer(path, fmt)
+    if hasattr(db, "shards"):
+        parts = [db.shard_for(tg_id)] if tg_id is not None else db.shards
+    else:
+        parts = [db]
+    try:
+        for part in parts:
+            if part.archive_dir:
+                await asyncio.to_thread(_export_archive, writer, part.archive_dir, tg_id, since_ms, until_ms)
+            async for page in part.iter_bets(tg_id, since_ms, until_ms):
+                await asyncio.to_thread(writer.write, page)
+    finally:
+        writer.close()
+    return writer.count
@@ -0,0 +1,76 @@
+"""
+In-memory top-K balance leaderboard.
+
+Holds the best `capacity` users and is updated incrementally from
+Database.balance_listeners, so /top never sorts the users table.
+
+Invariant: every user NOT held in `entries` has balance <= `floor`.
+`floor is None` means every user is held (the table was smaller than
+capacity at the last rebuild). When a held user drops below the floor
+they are evicted; if that leaves fewer than K entries the board is
+rebuilt from SQLite (an O(capacity) index walk) on the next read.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+
+class Leaderboard:
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        self.entries: Dict[int, Tuple[int, Optional[str]]] = {}
+        self.floor: Optional[int] = None
+        self.loaded = False
+        self._sorted: Optional[List[Tuple[int, int, Optional[str]]]] = None
+
+    def load(self, rows: List[dict]) -> None:
+        """Replace contents with rows sorted by balance DESC (at most capacity)."""
+        rows = rows[: self.capacity]
+        self.entries = {r["tg_id"]: (int(r["balance"]), r.get("username")) for r in rows}
+        self.floor = int(rows[-1]["balance"]) if len(rows) >= self.capacity else None
+        self.loaded = True
+        self._sorted = None
+
+    async def rebuild(self, db) -> None:
+        self.load(await db.top_balances(self.capacity))
+
+    def update(self, tg_id: int, balance: int, username: Optional[str] = None) -> None:
+        """Balance listener: keep the invariant after one user's balance changed."""
+        if not self.loaded:
+            return
+        held = self.entries.get(tg_id)
+        if held is not None:
+            name = username if username is not None else held[1]
+            if self.floor is None or balance >= self.floor:
+                self.entries[tg_id] = (balance, name)
+            else:
+                del self.entries[tg_id]
+            self._sorted = None
+            return
+        if self.floor is not None and balance <= self.floor:
+            return
+        self.entries[tg_id] = (balance, username)
+        if len(self.entries) > self.capacity:
+            low_id = min(self.entries, key=lambda k: self.entries[k][0])
+            self.floor = self.entries.pop(low_id)[0]
+        self._sorted = None
+
+    def top(self, k: int) -> Optional[List[Tuple[int, int, Optional[str]]]]:
+        """Top k as (tg_id, balance, username), or None if a rebuild is needed."""
+        if not self.loaded or k > self.capacity:
+            return None
+        if len(self.entries) < k and self.floor is not None:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(
+                ((tg, bal, name) for tg, (bal, name) in self.entries.items()),
+                key=lambda e: e[1],
+                reverse=True,
+            )
+        return self._sorted[:k]
+
+    async def get(self, db, k: int) -> List[Tuple[int, int, Optional[str]]]:
+        res = self.top(k)
+        if res is None:
+            await self.rebuild(db)
+            res = self.top(k) or []
+        return res
@@ -0,0 +1,84 @@
+"""
+Process lifecycle: draining in-flight work before shutdown.
+
+Every update is counted while its handler runs (see middlewares.drain).
+On SIGTERM/SIGINT the handler installed by stop_on_signals():
+
+1. flips `draining` at once, so updates still being dispatched (the rest
+   of the last fetched batch) that would open a new round are refused,
+2. asks the dispatcher to stop polling.
+
+Once polling has stopped the dispatcher runs shutdown() below, which
+waits up to the deadline for in-flight handlers (blackjack dealer reveal,
+roulette spin animation, settlement) to finish, stops the scheduler and
+waits for running jobs under the same deadline, and closes the database
+(final WAL checkpoint).
+
+Anything still running at the deadline is left to the startup recovery
+sweep, which settles or refunds it on the next start.
+"""
+
+import asyncio
+import logging
+import signal
+import time
+from contextlib import asynccontextmanager, suppress
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+log = logging.getLogger(__name__)
+
+
+class Lifecycle:
+    def __init__(self, deadline_s: float = 20):
+        self.deadline_s = deadline_s
+        self.draining = False
+        self.inflight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._stopping: Optional[asyncio.Future] = None
+
+    def stop_on_signals(self, stop_polling: Callable[[], Awaitable[None]]) -> None:
+        """
+        Handle SIGTERM/SIGINT in place of the dispatcher's own handlers (start
+        polling with handle_signals=False): refuse new rounds first, then stop.
+        """
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            with suppress(NotImplementedError):  # no loop signal handlers on Windows
+                loop.add_signal_handler(sig, self._on_signal, sig, stop_polling)
+
+    def _on_signal(self, sig: signal.Signals, stop_polling: Callable[[], Awaitable[None]]) -> None:
+        log.warning("received %s, draining", sig.name)
+        self.draining = True
+        if self._stopping is None:
+            self._stopping = asyncio.ensure_future(stop_polling())
+
+    @asynccontextmanager
+    async def track(self) -> AsyncIterator[None]:
+        self.inflight += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            if self.inflight == 0:
+                self._idle.set()
+
+    async def drain(self, timeout_s: float) -> int:
+        """Stop taking new rounds and wait for in-flight handlers. Returns how many are left."""
+        self.draining = True
+        if self.inflight:
+            log.info("draining %d in-flight update(s)", self.inflight)
+        try:
+            await asyncio.wait_for(self._idle.wait(), max(0.0, timeout_s))
+        except asyncio.TimeoutError:
+            log.warning("drain deadline hit with %d update(s) still running", self.inflight)
+        return self.inflight
+
+    async def shutdown(self, db, scheduler: Optional[object] = None) -> None:
+        deadline = time.monotonic() + self.deadline_s
+        await self.drain(self.deadline_s)
+        if scheduler is not None:
+            await scheduler.stop(max(0.0, deadline - time.monotonic()))
+        await db.close()
+        log.info("shutdown complete")
@@ -0,0 +1,123 @@
+"""
+Crash-recovery sweep and stale-round reaper for active rounds.
+
+A round can be left in active_rounds if the process dies mid-settlement
+(roulette spin animation, blackjack dealer reveal). The sweep walks all
+active rounds in batches and, per batch, closes in ONE transaction:
+
+- decided rounds -> settled exactly as the handler would have:
+    roulette spun with a result, blackjack with every hand played
+    (the dealer draws from the saved deck, so this is deterministic)
+- rounds idle longer than the TTL that are not decided -> stake refunded
+  (an interrupted spin that never drew a number is refunded too)
+
+recover_rounds() scans every round and is meant for startup. The
+periodic reap_stale_rounds() only visits rounds idle longer than the TTL,
+through the updated_at index, so its cost does not grow with the number
+of live sessions.
+"""
+
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from games import registry
+from services import clock
+
+log = logging.getLogger(__name__)
+
+blackjack = registry.lazy("blackjack")
+roulette = registry.lazy("roulette")
+
+# Outcome: (result flag or None for a plain refund, amount to credit)
+Outcome = Tuple[Optional[str], int]
+
+
+def _age_s(row: Dict[str, Any], now_ms: int) -> float:
+    try:
+        return (now_ms - int(row["updated_at"])) / 1000
+    except (TypeError, ValueError):
+        return float("inf")
+
+
+def decide(row: Dict[str, Any], stale: bool) -> Optional[Outcome]:
+    """What to do with one active round, or None to leave it alone."""
+    try:
+        if row["game"] == "roulette":
+            state = roulette.from_json(row["state_json"])
+            if state.get("spun") and state.get("result") is not None:
+                payout = roulette.evaluate(state, int(state["result"]))
+                return ("win" if payout > 0 else "loss", payout)
+            if state.get("spun") or stale:
+                return (None, row["bet"])
+            return None
+        if row["game"] == "blackjack":
+            st = blackjack.BlackjackState.from_json(row["state_json"])
+            if st.state["current_hand"] >= len(st.state["player_hands"]):
+                eval_res = blackjack.play_out(st)
+                payout = sum(p for (_t, p, _m) in eval_res["results"])
+                return (blackjack.overall_flag(eval_res["results"]), payout)
+            return (None, row["bet"]) if stale else None
+    except Exception:
+        log.exception("recovery: unreadable state for round %s, refunding", row.get("id"))
+        return (None, row["bet"])
+    return (None, row["bet"]) if stale else None
+
+
+async def recover_rounds(db, ttl_s: float, grace_s: float = 0, batch_size: int = 200) -> Dict[str, int]:
+    """Sweep active_rounds once. Returns counts: scanned, settled, refunded, kept."""
+    counts = {"scanned": 0, "settled": 0, "refunded": 0, "kept": 0}
+    now = clock.now_ms()
+    async for batch in db.iter_active_rounds(batch_size):
+        todo = []
+        for row in batch:
+            counts["scanned"] += 1
+            age = _age_s(row, now)
+            # "idle longer than the TTL", the same strict cutoff as stale_active_rounds
+            outcome = decide(row, stale=age > ttl_s) if age >= grace_s else None
+            if outcome is None:
+                counts["kept"] += 1
+                continue
+            todo.append((row, outcome[0], outcome[1]))
+        for _row, result, _payout in await db.settle_rounds(todo):
+            counts["refunded" if result is None else "settled"] += 1
+    if counts["settled"] or counts["refunded"]:
+        log.info("recovery: %s", counts)
+    return counts
+
+
+Notifier = Callable[[int, str], Awaitable[None]]
+
+
+def describe(row: Dict[str, Any], result: Optional[str], payout: int) -> str:
+    game = "Blackjack" if row["game"] == "blackjack" else row["game"].title()
+    if result is None:
+        return f"⏱ Your idle {game} round was closed and {payout} credits were refunded."
+    return f"⏱ Your idle {game} round was settled ({result}), payout {payout} credits."
+
+
+async def reap_stale_rounds(db, ttl_s: float, batch_size: int = 200,
+                            notify: Optional[Notifier] = None) -> Dict[str, int]:
+    """Settle or refund rounds idle for more than ttl_s, one transaction per batch."""
+    counts = {"settled": 0, "refunded": 0}
+    while True:
+        batch = await db.stale_active_rounds(ttl_s, batch_size)
+        if not batch:
+            break
+        todo = []
+        for row in batch:
+            outcome = decide(row, stale=True)
+            if outcome is not None:
+                todo.append((row, outcome[0], outcome[1]))
+        closed = await db.settle_rounds(todo)
+        for row, result, payout in closed:
+            counts["refunded" if result is None else "settled"] += 1
+            if notify:
+                try:
+                    await notify(row["tg_id"], describe(row, result, payout))
+                except Exception:
+                    log.warning("reaper: could not notify %s", row["tg_id"])
+        if len(batch) < batch_size or not closed:
+            break
+    if counts["settled"] or counts["refunded"]:
+        log.info("reaper: %s", counts)
+    return counts
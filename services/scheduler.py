@@ -0,0 +1,73 @@
+"""
+In-process background scheduler (APScheduler 3.x, asyncio flavour).
+
+Every job runs with max_instances=1 and coalesce=True, so a slow run is
+never overlapped by the next tick and missed ticks collapse into one.
+A small random jitter spreads jobs out so they don't all hit SQLite at
+the same moment after a restart.
+
+stop() is the graceful variant of shutdown(): no new runs are started and
+jobs already running get until the deadline to finish.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Set
+
+log = logging.getLogger(__name__)
+
+
+def _guarded(name: str, job: Callable[[], Awaitable[object]], running: Set["asyncio.Task"]):
+    async def run():
+        task = asyncio.current_task()
+        running.add(task)
+        try:
+            await job()
+        except Exception:
+            log.exception("scheduled job %s failed", name)
+        finally:
+            running.discard(task)
+    run.__name__ = name
+    return run
+
+
+class Scheduler:
+    def __init__(self, jitter_s: int = 10):
+        self.jitter_s = jitter_s
+        # Imported here so that importing the bot does not pay for APScheduler.
+        from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+        self._sched = AsyncIOScheduler(timezone="UTC")
+        self._running: Set[asyncio.Task] = set()
+
+    def every(self, seconds: float, name: str, job: Callable[[], Awaitable[object]]) -> None:
+        """Run job every `seconds` (plus up to jitter_s), never overlapping itself."""
+        self._sched.add_job(
+            _guarded(name, job, self._running),
+            "interval",
+            seconds=max(1, int(seconds)),
+            jitter=self.jitter_s or None,
+            id=name,
+            name=name,
+            max_instances=1,
+            coalesce=True,
+            misfire_grace_time=max(1, int(seconds)),
+            replace_existing=True,
+        )
+
+    def start(self) -> None:
+        self._sched.start()
+
+    def shutdown(self, wait: bool = False) -> None:
+        if self._sched.running:
+            self._sched.shutdown(wait=wait)
+
+    async def stop(self, timeout_s: float) -> None:
+        """Stop scheduling and wait up to timeout_s for running jobs."""
+        self.shutdown()
+        pending = [t for t in self._running if not t.done()]
+        if not pending:
+            return
+        done, left = await asyncio.wait(pending, timeout=max(0.0, timeout_s))
+        if left:
+            log.warning("%d scheduled job(s) still running at shutdown", len(left))
@@ -0,0 +1,32 @@
+"""
+Admin-side user lookup by "@username" or numeric tg_id.
+
+Usernames are matched case-insensitively through idx_users_username_nocase,
+so either form is a single indexed query and nothing is cached here: the
+row returned is always fresh, and renames need no invalidation.
+"""
+
+from typing import Any, Dict, Optional
+
+
+class UserDirectory:
+    def __init__(self, db):
+        self.db = db
+
+    async def resolve(self, identifier: str, create: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Full user row for "@username" or a numeric tg_id, in one query.
+        With create=True an unknown numeric id gets a fresh account
+        (same as the old /give behaviour); unknown usernames never do.
+        """
+        identifier = identifier.strip()
+        if identifier.startswith("@"):
+            name = identifier[1:].lower()
+            return await self.db.find_user(username=name) if name else None
+        if identifier.isdigit():
+            tg_id = int(identifier)
+            row = await self.db.find_user(tg_id=tg_id)
+            if row is None and create:
+                row = await self.db.get_or_create_user(tg_id, None)
+            return row
+        return None
@@ -0,0 +1,215 @@
+"""
+Append-only, columnar, zlib-compressed segment files for archived bets.
+
+One file per month: <archive_dir>/bets-YYYY-MM.seg
+
+    file   := MAGIC block*
+    block  := header payload
+    header := struct "<4sIIqq" (tag, n_rows, payload_len, min_id, max_id)
+    payload:= for each column of the tag's layout: uint32 length + zlib(column bytes)
+
+Integer columns are little-endian int64 arrays, text columns are
+NUL-joined UTF-8. Blocks are written with tag b"BLK2" (COLUMNS,
+created_at in epoch ms); b"BLK1" blocks from before the epoch-ms
+migration store created_at as ISO text and are converted when read, so a
+month file may hold both. Blocks are written in ascending id order, so readers
+drop any row whose id is not greater than the last one seen; a block
+re-appended after a crash (before the live rows were deleted) is
+therefore harmless. A torn tail block is ignored by readers and cut off
+by the next append.
+"""
+
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from services.clock import iso_to_ms
+
+MAGIC = b"CSNSEG1\n"
+HEADER = struct.Struct("<4sIIqq")
+BLOCK_TAG = b"BLK2"
+LEN = struct.Struct("<I")
+
+COLUMNS: List[Tuple[str, str]] = [
+    ("id", "int"),
+    ("tg_id", "int"),
+    ("username", "text"),
+    ("game", "text"),
+    ("amount", "int"),
+    ("result", "text"),
+    ("delta", "int"),
+    ("created_at", "int"),
+]
+# Block layouts by tag; BLK1 is read only.
+LAYOUTS: Dict[bytes, List[Tuple[str, str]]] = {
+    b"BLK1": COLUMNS[:-1] + [("created_at", "text")],
+    BLOCK_TAG: COLUMNS,
+}
+
+_SWAP = sys.byteorder != "little"
+
+
+def segment_name(created_at_ms: int) -> str:
+    """1741946400000 (2025-03-14T10:00:00Z) -> 'bets-2025-03.seg'"""
+    return time.strftime("bets-%Y-%m.seg", time.gmtime(created_at_ms // 1000))
+
+
+def list_segments(archive_dir: str) -> List[Path]:
+    """Segment files, oldest month first."""
+    d = Path(archive_dir)
+    if not d.is_dir():
+        return []
+    return sorted(d.glob("bets-*.seg"))
+
+
+# ---------------- Encoding ----------------
+
+def _encode_column(values: List[Any], kind: str) -> bytes:
+    if kind == "int":
+        arr = array("q", (int(v) for v in values))
+        if _SWAP:
+            arr.byteswap()
+        raw = arr.tobytes()
+    else:
+        raw = "\x00".join("" if v is None else str(v) for v in values).encode("utf-8")
+    return zlib.compress(raw, 6)
+
+
+def _decode_column(data: bytes, kind: str, n: int) -> List[Any]:
+    raw = zlib.decompress(data)
+    if kind == "int":
+        arr = array("q")
+        arr.frombytes(raw)
+        if _SWAP:
+            arr.byteswap()
+        return arr.tolist()
+    if n == 0:
+        return []
+    return raw.decode("utf-8").split("\x00")
+
+
+def encode_block(rows: List[Dict[str, Any]]) -> bytes:
+    payload = bytearray()
+    for name, kind in COLUMNS:
+        col = _encode_column([r.get(name) for r in rows], kind)
+        payload += LEN.pack(len(col)) + col
+    ids = [int(r["id"]) for r in rows]
+    return HEADER.pack(BLOCK_TAG, len(rows), len(payload), min(ids), max(ids)) + bytes(payload)
+
+
+# ---------------- Reading ----------------
+
+def _scan(buf) -> Iterator[Tuple[int, int, int, int, int, bytes]]:
+    """Yield (offset, n_rows, payload_len, min_id, max_id, tag) for every complete block."""
+    if len(buf) < len(MAGIC) or buf[: len(MAGIC)] != MAGIC:
+        return
+    off = len(MAGIC)
+    end = len(buf)
+    while off + HEADER.size <= end:
+        tag, n, plen, lo, hi = HEADER.unpack_from(buf, off)
+        if tag not in LAYOUTS or off + HEADER.size + plen > end:
+            return
+        yield off, n, plen, lo, hi, tag
+        off += HEADER.size + plen
+
+
+def _decode_payload(buf, off: int, n: int, tag: bytes = BLOCK_TAG,
+                    names: Optional[List[str]] = None) -> Dict[str, List[Any]]:
+    pos = off + HEADER.size
+    cols: Dict[str, List[Any]] = {}
+    for name, kind in LAYOUTS[tag]:
+        (clen,) = LEN.unpack_from(buf, pos)
+        pos += LEN.size
+        if names is None or name in names:
+            cols[name] = _decode_column(bytes(buf[pos:pos + clen]), kind, n)
+        pos += clen
+    if tag == b"BLK1" and "created_at" in cols:
+        cols["created_at"] = [iso_to_ms(v) for v in cols["created_at"]]
+    return cols
+
+
+class Segment:
+    """Read-only, memory-mapped view of one segment file."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._f = open(self.path, "rb")
+        size = os.fstat(self._f.fileno()).st_size
+        self.buf = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def close(self) -> None:
+        if isinstance(self.buf, mmap.mmap):
+            self.buf.close()
+        self._f.close()
+
+    def __enter__(self) -> "Segment":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def blocks(self, columns: Optional[List[str]] = None) -> Iterator[Dict[str, List[Any]]]:
+        """Decoded column blocks (optionally only some columns), oldest first."""
+        for off, n, _plen, _lo, _hi, tag in _scan(self.buf):
+            yield _decode_payload(self.buf, off, n, tag, columns)
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        last_id = None
+        names = [c for c, _ in COLUMNS]
+        for cols in self.blocks():
+            for values in zip(*(cols[c] for c in names)):
+                row = dict(zip(names, values))
+                if last_id is not None and row["id"] <= last_id:
+                    continue
+                last_id = row["id"]
+                row["username"] = row["username"] or None
+                yield row
+
+
+def iter_archived_bets(archive_dir: str, tg_id: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Stream every archived bet (optionally for one user), oldest first."""
+    for path in list_segments(archive_dir):
+        with Segment(path) as seg:
+            for row in seg.rows():
+                if tg_id is None or row["tg_id"] == tg_id:
+                    yield row
+
+
+# ---------------- Writing ----------------
+
+def append_rows(archive_dir: str, name: str, rows: List[Dict[str, Any]]) -> int:
+    """
+    Append rows (ascending id) as one block to archive_dir/name, fsync'd.
+    Rows already present in the file are skipped. Returns rows written.
+    """
+    path = Path(archive_dir) / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    good_end = 0
+    max_id = None
+    if path.exists():
+        with Segment(path) as seg:
+            good_end = len(MAGIC) if seg.buf[: len(MAGIC)] == MAGIC else 0
+            for off, _n, plen, _lo, hi, _tag in _scan(seg.buf):
+                good_end = off + HEADER.size + plen
+                max_id = hi
+    if max_id is not None:
+        rows = [r for r in rows if r["id"] > max_id]
+    if not rows:
+        return 0
+    with open(path, "r+b" if path.exists() else "wb") as f:
+        if good_end == 0:
+            f.truncate(0)
+            f.write(MAGIC)
+        else:
+            f.truncate(good_end)
+            f.seek(good_end)
+        f.write(encode_block(rows))
+        f.flush()
+        os.fsync(f.fileno())
+    return len(rows)
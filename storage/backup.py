@@ -0,0 +1,250 @@
+"""
+Online backups of the SQLite files, taken while the bot keeps running.
+
+    python -m storage.backup create  --db data/casino.db --dir data/backups
+    python -m storage.backup list    --db data/casino.db --dir data/backups
+    python -m storage.backup verify  data/backups/casino-20260301T120000Z.db.gz
+    python -m storage.backup restore data/backups/casino-20260301T120000Z.db.gz --db data/casino.db
+
+Copying casino.db with cp is not a backup under WAL (committed pages may
+still live in casino.db-wal). snapshot() uses SQLite's online backup API
+instead, in steps of `pages` pages with `step_sleep_s` between steps:
+
+- The source connection is read-only and holds one read transaction for
+  the whole copy, so the snapshot is consistent as of its start. Under WAL
+  that never blocks the writer; without it, every commit made during the
+  copy would restart the backup from page 1.
+- Each step holds no lock the writer needs, and both the step and the
+  sleep release the GIL, so the event loop keeps serving callbacks while
+  Database.backup runs this in a thread. Pacing only bounds the disk I/O
+  competing with gameplay writes (benchmarks/backup.py measures it).
+- WAL checkpoints cannot move past the pinned snapshot until the copy
+  ends, so the -wal file may grow for the duration of a backup.
+
+The copy is integrity-checked before it is gzip-compressed to
+<dir>/<stem>-YYYYmmddTHHMMSSZ.db.gz (written under a temporary name and
+renamed, so a listed snapshot is always complete). Only the newest `keep`
+snapshots per database file are kept. Shards are separate files
+(casino.shard0of4-...db.gz); back them up and restore them together.
+
+restore refuses to overwrite an existing database unless --force, in
+which case the old file is kept next to it as <db>.before-restore. Stop
+the bot before restoring.
+"""
+
+import argparse
+import datetime
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from storage.connections import ro_uri
+
+SUFFIX = ".db.gz"
+STAMP = "%Y%m%dT%H%M%SZ"
+
+
+class BackupAborted(Exception):
+    pass
+
+
+def snapshot_name(db_path: str, when: Optional[datetime.datetime] = None) -> str:
+    """'data/casino.db' -> 'casino-20260301T120000Z.db.gz'"""
+    when = when or datetime.datetime.utcnow()
+    return f"{Path(db_path).stem}-{when.strftime(STAMP)}{SUFFIX}"
+
+
+def list_snapshots(backup_dir: str, db_path: str) -> List[Path]:
+    """Snapshots of one database file, oldest first."""
+    d = Path(backup_dir)
+    if not d.is_dir():
+        return []
+    return sorted(d.glob(f"{Path(db_path).stem}-*{SUFFIX}"))
+
+
+def integrity_check(path: str) -> List[str]:
+    """Problems reported by PRAGMA integrity_check (empty when the file is sound)."""
+    with closing(sqlite3.connect(ro_uri(path), uri=True)) as c:
+        rows = [r[0] for r in c.execute("PRAGMA integrity_check").fetchall()]
+    return [] if rows == ["ok"] else rows
+
+
+def _counts(path: str) -> Dict[str, int]:
+    with closing(sqlite3.connect(ro_uri(path), uri=True)) as c:
+        return {
+            "users": c.execute("SELECT COUNT(*) FROM users").fetchone()[0],
+            "balance": c.execute("SELECT COALESCE(SUM(balance), 0) FROM users").fetchone()[0],
+            "bets": c.execute("SELECT COUNT(*) FROM bets").fetchone()[0],
+            "active_rounds": c.execute("SELECT COUNT(*) FROM active_rounds").fetchone()[0],
+        }
+
+
+def _fsync(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def snapshot(db_path: str, backup_dir: str, pages: int = 256, step_sleep_s: float = 0.005,
+             keep: int = 8, stop: Optional[threading.Event] = None) -> Dict[str, Any]:
+    """
+    Copy db_path into a new compressed snapshot (blocking; run it in a
+    thread). Setting `stop` aborts between steps with BackupAborted.
+    Raises RuntimeError when the copy fails its integrity check.
+    """
+    out_dir = Path(backup_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    final = out_dir / snapshot_name(db_path)
+    raw = out_dir / f".{final.name[:-len('.gz')]}.tmp"
+    part = out_dir / f".{final.name}.part"
+    steps = 0
+
+    def progress(_status: int, remaining: int, _total: int) -> None:
+        nonlocal steps
+        steps += 1
+        if stop is not None and stop.is_set():
+            raise BackupAborted(f"backup of {db_path} aborted after {steps} step(s)")
+        if remaining and step_sleep_s > 0:
+            # Connection.backup(sleep=...) only waits after BUSY/LOCKED, so pace here.
+            time.sleep(step_sleep_s)
+
+    started = time.perf_counter()
+    try:
+        src = sqlite3.connect(ro_uri(db_path), uri=True, isolation_level=None)
+        dst = sqlite3.connect(raw)
+        try:
+            # Pin one read snapshot for the whole copy (see the module docstring).
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchall()
+            src.backup(dst, pages=max(1, pages), progress=progress)
+            src.execute("COMMIT")
+            page_count = dst.execute("PRAGMA page_count").fetchone()[0]
+        finally:
+            src.close()
+            dst.close()
+        copied = time.perf_counter() - started
+
+        problems = integrity_check(str(raw))
+        if problems:
+            raise RuntimeError(f"backup of {db_path} failed its integrity check: {problems[:5]}")
+        with open(raw, "rb") as f_in, gzip.open(part, "wb", compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1 << 20)
+        _fsync(part)
+        os.replace(part, final)
+    finally:
+        raw.unlink(missing_ok=True)
+        part.unlink(missing_ok=True)
+
+    pruned = prune(backup_dir, db_path, keep)
+    return {
+        "path": str(final),
+        "pages": page_count,
+        "steps": steps,
+        "bytes": final.stat().st_size,
+        "copy_s": round(copied, 3),
+        "total_s": round(time.perf_counter() - started, 3),
+        "pruned": pruned,
+    }
+
+
+def prune(backup_dir: str, db_path: str, keep: int) -> int:
+    """Delete all but the newest `keep` snapshots of db_path (keep <= 0 keeps everything)."""
+    if keep <= 0:
+        return 0
+    old = list_snapshots(backup_dir, db_path)[:-keep]
+    for p in old:
+        p.unlink(missing_ok=True)
+    return len(old)
+
+
+def _unpack(snapshot_path: str, target: Path) -> None:
+    with gzip.open(snapshot_path, "rb") as f_in, open(target, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out, 1 << 20)
+
+
+def verify(snapshot_path: str) -> Dict[str, Any]:
+    """Unpack to a temp file, integrity-check it and count its rows."""
+    with tempfile.TemporaryDirectory(prefix="casinon-verify-") as tmp:
+        target = Path(tmp) / "snapshot.db"
+        _unpack(snapshot_path, target)
+        problems = integrity_check(str(target))
+        counts = {} if problems else _counts(str(target))
+    return {"ok": not problems, "problems": problems, **counts}
+
+
+def restore(snapshot_path: str, db_path: str, force: bool = False) -> Dict[str, Any]:
+    """Replace db_path with the snapshot (offline: stop the bot first)."""
+    dest = Path(db_path)
+    if dest.exists() and not force:
+        raise FileExistsError(f"{db_path} exists; pass force=True (--force) to replace it")
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    staged = dest.with_name(dest.name + ".restore")
+    try:
+        _unpack(snapshot_path, staged)
+        problems = integrity_check(str(staged))
+        if problems:
+            raise RuntimeError(f"{snapshot_path} failed its integrity check: {problems[:5]}")
+        counts = _counts(str(staged))
+        _fsync(staged)
+        if dest.exists():
+            # Fold the old WAL into the old file before setting it aside.
+            with closing(sqlite3.connect(dest)) as c:
+                c.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            os.replace(dest, dest.with_name(dest.name + ".before-restore"))
+        for side in ("-wal", "-shm"):
+            Path(str(dest) + side).unlink(missing_ok=True)
+        os.replace(staged, dest)
+    finally:
+        staged.unlink(missing_ok=True)
+    return counts
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Online backups of the Casinon database.")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("create", help="take a snapshot now (the bot may keep running)")
+    c.add_argument("--db", required=True, help="database file (one shard file when DB_SHARDS > 1)")
+    c.add_argument("--dir", required=True, help="BACKUP_DIR")
+    c.add_argument("--pages", type=int, default=256, help="pages copied per step")
+    c.add_argument("--sleep-ms", type=float, default=5, help="pause between steps")
+    c.add_argument("--keep", type=int, default=8, help="snapshots to keep per file (0 = all)")
+    ls = sub.add_parser("list", help="list snapshots, oldest first")
+    ls.add_argument("--db", required=True)
+    ls.add_argument("--dir", required=True)
+    v = sub.add_parser("verify", help="integrity-check a snapshot and print its row counts")
+    v.add_argument("snapshot")
+    r = sub.add_parser("restore", help="replace the database with a snapshot (stop the bot first)")
+    r.add_argument("snapshot")
+    r.add_argument("--db", required=True)
+    r.add_argument("--force", action="store_true", help="replace an existing database (kept as .before-restore)")
+    args = p.parse_args(argv)
+
+    if args.cmd == "create":
+        print(snapshot(args.db, args.dir, args.pages, args.sleep_ms / 1000, args.keep))
+    elif args.cmd == "list":
+        for s in list_snapshots(args.dir, args.db):
+            print(f"{s}  {s.stat().st_size} bytes")
+    elif args.cmd == "verify":
+        result = verify(args.snapshot)
+        print(result)
+        return 0 if result["ok"] else 1
+    else:
+        try:
+            print(f"restored: {restore(args.snapshot, args.db, args.force)}")
+        except FileExistsError as e:
+            p.error(str(e))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""
+Storage interface shared by the engines in this package.
+
+    storage.db.Database        SQLite (aiosqlite), used by the bot
+    storage.memory.MemoryStorage  plain dicts, for tests / benchmarks / simulations
+
+The interface covers users, balances, active rounds and bet history, which
+is what the game handlers and services.recovery need. Leaderboard rollups,
+admin audit, bonus, archive and export stay SQLite-only for now.
+
+Contract every engine must keep (checked by test_storage.py):
+
+- a round's stake is held, not debited: available = balance - holds of
+  the user's open rounds, and only available funds can be staked. User
+  rows carry balance, held and available; every other "balance" returned
+  by a write (and passed to balance listeners) is the available balance.
+- start_active_round: at most one active round per user and game (rounds
+  of different games run side by side); the bet is held in the same
+  step, and nothing changes if the user is missing, already in a round of
+  that game or cannot cover the bet.
+- adjust_active_round_bet: raise the hold and the locked bet together, or
+  do neither.
+- every write to a round bumps its version; save_active_round applies only
+  at the version the caller read (compare-and-swap) and holds its stake
+  in the same step, and settle_rounds skips rows whose version moved.
+- resolve_active_round / settle_rounds: turn the hold into the debit,
+  credit the payout, record the bet and remove the round together.
+- cancel_active_round / reset_active_round: remove (or restart) the round
+  and release its hold together.
+- round methods taking game=None act on the user's most recently touched
+  round (cancel_active_round: on all of them).
+- balance listeners fire only after a change is committed.
+"""
+
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+BalanceListener = Callable[[int, int, Optional[str]], None]
+UsernameListener = Callable[[int, Optional[str], Optional[str]], None]
+
+
+class Storage(ABC):
+    def __init__(self, starting_balance: int):
+        self.starting_balance = starting_balance
+        # Called as listener(tg_id, new_available_balance, username_or_None) after
+        # every committed balance or hold change (e.g. services.leaderboard.Leaderboard.update).
+        self.balance_listeners: List[BalanceListener] = []
+        # Called as listener(tg_id, old_username, new_username) after a rename.
+        self.username_listeners: List[UsernameListener] = []
+
+    def _notify_balance(self, tg_id: int, balance: int, username: Optional[str] = None) -> None:
+        for listener in self.balance_listeners:
+            listener(tg_id, balance, username)
+
+    def _notify_rename(self, tg_id: int, old: Optional[str], new: Optional[str]) -> None:
+        for listener in self.username_listeners:
+            listener(tg_id, old, new)
+
+    async def init(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    # ---------------- Users ----------------
+    @abstractmethod
+    async def get_or_create_user(self, tg_id: int, username: Optional[str]) -> Dict[str, Any]: ...
+
+    @abstractmethod
+    async def find_user(self, tg_id: Optional[int] = None, username: Optional[str] = None) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def update_balance(self, tg_id: int, delta: int, kind: str = "adjust", ref: Optional[int] = None) -> int: ...
+
+    @abstractmethod
+    async def set_balance(self, tg_id: int, amount: int, ref: Optional[int] = None) -> Optional[int]: ...
+
+    @abstractmethod
+    async def get_balances(self, tg_ids: List[int]) -> Dict[int, int]: ...
+
+    @abstractmethod
+    async def top_balances(self, limit: int) -> List[Dict[str, Any]]: ...
+
+    # ---------------- Bets history ----------------
+    @abstractmethod
+    async def record_bet(self, tg_id: int, game: str, amount: int, result: str, delta: int) -> None: ...
+
+    @abstractmethod
+    async def recent_bets(self, tg_id: int, limit: int = 5) -> List[Dict[str, Any]]: ...
+
+    # ---------------- Active rounds ----------------
+    @abstractmethod
+    async def start_active_round(self, tg_id: int, game: str, bet: int, state_json: str) -> bool: ...
+
+    @abstractmethod
+    async def adjust_active_round_bet(self, tg_id: int, delta: int, game: Optional[str] = None) -> bool: ...
+
+    @abstractmethod
+    async def get_active_round(self, tg_id: int, game: Optional[str] = None) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def update_active_round(self, tg_id: int, state_json: str, game: Optional[str] = None) -> None: ...
+
+    @abstractmethod
+    async def save_active_round(self, tg_id: int, state_json: str, version: int, stake: int = 0,
+                                game: Optional[str] = None) -> Dict[str, Any]: ...
+
+    @abstractmethod
+    async def resolve_active_round(self, tg_id: int, result: str, total_payout: int,
+                                   game: Optional[str] = None) -> None: ...
+
+    @abstractmethod
+    async def delete_active_round(self, tg_id: int, game: Optional[str] = None) -> None: ...
+
+    @abstractmethod
+    async def cancel_active_round(self, tg_id: int, refund: bool = True, game: Optional[str] = None) -> Optional[int]: ...
+
+    @abstractmethod
+    async def reset_active_round(self, tg_id: int, state_json: str, game: Optional[str] = None) -> Optional[int]: ...
+
+    @abstractmethod
+    def iter_active_rounds(self, batch_size: int = 200) -> AsyncIterator[List[Dict[str, Any]]]: ...
+
+    @abstractmethod
+    async def stale_active_rounds(self, idle_s: float, limit: int = 200) -> List[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def settle_rounds(self, items: List[tuple]) -> List[tuple]: ...
@@ -0,0 +1,203 @@
+"""
+Connections behind storage.db.Database: one writer task, a pool of readers.
+
+Writer owns the only write connection of a database file. Mutations are
+queued as ops (async callables taking the connection) and applied by a
+single task: whatever is queued when the task wakes up (up to batch_max
+ops) runs in ONE transaction, each op inside its own SAVEPOINT.
+
+- An op that raises is rolled back to its savepoint; the others in the
+  batch still commit, and only that caller gets the exception.
+- Every caller's future resolves after COMMIT, so results (and the balance
+  listeners fired from them) never describe uncommitted data.
+- If COMMIT itself fails, every op of the batch fails with that error.
+
+Because only this task writes, BEGIN IMMEDIATE never waits on another
+connection of this process; busy_timeout only covers outside writers
+(e.g. the offline reshard tool). One fsync per batch instead of one per
+op is where the throughput comes from.
+
+ReadPool hands out read-only connections (mode=ro, query_only). Under WAL
+a read never blocks the writer and sees everything committed before it
+started, including the caller's own writes that have already returned.
+Use execute_fetchall / fully fetched cursors so no read snapshot is held
+while the connection sits in the pool.
+
+Database keeps two pools on the same file: a small-cache one for gameplay
+reads and an analytics one (own connections, larger cache_size) for
+admin, stats, export and maintenance scans, so a long scan never leaves a
+callback waiting for a connection. The analytics pool also caps how long
+one borrow may run (max_query_ms): a runaway scan is interrupted instead
+of pinning an old WAL snapshot, which would stop checkpoints and make
+every later read walk a growing WAL.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiosqlite
+
+log = logging.getLogger(__name__)
+
+Op = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+
+def ro_uri(path: str) -> str:
+    return f"{Path(path).resolve().as_uri()}?mode=ro"
+
+
+class Writer:
+    def __init__(self, path: str, batch_max: int = 64, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.batch_max = max(1, batch_max)
+        self.busy_timeout_ms = busy_timeout_ms
+        self._queue: "asyncio.Queue[Optional[Tuple[Op, asyncio.Future]]]" = asyncio.Queue()
+        self._db: Optional[aiosqlite.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        # Counters for benchmarks / debugging.
+        self.batches = 0
+        self.ops = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        # isolation_level=None: the writer issues BEGIN / SAVEPOINT / COMMIT itself.
+        self._db = await aiosqlite.connect(self.path, isolation_level=None)
+        self._db.row_factory = aiosqlite.Row
+        await self._db.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        self._task = asyncio.create_task(self._run(), name=f"db-writer:{Path(self.path).name}")
+
+    async def submit(self, op: Op) -> Any:
+        if not self.running:
+            raise RuntimeError("database writer is not running (call Database.init() first)")
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((op, fut))
+        return await fut
+
+    async def stop(self) -> None:
+        """Apply everything already queued, then close the connection."""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+        await self._db.close()
+        self._db = None
+
+    async def _run(self) -> None:
+        while True:
+            item = await self._queue.get()
+            stopping = item is None
+            batch: List[Tuple[Op, asyncio.Future]] = [] if stopping else [item]
+            while len(batch) < self.batch_max and not self._queue.empty():
+                nxt = self._queue.get_nowait()
+                if nxt is None:
+                    stopping = True
+                    continue
+                batch.append(nxt)
+            if batch:
+                await self._apply(batch)
+            if stopping and self._queue.empty():
+                return
+            if stopping:
+                self._queue.put_nowait(None)
+
+    async def _apply(self, batch: List[Tuple[Op, asyncio.Future]]) -> None:
+        db = self._db
+        outcomes: List[Tuple[asyncio.Future, Any, Optional[BaseException]]] = []
+        try:
+            await db.execute("BEGIN IMMEDIATE")
+            for op, fut in batch:
+                if fut.cancelled():
+                    continue
+                await db.execute("SAVEPOINT op")
+                try:
+                    result = await op(db)
+                except Exception as e:
+                    await db.execute("ROLLBACK TO op")
+                    await db.execute("RELEASE op")
+                    outcomes.append((fut, None, e))
+                else:
+                    await db.execute("RELEASE op")
+                    outcomes.append((fut, result, None))
+            await db.execute("COMMIT")
+        except Exception as e:
+            log.exception("write batch of %d op(s) failed", len(batch))
+            if db.in_transaction:
+                await db.execute("ROLLBACK")
+            for _op, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        self.batches += 1
+        self.ops += len(outcomes)
+        for fut, result, error in outcomes:
+            if fut.done():
+                continue
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(result)
+
+
+class ReadPool:
+    def __init__(self, path: str, size: int = 4, cache_kib: int = 0, max_query_ms: int = 0):
+        """
+        cache_kib > 0 sets each connection's page cache (default: SQLite's 2 MiB).
+        max_query_ms > 0 interrupts statements still running that long after
+        the connection was borrowed (sqlite3.OperationalError: interrupted).
+        """
+        self.path = path
+        self.size = max(1, size)
+        self.cache_kib = cache_kib
+        self.max_query_ms = max_query_ms
+        self._idle: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+        self._all: List[aiosqlite.Connection] = []
+        # Per-connection deadline (time.monotonic()), read by the progress handler
+        # on the connection's own thread.
+        self._deadlines: Dict[int, float] = {}
+
+    async def _open(self) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(ro_uri(self.path), uri=True)
+        db.row_factory = aiosqlite.Row
+        await db.execute("PRAGMA query_only = 1")
+        if self.cache_kib > 0:
+            await db.execute(f"PRAGMA cache_size = {-int(self.cache_kib)}")
+        if self.max_query_ms > 0:
+            key = id(db)
+            self._deadlines[key] = math.inf
+            deadlines = self._deadlines
+            await db.set_progress_handler(lambda: time.monotonic() > deadlines[key], 10_000)
+        self._all.append(db)
+        return db
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[aiosqlite.Connection]:
+        if self._idle.empty() and len(self._all) < self.size:
+            db = await self._open()
+        else:
+            db = await self._idle.get()
+        if self.max_query_ms > 0:
+            self._deadlines[id(db)] = time.monotonic() + self.max_query_ms / 1000
+        try:
+            yield db
+        finally:
+            if self.max_query_ms > 0:
+                self._deadlines[id(db)] = math.inf
+            self._idle.put_nowait(db)
+
+    async def close(self) -> None:
+        for db in self._all:
+            await db.close()
+        self._all.clear()
+        self._deadlines.clear()
+        self._idle = asyncio.Queue()
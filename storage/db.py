@@ -1,215 +1,1319 @@
 import aiosqlite
-import datetime
-from typing import Optional, Dict, Any
+import asyncio
+import collections
+import sqlite3
+import threading
+from itertools import groupby
+from typing import Optional, Dict, Any, AsyncIterator, List
 
+from services import clock
+from storage import archive
+from storage.base import Storage
+from storage.connections import ReadPool, Writer
 
-class Database:
-    def __init__(self, path: str, starting_balance: int):
-        self.path = path
-        self.starting_balance = starting_balance
+HOUR_MS = 3_600_000
+DAY_MS = 86_400_000
+WEEK_MS = 7 * DAY_MS
 
-    async def init(self):
-        async with aiosqlite.connect(self.path) as db:
-            await db.executescript(
-                """
-                CREATE TABLE IF NOT EXISTS users (
+# Rollup periods used by the windowed leaderboards.
+LEADERBOARD_PERIODS = ("day", "week")
+ALL_GAMES = "*"
+
+# Ledger entry kinds and the account on the other side of each entry.
+LEDGER_KINDS = {
+    "open": "house",      # starting balance of a new account
+    "stake": "round",     # a settled round's hold (negative)
+    "payout": "round",    # settled round paid out
+    "refund": "round",    # stake returned (only rows written before holds)
+    "bonus": "house",
+    "admin": "house",     # /give, /setbal, bulk admin changes
+    "adjust": "house",    # anything else going through update_balance
+}
+
+
+# STRICT tables need SQLite 3.37+; older libraries get the same tables without it.
+STRICT = " STRICT" if sqlite3.sqlite_version_info >= (3, 37) else ""
+
+# Tables with epoch-ms timestamps (int, UTC). Databases created before that
+# stored ISO TEXT here and are rebuilt once by Database._migrate_epoch_ms;
+# each table also gets a <name>_iso view with the old text columns for
+# readers (reports, ad-hoc SQL) that still expect them.
+TIMESTAMP_COLUMNS = ("created_at", "updated_at")
+EPOCH_TABLES = {
+    "users": """
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     tg_id INTEGER UNIQUE NOT NULL,
                     username TEXT,
                     balance INTEGER NOT NULL,
-                    created_at TEXT NOT NULL
-                );
-
-                CREATE TABLE IF NOT EXISTS bets (
+                    created_at INTEGER NOT NULL,
+                    last_bonus_at INTEGER""",
+    "bets": """
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER NOT NULL,
                     game TEXT NOT NULL,
                     amount INTEGER NOT NULL,
                     result TEXT NOT NULL,
                     delta INTEGER NOT NULL,
-                    created_at TEXT NOT NULL,
-                    FOREIGN KEY (user_id) REFERENCES users(id)
-                );
-
-                CREATE TABLE IF NOT EXISTS active_rounds (
+                    created_at INTEGER NOT NULL,
+                    FOREIGN KEY (user_id) REFERENCES users(id)""",
+    "active_rounds": """
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     tg_id INTEGER NOT NULL,
                     game TEXT NOT NULL,
                     bet INTEGER NOT NULL,
                     state_json TEXT NOT NULL,
-                    created_at TEXT NOT NULL,
-                    updated_at TEXT NOT NULL
+                    created_at INTEGER NOT NULL,
+                    updated_at INTEGER NOT NULL,
+                    -- Bumped by every write to the row; save_active_round compares it.
+                    version INTEGER NOT NULL DEFAULT 0""",
+    "admin_audit": """
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    admin_id INTEGER NOT NULL,
+                    tg_id INTEGER NOT NULL,
+                    action TEXT NOT NULL,
+                    amount INTEGER NOT NULL,
+                    delta INTEGER NOT NULL,
+                    created_at INTEGER NOT NULL""",
+}
+
+
+def _column_names(columns: str) -> List[str]:
+    lines = (line.strip() for line in columns.strip().splitlines())
+    return [line.split()[0] for line in lines if line and not line.startswith(("--", "FOREIGN"))]
+
+
+def _iso_columns(columns: str) -> str:
+    return ", ".join(
+        f"strftime('%Y-%m-%dT%H:%M:%f', {c} / 1000.0, 'unixepoch') AS {c}" if c in TIMESTAMP_COLUMNS else c
+        for c in _column_names(columns)
+    )
+
+
+async def _one(db, sql: str, args: tuple = ()) -> Optional[aiosqlite.Row]:
+    """First row of a fully fetched result, so no statement stays open on a shared connection."""
+    rows = await db.execute_fetchall(sql, args)
+    return rows[0] if rows else None
+
+
+# A user row with the funds held by open rounds and what is left to spend.
+USER_SELECT = """SELECT u.*, COALESCE(h.held, 0) AS held, u.balance - COALESCE(h.held, 0) AS available
+                 FROM users u LEFT JOIN hold_totals h ON h.tg_id = u.tg_id"""
+
+
+async def _find_round(db, tg_id: int, game: Optional[str], columns: str = "*") -> Optional[aiosqlite.Row]:
+    """The user's round of `game`, or the one they touched last when game is None."""
+    if game is not None:
+        return await _one(db, f"SELECT {columns} FROM active_rounds WHERE tg_id = ? AND game = ?", (tg_id, game))
+    return await _one(
+        db, f"SELECT {columns} FROM active_rounds WHERE tg_id = ? ORDER BY updated_at DESC, id DESC LIMIT 1",
+        (tg_id,)
+    )
+
+
+def bucket_start(period: str, ms: int) -> int:
+    """Start (epoch ms, UTC) of the hour/day/week bucket containing ms. Weeks start on Monday."""
+    if period == "hour":
+        return ms // HOUR_MS * HOUR_MS
+    day = ms // DAY_MS
+    if period == "day":
+        return day * DAY_MS
+    if period == "week":
+        # 1970-01-01 was a Thursday -> shift so weeks begin on Monday.
+        return (day - (day + 3) % 7) * DAY_MS
+    raise ValueError(f"unknown period: {period}")
+
+
+class Database(Storage):
+    def __init__(self, path: str, starting_balance: int, archive_dir: Optional[str] = None,
+                 read_pool: int = 4, write_batch: int = 64, analytics_pool: int = 2,
+                 analytics_cache_kib: int = 16384, analytics_max_query_ms: int = 10_000):
+        super().__init__(starting_balance)
+        self.path = path
+        self.archive_dir = archive_dir
+        # All mutations go through one writer task; reads use pooled read-only connections,
+        # gameplay and analytics apart (see _analytics).
+        self._writer = Writer(path, batch_max=write_batch)
+        self._readers = ReadPool(path, size=read_pool)
+        self._analytics_pool = ReadPool(path, size=analytics_pool, cache_kib=analytics_cache_kib,
+                                        max_query_ms=analytics_max_query_ms)
+
+    async def init(self):
+        async with aiosqlite.connect(self.path) as db:
+            tables = "\n".join(
+                f"CREATE TABLE IF NOT EXISTS {name} ({columns}\n){STRICT};" for name, columns in EPOCH_TABLES.items()
+            )
+            await db.executescript(
+                tables + """
+                -- Per-user net winnings per day/week bucket, kept up to date by
+                -- resolve_active_round. game = '*' holds the all-games total.
+                CREATE TABLE IF NOT EXISTS user_rollups (
+                    period TEXT NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    game TEXT NOT NULL,
+                    tg_id INTEGER NOT NULL,
+                    rounds INTEGER NOT NULL DEFAULT 0,
+                    wagered INTEGER NOT NULL DEFAULT 0,
+                    net INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (period, bucket, game, tg_id)
+                );
+
+                -- Per-game aggregates of settled rounds. span = 'hour' rows are
+                -- written by resolve_active_round; compact_rollups() folds old
+                -- hours into span = 'day' rows.
+                CREATE TABLE IF NOT EXISTS game_rollups (
+                    span TEXT NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    game TEXT NOT NULL,
+                    rounds INTEGER NOT NULL DEFAULT 0,
+                    wagered INTEGER NOT NULL DEFAULT 0,
+                    paid INTEGER NOT NULL DEFAULT 0,
+                    net INTEGER NOT NULL DEFAULT 0,
+                    wins INTEGER NOT NULL DEFAULT 0,
+                    losses INTEGER NOT NULL DEFAULT 0,
+                    pushes INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (span, bucket, game)
+                );
+
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+
+                -- Append-only balance ledger: one row per credit (+) or debit (-)
+                -- of a player account, written in the same transaction as the
+                -- users.balance change. The other side of every entry is implied
+                -- by kind (see LEDGER_KINDS). ref is the round id for stake /
+                -- payout / refund rows and the admin id for admin rows.
+                CREATE TABLE IF NOT EXISTS ledger (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    tg_id INTEGER NOT NULL,
+                    amount INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    ref INTEGER,
+                    created_at INTEGER NOT NULL
+                );
+
+                -- Balance of each account as of ledger row ledger_id (inclusive).
+                -- compact_ledger() folds the tail into it.
+                CREATE TABLE IF NOT EXISTS balance_snapshots (
+                    tg_id INTEGER PRIMARY KEY,
+                    ledger_id INTEGER NOT NULL,
+                    balance INTEGER NOT NULL,
+                    taken_at INTEGER NOT NULL
+                );
+
+                -- Funds reserved by an open round (round_id = active_rounds.id).
+                -- Stakes only move holds; users.balance changes when the round
+                -- settles and its hold becomes a 'stake' ledger entry.
+                CREATE TABLE IF NOT EXISTS holds (
+                    round_id INTEGER PRIMARY KEY,
+                    tg_id INTEGER NOT NULL,
+                    game TEXT NOT NULL,
+                    amount INTEGER NOT NULL,
+                    created_at INTEGER NOT NULL
+                );
+
+                -- Sum of each user's holds, updated with every hold change (no
+                -- row at zero): available = users.balance - held.
+                CREATE TABLE IF NOT EXISTS hold_totals (
+                    tg_id INTEGER PRIMARY KEY,
+                    held INTEGER NOT NULL
                 );
                 """
             )
+            # Columns added after the first release (CREATE TABLE IF NOT EXISTS won't add them).
+            await self._ensure_column(db, "users", "last_bonus_at", "INTEGER")
+            await self._ensure_column(db, "active_rounds", "version", "INTEGER NOT NULL DEFAULT 0")
             # Optional performance / locking mitigation
             await db.execute("PRAGMA journal_mode=WAL;")
             await db.execute("PRAGMA synchronous=NORMAL;")
+            await self._migrate_epoch_ms(db)
+            await db.executescript(
+                """
+                CREATE INDEX IF NOT EXISTS idx_users_balance ON users(balance DESC);
+                CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users(username COLLATE NOCASE);
+                CREATE INDEX IF NOT EXISTS idx_users_last_bonus_at ON users(last_bonus_at);
+                CREATE INDEX IF NOT EXISTS idx_bets_created_at ON bets(created_at);
+                CREATE INDEX IF NOT EXISTS idx_active_rounds_updated_at ON active_rounds(updated_at);
+                -- One open round per user and game; sessions of different games run side by side.
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_active_rounds_tg_game ON active_rounds(tg_id, game);
+                CREATE INDEX IF NOT EXISTS idx_holds_tg_id ON holds(tg_id);
+                CREATE INDEX IF NOT EXISTS idx_user_rollups_net
+                    ON user_rollups(period, bucket, game, net DESC);
+                CREATE INDEX IF NOT EXISTS idx_ledger_tg_id ON ledger(tg_id, id);
+                """
+                + "\n".join(
+                    f"CREATE VIEW IF NOT EXISTS {name}_iso AS SELECT {_iso_columns(columns)} FROM {name};"
+                    for name, columns in EPOCH_TABLES.items()
+                )
+            )
+            # Accounts that predate the ledger start from a snapshot of their balance.
+            cur = await db.execute("SELECT 1 FROM meta WHERE key = 'ledger_seeded'")
+            if not await cur.fetchone():
+                await db.execute(
+                    """INSERT OR IGNORE INTO balance_snapshots (tg_id, ledger_id, balance, taken_at)
+                       SELECT tg_id, 0, balance, ? FROM users""",
+                    (clock.now_ms(),)
+                )
+                await db.execute("INSERT INTO meta (key, value) VALUES ('ledger_seeded', '1')")
+            await self._migrate_holds(db)
             await db.commit()
+        await self._writer.start()
+
+    @staticmethod
+    async def _migrate_epoch_ms(db) -> None:
+        """
+        Rebuild tables that still store ISO TEXT timestamps (databases created
+        before epoch-ms columns) in the EPOCH_TABLES layout, in one
+        transaction. Row ids and AUTOINCREMENT counters are kept, so archived
+        bet ids stay below every live one.
+        """
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            for name, columns in EPOCH_TABLES.items():
+                info = await db.execute_fetchall(f"PRAGMA table_info({name})")
+                if {r[1]: r[2].upper() for r in info}.get("created_at") != "TEXT":
+                    continue
+                names = _column_names(columns)
+                select = ", ".join(
+                    f"CAST(ROUND((julianday({c}) - 2440587.5) * 86400000) AS INTEGER)" if c in TIMESTAMP_COLUMNS else c
+                    for c in names
+                )
+                seq = await _one(db, "SELECT seq FROM sqlite_sequence WHERE name = ?", (name,))
+                await db.execute(f"CREATE TABLE {name}_ms ({columns}\n){STRICT}")
+                await db.execute(f"INSERT INTO {name}_ms ({', '.join(names)}) SELECT {select} FROM {name}")
+                await db.execute(f"DROP TABLE {name}")
+                await db.execute(f"ALTER TABLE {name}_ms RENAME TO {name}")
+                if seq:
+                    await db.execute(
+                        "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (seq[0], name)
+                    )
+                    await db.execute(
+                        "INSERT INTO sqlite_sequence (name, seq) SELECT ?, ? "
+                        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)",
+                        (name, seq[0], name)
+                    )
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+    @staticmethod
+    async def _migrate_holds(db) -> None:
+        """
+        Rounds opened before holds had their stake debited up front: credit
+        it back (ledger 'refund') and hold it instead, so settling them
+        through holds does not debit it twice. Available balance is unchanged.
+        """
+        rows = await db.execute_fetchall(
+            "SELECT id, tg_id, game, bet, created_at FROM active_rounds "
+            "WHERE id NOT IN (SELECT round_id FROM holds)"
+        )
+        if not rows:
+            return
+        await db.executemany(
+            "INSERT INTO holds (round_id, tg_id, game, amount, created_at) VALUES (?, ?, ?, ?, ?)",
+            [tuple(r) for r in rows]
+        )
+        staked = [(round_id, tg, bet) for round_id, tg, _game, bet, _at in rows if bet]
+        await db.executemany("UPDATE users SET balance = balance + ? WHERE tg_id = ?",
+                             [(bet, tg) for _, tg, bet in staked])
+        await db.executemany(
+            """INSERT INTO hold_totals (tg_id, held) VALUES (?, ?)
+               ON CONFLICT (tg_id) DO UPDATE SET held = held + excluded.held""",
+            [(tg, bet) for _, tg, bet in staked]
+        )
+        await Database._ledger(db, [(tg, bet, "refund", round_id) for round_id, tg, bet in staked])
+
+    @staticmethod
+    async def _ensure_column(db, table: str, column: str, decl: str) -> None:
+        cur = await db.execute(f"PRAGMA table_info({table})")
+        if column not in [r[1] for r in await cur.fetchall()]:
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+    # ---------------- Connections ----------------
+    async def _write(self, op):
+        """Run op(connection) on the writer task; see storage.connections."""
+        return await self._writer.submit(op)
+
+    def _read(self):
+        """Borrow a read-only pooled connection: async with self._read() as db."""
+        return self._readers.connection()
+
+    def _analytics(self):
+        """
+        Same as _read, from the analytics pool: admin, stats, export and
+        maintenance scans. Each statement sees everything committed before it
+        started; a borrow is interrupted after analytics_max_query_ms. What
+        that means per query:
+
+            top_balances, top_net, game_stats   current when the query starts
+                                                (rollups are bumped in the round's
+                                                own transaction)
+            recent_bets, ledger_entries,        current when the query starts;
+            ledger_balance, resolve_usernames,  (the archive tail of recent_bets is
+            get_balances                        read from segments, not this pool)
+            iter_bets (export)                  current per page, not one snapshot:
+                                                rows committed during an export
+                                                appear if they sort after the page
+            archive_bets                        current per batch
+
+        The in-memory leaderboard behind /top and the gameplay reads
+        (_read) are not affected by this pool at all.
+        """
+        return self._analytics_pool.connection()
 
     # ---------------- Users ----------------
     async def get_or_create_user(self, tg_id: int, username: Optional[str]) -> Dict[str, Any]:
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
-            cur = await db.execute("SELECT * FROM users WHERE tg_id = ?", (tg_id,))
-            row = await cur.fetchone()
+        """The users row plus held and available (balance minus holds)."""
+        async with self._read() as db:
+            row = await _one(db, f"{USER_SELECT} WHERE u.tg_id = ?", (tg_id,))
+        if row and not (username and username != row["username"]):
+            return dict(row)
+
+        async def op(db):
+            row = await _one(db, f"{USER_SELECT} WHERE u.tg_id = ?", (tg_id,))
+            if row is None:
+                now = clock.now_ms()
+                await db.execute(
+                    "INSERT INTO users (tg_id, username, balance, created_at) VALUES (?, ?, ?, ?)",
+                    (tg_id, username, self.starting_balance, now),
+                )
+                await self._ledger(db, [(tg_id, self.starting_balance, "open", None)])
+                return "created", None, await _one(db, f"{USER_SELECT} WHERE u.tg_id = ?", (tg_id,))
+            if username and username != row["username"]:
+                await db.execute("UPDATE users SET username = ? WHERE tg_id = ?", (username, tg_id))
+                return "renamed", row["username"], {**dict(row), "username": username}
+            return None, None, row
+
+        change, old_username, row = await self._write(op)
+        if change == "renamed":
+            self._notify_rename(tg_id, old_username, username)
+        if change:
+            self._notify_balance(tg_id, int(row["available"]), username)
+        return dict(row)
+
+    async def update_balance(self, tg_id: int, delta: int, kind: str = "adjust", ref: Optional[int] = None) -> int:
+        """
+        Adjust balance and return the new available balance. The ledger
+        entry is written in the same transaction.
+        """
+        async def op(db):
+            row = await _one(db, "UPDATE users SET balance = balance + ? WHERE tg_id = ? RETURNING balance", (delta, tg_id))
             if row:
-                if username and username != row["username"]:
-                    await db.execute("UPDATE users SET username = ? WHERE tg_id = ?", (username, tg_id))
-                    await db.commit()
-                    cur = await db.execute("SELECT * FROM users WHERE tg_id = ?", (tg_id,))
-                    row = await cur.fetchone()
-                return dict(row)
-
-            now = datetime.datetime.utcnow().isoformat()
+                await self._ledger(db, [(tg_id, delta, kind, ref)])
+                return await self._available(db, tg_id)
+            # Edge case: user disappeared (shouldn't happen) -> recreate
+            now = clock.now_ms()
             await db.execute(
                 "INSERT INTO users (tg_id, username, balance, created_at) VALUES (?, ?, ?, ?)",
-                (tg_id, username, self.starting_balance, now),
+                (tg_id, None, self.starting_balance, now)
             )
-            await db.commit()
-            cur = await db.execute("SELECT * FROM users WHERE tg_id = ?", (tg_id,))
-            row = await cur.fetchone()
-            return dict(row)
+            await self._ledger(db, [(tg_id, self.starting_balance, "open", None)])
+            return self.starting_balance
+
+        balance = await self._write(op)
+        self._notify_balance(tg_id, balance)
+        return balance
 
-    async def update_balance(self, tg_id: int, delta: int) -> int:
+    async def find_user(self, tg_id: Optional[int] = None, username: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Full user row by tg_id, or by case-insensitive username (indexed). Never creates."""
+        async with self._read() as db:
+            if tg_id is not None:
+                row = await _one(db, f"{USER_SELECT} WHERE u.tg_id = ?", (tg_id,))
+            else:
+                row = await _one(
+                    db, f"{USER_SELECT} WHERE u.username = ? COLLATE NOCASE ORDER BY u.id DESC LIMIT 1", (username,)
+                )
+            return dict(row) if row else None
+
+    async def set_balance(self, tg_id: int, amount: int, ref: Optional[int] = None) -> Optional[int]:
         """
-        Adjust balance and return new balance.
-        (Fixed: added row_factory so row['balance'] works; prevents TypeError.)
+        Overwrite a balance (ledger gets the difference); holds stay as they
+        are. Returns the balance it replaced, read inside the same write, so
+        callers get the true delta even if the row changed since they last
+        looked (None if no such user).
         """
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
-            await db.execute("UPDATE users SET balance = balance + ? WHERE tg_id = ?", (delta, tg_id))
-            await db.commit()
-            cur = await db.execute("SELECT balance FROM users WHERE tg_id = ?", (tg_id,))
-            row = await cur.fetchone()
-            if not row:
-                # Edge case: user disappeared (shouldn't happen) -> recreate
-                now = datetime.datetime.utcnow().isoformat()
-                await db.execute(
-                    "INSERT INTO users (tg_id, username, balance, created_at) VALUES (?, ?, ?, ?)",
-                    (tg_id, None, self.starting_balance, now)
+        async def op(db):
+            old = await _one(db, "SELECT balance FROM users WHERE tg_id = ?", (tg_id,))
+            if not old:
+                return None
+            await db.execute("UPDATE users SET balance = ? WHERE tg_id = ?", (amount, tg_id))
+            await self._ledger(db, [(tg_id, amount - old[0], "admin", ref)])
+            return old[0], await self._available(db, tg_id)
+
+        res = await self._write(op)
+        if res is None:
+            return None
+        old, available = res
+        self._notify_balance(tg_id, available)
+        return old
+
+    async def resolve_usernames(self, names: List[str]) -> Dict[str, int]:
+        """
+        Map lower-cased usernames to tg_id in chunks of indexed IN lookups.
+        A name held by several users resolves like find_user: newest account.
+        """
+        return {name: tg_id for name, (tg_id, _created) in (await self._resolve_usernames(names)).items()}
+
+    async def _resolve_usernames(self, names: List[str]) -> Dict[str, tuple]:
+        """resolve_usernames with the account's created_at: name -> (tg_id, created_at)."""
+        out: Dict[str, tuple] = {}
+        uniq = list({n.lower() for n in names})
+        async with self._analytics() as db:
+            for i in range(0, len(uniq), 500):
+                chunk = uniq[i:i + 500]
+                rows = await db.execute_fetchall(
+                    f"SELECT username, tg_id, created_at FROM users "
+                    f"WHERE username COLLATE NOCASE IN ({','.join('?' * len(chunk))}) ORDER BY id",
+                    chunk
                 )
-                await db.commit()
-                return self.starting_balance
-            return int(row["balance"])
+                for username, tg_id, created_at in rows:
+                    out[username.lower()] = (tg_id, created_at)  # ascending id: the newest row wins
+        return out
+
+    async def get_balances(self, tg_ids: List[int]) -> Dict[int, int]:
+        """
+        Available balance per existing tg_id (missing users are left out),
+        the value balance listeners see; for cache reconciliation.
+        """
+        async with self._analytics() as db:
+            return dict(await self._available_of(db, list(set(tg_ids))))
+
+    async def apply_admin_balances(self, admin_id: int, items: List[tuple], mode: str = "give") -> Dict[str, int]:
+        """
+        Apply many admin balance changes in ONE transaction.
+        items: [(tg_id, amount), ...]; mode 'give' adds amount, 'set' overwrites
+        (last entry per user wins). Unknown tg_ids get a fresh account first.
+        Every change gets an admin_audit row. Returns totals.
+        """
+        if mode not in ("give", "set"):
+            raise ValueError(mode)
+        if mode == "set":
+            items = list({tg: amt for tg, amt in items}.items())
+        now = clock.now_ms()
+        ids = list({tg for tg, _ in items})
+
+        async def op(db):
+            known = {tg for tg, _b in await self._balances_of(db, ids)}
+            fresh = [tg for tg in ids if tg not in known]
+            await db.executemany(
+                "INSERT INTO users (tg_id, username, balance, created_at) VALUES (?, NULL, ?, ?)",
+                [(tg, self.starting_balance, now) for tg in fresh]
+            )
+            await self._ledger(db, [(tg, self.starting_balance, "open", None) for tg in fresh])
+            old = dict(await self._balances_of(db, ids))
+            if mode == "give":
+                audit = [(admin_id, tg, "give", amt, amt, now) for tg, amt in items]
+                sql = "UPDATE users SET balance = balance + ? WHERE tg_id = ?"
+            else:
+                audit = [(admin_id, tg, "set", amt, amt - old[tg], now) for tg, amt in items]
+                sql = "UPDATE users SET balance = ? WHERE tg_id = ?"
+            await db.executemany(
+                "INSERT INTO admin_audit (admin_id, tg_id, action, amount, delta, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                audit
+            )
+            await db.executemany(sql, [(amt, tg) for tg, amt in items])
+            await self._ledger(db, [(tg, delta, "admin", admin_id) for _a, tg, _k, _amt, delta, _t in audit])
+            return len(fresh), sum(a[4] for a in audit), await self._available_of(db, ids)
+
+        created, total_delta, balances = await self._write(op)
+        for tg, bal in balances:
+            self._notify_balance(tg, int(bal))
+        return {"changes": len(items), "users": len(ids), "created": created, "total_delta": int(total_delta)}
+
+    @staticmethod
+    async def _ledger(db, entries: List[tuple]) -> None:
+        """Append (tg_id, amount, kind, ref) entries; zero amounts are skipped."""
+        now = clock.now_ms()
+        rows = [(tg, amt, kind, ref, now) for tg, amt, kind, ref in entries if amt]
+        if rows:
+            await db.executemany(
+                "INSERT INTO ledger (tg_id, amount, kind, ref, created_at) VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+    @staticmethod
+    async def _balances_of(db, ids: List[int]) -> List[tuple]:
+        out = []
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            out += await db.execute_fetchall(
+                f"SELECT tg_id, balance FROM users WHERE tg_id IN ({','.join('?' * len(chunk))})", chunk
+            )
+        return out
+
+    @staticmethod
+    async def _available_of(db, ids: List[int]) -> List[tuple]:
+        """[(tg_id, available)] for the existing ids."""
+        out = []
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            out += await db.execute_fetchall(
+                f"""SELECT u.tg_id, u.balance - COALESCE(h.held, 0) FROM users u
+                    LEFT JOIN hold_totals h ON h.tg_id = u.tg_id
+                    WHERE u.tg_id IN ({','.join('?' * len(chunk))})""",
+                chunk
+            )
+        return out
+
+    @staticmethod
+    async def _available(db, tg_id: int) -> Optional[int]:
+        rows = await Database._available_of(db, [tg_id])
+        return int(rows[0][1]) if rows else None
+
+    @staticmethod
+    async def _hold(db, round_id: int, tg_id: int, amount: int) -> None:
+        """Add amount (negative releases) to a round's hold and to its user's total."""
+        await db.execute("UPDATE holds SET amount = amount + ? WHERE round_id = ?", (amount, round_id))
+        await db.execute(
+            """INSERT INTO hold_totals (tg_id, held) VALUES (?, ?)
+               ON CONFLICT (tg_id) DO UPDATE SET held = held + excluded.held""",
+            (tg_id, amount)
+        )
+        await db.execute("DELETE FROM hold_totals WHERE tg_id = ? AND held = 0", (tg_id,))
+
+    async def _close_holds(self, db, closes: List[tuple]) -> List[int]:
+        """
+        Close the holds of finished rounds. closes: [(round_id, payout)];
+        a payout (0 included) settles the round: its hold becomes a 'stake'
+        ledger entry and the balance moves by payout - hold. payout None
+        releases the hold (refund): the balance never paid it. Returns the
+        tg_ids whose holds changed.
+        """
+        ids = [rid for rid, _p in closes]
+        rows = await db.execute_fetchall(
+            f"SELECT round_id, tg_id, amount FROM holds WHERE round_id IN ({','.join('?' * len(ids))})", ids
+        )
+        holds = {r["round_id"]: (r["tg_id"], r["amount"]) for r in rows}
+        settled = [(rid, p) for rid, p in closes if p is not None and rid in holds]
+        await db.executemany(
+            """INSERT INTO ledger (tg_id, amount, kind, ref, created_at)
+               SELECT tg_id, -amount, 'stake', round_id, ? FROM holds WHERE round_id = ? AND amount != 0""",
+            [(clock.now_ms(), rid) for rid, _p in settled]
+        )
+        await self._ledger(db, [(holds[rid][0], p, "payout", rid) for rid, p in settled])
+        await db.executemany(
+            "UPDATE users SET balance = balance + ? WHERE tg_id = ?",
+            [(p - holds[rid][1], holds[rid][0]) for rid, p in settled if p != holds[rid][1]]
+        )
+        released: Dict[int, int] = collections.Counter()
+        for tg, amount in holds.values():
+            released[tg] += amount
+        await db.executemany(
+            "UPDATE hold_totals SET held = held - ? WHERE tg_id = ?", [(amt, tg) for tg, amt in released.items() if amt]
+        )
+        await db.executemany("DELETE FROM hold_totals WHERE tg_id = ? AND held = 0", [(tg,) for tg in released])
+        await db.executemany("DELETE FROM holds WHERE round_id = ?", [(rid,) for rid in holds])
+        return list(released)
+
+    # ---------------- Daily bonus ----------------
+    async def claim_bonus(self, tg_id: int, amount: int, cooldown_hours: int) -> Dict[str, Any]:
+        """
+        Credit the daily bonus if the cooldown has passed. Eligibility check and
+        credit are ONE conditional UPDATE, so concurrent claims cannot double-pay.
+        Returns {"ok", "balance" (available), "next_at" (epoch ms, only when not ok)}.
+        """
+        now = clock.now_ms()
+        cutoff = now - cooldown_hours * HOUR_MS
+
+        async def op(db):
+            row = await _one(
+                db,
+                """UPDATE users SET balance = balance + ?, last_bonus_at = ?
+                   WHERE tg_id = ? AND (last_bonus_at IS NULL OR last_bonus_at <= ?)
+                   RETURNING balance""",
+                (amount, now, tg_id, cutoff)
+            )
+            if not row:
+                return None
+            await self._ledger(db, [(tg_id, amount, "bonus", None)])
+            return await self._available(db, tg_id)
+
+        available = await self._write(op)
+        if available is not None:
+            self._notify_balance(tg_id, available)
+            return {"ok": True, "balance": available, "next_at": None}
+        async with self._read() as db:
+            denied = await _one(db, f"SELECT available, last_bonus_at FROM ({USER_SELECT} WHERE u.tg_id = ?)", (tg_id,))
+        if not denied:
+            return {"ok": False, "balance": None, "next_at": None}
+        return {"ok": False, "balance": int(denied[0]), "next_at": int(denied[1]) + cooldown_hours * HOUR_MS}
+
+    async def grant_bonus_to_active(self, amount: int, cooldown_hours: int, active_days: int) -> int:
+        """
+        Scheduled mode: credit every user who settled a round in the last
+        active_days and whose cooldown has passed, in a single UPDATE.
+        Returns the number of users credited.
+        """
+        now = clock.now_ms()
+        cutoff = now - cooldown_hours * HOUR_MS
+        since_bucket = bucket_start("day", now) - (active_days - 1) * DAY_MS
+
+        async def op(db):
+            rows = await db.execute_fetchall(
+                """UPDATE users SET balance = balance + ?, last_bonus_at = ?
+                   WHERE (last_bonus_at IS NULL OR last_bonus_at <= ?)
+                     AND tg_id IN (SELECT tg_id FROM user_rollups
+                                   WHERE period = 'day' AND bucket >= ? AND game = ?)
+                   RETURNING tg_id, balance""",
+                (amount, now, cutoff, since_bucket, ALL_GAMES)
+            )
+            await self._ledger(db, [(tg, amount, "bonus", None) for tg, _bal in rows])
+            return await self._available_of(db, [tg for tg, _bal in rows])
+
+        rows = await self._write(op)
+        for tg, available in rows:
+            self._notify_balance(tg, int(available))
+        return len(rows)
 
     # ---------------- Bets history ----------------
     async def record_bet(self, tg_id: int, game: str, amount: int, result: str, delta: int) -> None:
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
-            cur = await db.execute("SELECT id FROM users WHERE tg_id = ?", (tg_id,))
-            user = await cur.fetchone()
-            if not user:
-                return
-            now = datetime.datetime.utcnow().isoformat()
+        now = clock.now_ms()
+
+        async def op(db):
             await db.execute(
-                "INSERT INTO bets (user_id, game, amount, result, delta, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-                (int(user["id"]), game, amount, result, delta, now),
+                """INSERT INTO bets (user_id, game, amount, result, delta, created_at)
+                   SELECT id, ?, ?, ?, ?, ? FROM users WHERE tg_id = ?""",
+                (game, amount, result, delta, now, tg_id),
             )
-            await db.commit()
+
+        await self._write(op)
 
     # ---------------- Active round lifecycle ----------------
+    # Every round has a hold (see the holds table): stakes raise the hold and
+    # must fit the available balance; settling turns the hold into ledger
+    # entries, cancel / clear release it. Rounds are per user and game;
+    # game=None means the user's most recently touched round.
     async def start_active_round(self, tg_id: int, game: str, bet: int, state_json: str) -> bool:
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
-            try:
-                await db.execute("BEGIN IMMEDIATE")
-                cur = await db.execute("SELECT id FROM active_rounds WHERE tg_id = ?", (tg_id,))
-                if await cur.fetchone():
-                    await db.rollback()
-                    return False
-
-                cur = await db.execute("SELECT balance FROM users WHERE tg_id = ?", (tg_id,))
-                user = await cur.fetchone()
-                if not user or user["balance"] < bet:
-                    await db.rollback()
-                    return False
-
-                if bet > 0:
-                    await db.execute("UPDATE users SET balance = balance - ? WHERE tg_id = ?", (bet, tg_id))
-
-                now = datetime.datetime.utcnow().isoformat()
-                await db.execute(
-                    """INSERT INTO active_rounds (tg_id, game, bet, state_json, created_at, updated_at)
-                       VALUES (?, ?, ?, ?, ?, ?)""",
-                    (tg_id, game, bet, state_json, now, now)
-                )
-                await db.commit()
-                return True
-            except Exception:
-                await db.rollback()
-                return False
+        async def op(db):
+            if await _find_round(db, tg_id, game, "id"):
+                return False, None
+            available = await self._available(db, tg_id)
+            if available is None or available < bet:
+                return False, None
+            now = clock.now_ms()
+            cur = await db.execute(
+                """INSERT INTO active_rounds (tg_id, game, bet, state_json, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (tg_id, game, bet, state_json, now, now)
+            )
+            await db.execute(
+                "INSERT INTO holds (round_id, tg_id, game, amount, created_at) VALUES (?, ?, ?, 0, ?)",
+                (cur.lastrowid, tg_id, game, now)
+            )
+            if bet <= 0:
+                return True, None
+            await self._hold(db, cur.lastrowid, tg_id, bet)
+            return True, available - bet
 
-    async def adjust_active_round_bet(self, tg_id: int, delta: int) -> bool:
+        started, available = await self._write(op)
+        if available is not None:
+            self._notify_balance(tg_id, available)
+        return started
+
+    async def adjust_active_round_bet(self, tg_id: int, delta: int, game: Optional[str] = None) -> bool:
         if delta <= 0:
             return False
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
-            try:
-                await db.execute("BEGIN IMMEDIATE")
-                cur = await db.execute("SELECT * FROM active_rounds WHERE tg_id = ?", (tg_id,))
-                ar = await cur.fetchone()
-                if not ar:
-                    await db.rollback()
-                    return False
-                cur = await db.execute("SELECT balance FROM users WHERE tg_id = ?", (tg_id,))
-                user = await cur.fetchone()
-                if not user or user["balance"] < delta:
-                    await db.rollback()
-                    return False
-                await db.execute("UPDATE users SET balance = balance - ? WHERE tg_id = ?", (delta, tg_id))
+
+        async def op(db):
+            ar = await _find_round(db, tg_id, game, "id")
+            if not ar:
+                return None
+            available = await self._available(db, tg_id)
+            if available is None or available < delta:
+                return None
+            await db.execute(
+                "UPDATE active_rounds SET bet = bet + ?, updated_at = ?, version = version + 1 WHERE id = ?",
+                (delta, clock.now_ms(), ar["id"])
+            )
+            await self._hold(db, ar["id"], tg_id, delta)
+            return available - delta
+
+        available = await self._write(op)
+        if available is None:
+            return False
+        self._notify_balance(tg_id, available)
+        return True
+
+    async def get_active_round(self, tg_id: int, game: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        async with self._read() as db:
+            row = await _find_round(db, tg_id, game)
+            return dict(row) if row else None
+
+    async def update_active_round(self, tg_id: int, state_json: str, game: Optional[str] = None) -> None:
+        """Unconditional overwrite (last writer wins); handlers use save_active_round."""
+        async def op(db):
+            ar = await _find_round(db, tg_id, game, "id")
+            if ar:
                 await db.execute(
-                    "UPDATE active_rounds SET bet = bet + ?, updated_at = ? WHERE tg_id = ?",
-                    (delta, datetime.datetime.utcnow().isoformat(), tg_id)
+                    "UPDATE active_rounds SET state_json = ?, updated_at = ?, version = version + 1 WHERE id = ?",
+                    (state_json, clock.now_ms(), ar["id"])
                 )
-                await db.commit()
-                return True
-            except Exception:
-                await db.rollback()
-                return False
 
-    async def get_active_round(self, tg_id: int) -> Optional[Dict[str, Any]]:
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
-            cur = await db.execute("SELECT * FROM active_rounds WHERE tg_id = ?", (tg_id,))
-            row = await cur.fetchone()
-            return dict(row) if row else None
+        await self._write(op)
 
-    async def update_active_round(self, tg_id: int, state_json: str) -> None:
-        async with aiosqlite.connect(self.path) as db:
+    async def save_active_round(self, tg_id: int, state_json: str, version: int, stake: int = 0,
+                                game: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Compare-and-swap save of the round state: applies only if the row is
+        still at `version` (as read by the caller), and adds `stake` to the
+        round's hold in the same transaction. Returns
+        {"ok": True, "version": new_version, "balance": new_available_or_None}
+        or {"ok": False, "reason": "missing" | "conflict" | "funds"}.
+        """
+        async def op(db):
+            ar = await _find_round(db, tg_id, game, "id, version")
+            if not ar:
+                return {"ok": False, "reason": "missing"}
+            if ar["version"] != version:
+                return {"ok": False, "reason": "conflict"}
+            balance = None
+            if stake > 0:
+                available = await self._available(db, tg_id)
+                if available is None or available < stake:
+                    return {"ok": False, "reason": "funds"}
+                await self._hold(db, ar["id"], tg_id, stake)
+                balance = available - stake
+            row = await _one(
+                db,
+                """UPDATE active_rounds SET state_json = ?, bet = bet + ?, updated_at = ?, version = version + 1
+                   WHERE id = ? AND version = ? RETURNING version""",
+                (state_json, max(stake, 0), clock.now_ms(), ar["id"], version)
+            )
+            return {"ok": True, "version": int(row[0]), "balance": balance}
+
+        result = await self._write(op)
+        if result.get("balance") is not None:
+            self._notify_balance(tg_id, result["balance"])
+        return result
+
+    async def resolve_active_round(self, tg_id: int, result: str, total_payout: int,
+                                   game: Optional[str] = None) -> None:
+        async def op(db):
+            active = await _find_round(db, tg_id, game)
+            if not active:
+                return None
+            await db.execute("DELETE FROM active_rounds WHERE id = ?", (active["id"],))
+            user_row = await _one(db, "SELECT id FROM users WHERE tg_id = ?", (tg_id,))
+            if not user_row:
+                await self._close_holds(db, [(active["id"], None)])  # nobody to settle with
+                return None
+            locked = active["bet"]
+            net_delta = total_payout - locked
+            now = clock.now_ms()
             await db.execute(
-                "UPDATE active_rounds SET state_json = ?, updated_at = ? WHERE tg_id = ?",
-                (state_json, datetime.datetime.utcnow().isoformat(), tg_id)
+                "INSERT INTO bets (user_id, game, amount, result, delta, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_row["id"], active["game"], locked, result, net_delta, now)
             )
-            await db.commit()
+            await self._bump_user_rollups(db, tg_id, active["game"], locked, net_delta)
+            await self._bump_game_rollup(db, active["game"], locked, total_payout, result)
+            await self._close_holds(db, [(active["id"], total_payout)])
+            return await self._available(db, tg_id)
 
-    async def resolve_active_round(self, tg_id: int, result: str, total_payout: int) -> None:
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
-            try:
-                await db.execute("BEGIN IMMEDIATE")
-                cur = await db.execute("SELECT * FROM active_rounds WHERE tg_id = ?", (tg_id,))
-                active = await cur.fetchone()
-                if not active:
-                    await db.rollback()
-                    return
-                locked = active["bet"]
-                await db.execute("UPDATE users SET balance = balance + ? WHERE tg_id = ?", (total_payout, tg_id))
-                cur = await db.execute("SELECT id FROM users WHERE tg_id = ?", (tg_id,))
-                user_row = await cur.fetchone()
-                if user_row:
-                    net_delta = total_payout - locked
-                    now = datetime.datetime.utcnow().isoformat()
-                    await db.execute(
-                        "INSERT INTO bets (user_id, game, amount, result, delta, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-                        (user_row["id"], active["game"], locked, result, net_delta, now)
-                    )
-                await db.execute("DELETE FROM active_rounds WHERE tg_id = ?", (tg_id,))
-                await db.commit()
-            except Exception:
-                await db.rollback()
+        balance = await self._write(op)
+        if balance is not None:
+            self._notify_balance(tg_id, balance)
+
+    async def iter_active_rounds(self, batch_size: int = 200) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield every active round in id order, batch_size rows at a time (keyset pagination)."""
+        last_id = 0
+        while True:
+            async with self._read() as db:
+                rows = await db.execute_fetchall(
+                    "SELECT * FROM active_rounds WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+                )
+            batch = [dict(r) for r in rows]
+            if not batch:
+                return
+            yield batch
+            if len(batch) < batch_size:
+                return
+            last_id = batch[-1]["id"]
+
+    async def stale_active_rounds(self, idle_s: float, limit: int = 200) -> List[Dict[str, Any]]:
+        """Oldest rounds not touched for idle_s seconds (range scan on idx_active_rounds_updated_at)."""
+        cutoff = clock.now_ms() - int(idle_s * 1000)
+        async with self._read() as db:
+            rows = await db.execute_fetchall(
+                "SELECT * FROM active_rounds WHERE updated_at < ? ORDER BY updated_at LIMIT ?", (cutoff, limit)
+            )
+            return [dict(r) for r in rows]
+
+    async def settle_rounds(self, items: List[tuple]) -> List[tuple]:
+        """
+        Close many active rounds in ONE transaction.
+        items: [(round_row, result, payout), ...] where round_row is a row from
+        iter_active_rounds. The round is settled with payout like
+        resolve_active_round does; result None means a plain refund (the
+        hold is released, no bets/rollup rows). Rows whose version changed
+        since they were read are skipped. Returns the items that were
+        actually closed.
+        """
+        if not items:
+            return []
+
+        async def op(db):
+            ids = [row["id"] for row, _r, _p in items]
+            rows = await db.execute_fetchall(
+                f"SELECT id, version FROM active_rounds WHERE id IN ({','.join('?' * len(ids))})", ids
+            )
+            current = {r["id"]: r["version"] for r in rows}
+            todo = [it for it in items if current.get(it[0]["id"]) == it[0]["version"]]
+            if not todo:
+                return [], []
+            now = clock.now_ms()
+            await db.executemany(
+                """INSERT INTO bets (user_id, game, amount, result, delta, created_at)
+                   SELECT id, ?, ?, ?, ?, ? FROM users WHERE tg_id = ?""",
+                [(row["game"], row["bet"], result, payout - row["bet"], now, row["tg_id"])
+                 for row, result, payout in todo if result is not None]
+            )
+            for row, result, payout in todo:
+                if result is not None:
+                    await self._bump_user_rollups(db, row["tg_id"], row["game"], row["bet"], payout - row["bet"])
+                    await self._bump_game_rollup(db, row["game"], row["bet"], payout, result)
+            await db.executemany("DELETE FROM active_rounds WHERE id = ?", [(row["id"],) for row, _r, _p in todo])
+            touched = await self._close_holds(
+                db, [(row["id"], None if result is None else payout) for row, result, payout in todo]
+            )
+            return todo, await self._available_of(db, touched)
 
-    async def delete_active_round(self, tg_id: int) -> None:
+        closed, balances = await self._write(op)
+        for tg, bal in balances:
+            self._notify_balance(tg, int(bal))
+        return closed
+
+    async def delete_active_round(self, tg_id: int, game: Optional[str] = None) -> None:
+        """Drop the round without a payout: its hold is forfeited (debited as a stake)."""
+        async def op(db):
+            ar = await _find_round(db, tg_id, game, "id")
+            if ar:
+                await db.execute("DELETE FROM active_rounds WHERE id = ?", (ar["id"],))
+                await self._close_holds(db, [(ar["id"], 0)])
+
+        await self._write(op)
+
+    async def cancel_active_round(self, tg_id: int, refund: bool = True, game: Optional[str] = None) -> Optional[int]:
+        """
+        Close the round of `game` (every round of the user when game is None)
+        and release its hold in ONE transaction; without refund the hold is
+        forfeited instead. Returns the refunded amount (0 without refund),
+        None if there was no round.
+        """
+        async def op(db):
+            if game is None:
+                rows = await db.execute_fetchall(
+                    "DELETE FROM active_rounds WHERE tg_id = ? RETURNING id, bet", (tg_id,)
+                )
+            else:
+                rows = await db.execute_fetchall(
+                    "DELETE FROM active_rounds WHERE tg_id = ? AND game = ? RETURNING id, bet", (tg_id, game)
+                )
+            if not rows:
+                return None, None
+            await self._close_holds(db, [(round_id, None if refund else 0) for round_id, _bet in rows])
+            refunded = sum(bet for _id, bet in rows) if refund else 0
+            return refunded, (await self._available(db, tg_id) if refunded else None)
+
+        refunded, balance = await self._write(op)
+        if balance is not None:
+            self._notify_balance(tg_id, balance)
+        return refunded
+
+    async def reset_active_round(self, tg_id: int, state_json: str, game: Optional[str] = None) -> Optional[int]:
+        """
+        Release the whole hold and restart the round with a fresh state and
+        bet 0, in ONE transaction (roulette "clear"). Returns the new
+        available balance, None if there was no round.
+        """
+        async def op(db):
+            row = await _find_round(db, tg_id, game, "id, bet")
+            if not row:
+                return None, 0
+            round_id, bet = row
+            await db.execute(
+                "UPDATE active_rounds SET bet = 0, state_json = ?, updated_at = ?, version = version + 1 WHERE id = ?",
+                (state_json, clock.now_ms(), round_id)
+            )
+            if bet:
+                await self._hold(db, round_id, tg_id, -bet)
+            return await self._available(db, tg_id), bet
+
+        balance, refunded = await self._write(op)
+        if refunded and balance is not None:
+            self._notify_balance(tg_id, balance)
+        return balance
+
+    async def checkpoint(self, mode: str = "PASSIVE") -> None:
+        """Run a WAL checkpoint (PASSIVE never waits on readers or writers)."""
         async with aiosqlite.connect(self.path) as db:
-            await db.execute("DELETE FROM active_rounds WHERE tg_id = ?", (tg_id,))
-            await db.commit()
\ No newline at end of file
+            await db.execute(f"PRAGMA wal_checkpoint({mode})")
+
+    async def backup(self, backup_dir: str, keep: int = 8, pages: int = 256,
+                     step_sleep_s: float = 0.005) -> Dict[str, Any]:
+        """
+        Online snapshot into backup_dir (storage.backup.snapshot in a worker
+        thread, so callbacks keep being served). Cancelling the caller stops
+        the copy at its next step.
+        """
+        from storage.backup import snapshot  # gzip/tempfile only when a backup actually runs
+
+        stop = threading.Event()
+        try:
+            return await asyncio.to_thread(snapshot, self.path, backup_dir, pages, step_sleep_s, keep, stop)
+        except asyncio.CancelledError:
+            stop.set()
+            raise
+
+    async def close(self) -> None:
+        """
+        Final flush on shutdown: apply the queued writes, close every
+        connection, then fold the WAL back into the main file and truncate it.
+        """
+        await self._writer.stop()
+        await self._readers.close()
+        await self._analytics_pool.close()
+        await self.checkpoint("TRUNCATE")
+
+    # ---------------- Ledger ----------------
+    async def ledger_balance(self, tg_id: int) -> Optional[int]:
+        """Balance derived from the snapshot plus the ledger tail (None for unknown accounts)."""
+        async with self._analytics() as db:
+            snap = await _one(db, "SELECT balance, ledger_id FROM balance_snapshots WHERE tg_id = ?", (tg_id,))
+            base, after = (snap[0], snap[1]) if snap else (0, 0)
+            n, tail = await _one(
+                db, "SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM ledger WHERE tg_id = ? AND id > ?", (tg_id, after)
+            )
+        if not snap and not n:
+            return None
+        return base + tail
+
+    async def compact_ledger(self, keep_days: int = 90) -> Dict[str, int]:
+        """
+        Fold every account's ledger tail into balance_snapshots, then drop
+        folded entries older than keep_days. Runs in one transaction, so the
+        fold sees a consistent cut; afterwards every snapshot must equal
+        users.balance, and accounts where it doesn't are reported as
+        mismatches (and logged by the caller).
+        """
+        now = clock.now_ms()
+
+        async def op(db):
+            upto = (await _one(db, "SELECT COALESCE(MAX(id), 0) FROM ledger"))[0]
+            cur = await db.execute(
+                """INSERT INTO balance_snapshots (tg_id, ledger_id, balance, taken_at)
+                   SELECT l.tg_id, MAX(l.id), COALESCE(s.balance, 0) + SUM(l.amount), ?
+                   FROM ledger l LEFT JOIN balance_snapshots s ON s.tg_id = l.tg_id
+                   WHERE l.id > COALESCE(s.ledger_id, 0) AND l.id <= ?
+                   GROUP BY l.tg_id
+                   ON CONFLICT (tg_id) DO UPDATE SET
+                       ledger_id = excluded.ledger_id,
+                       balance = excluded.balance,
+                       taken_at = excluded.taken_at""",
+                (now, upto)
+            )
+            folded = cur.rowcount
+            cur = await db.execute(
+                "DELETE FROM ledger WHERE id <= ? AND created_at < ?", (upto, now - keep_days * DAY_MS)
+            )
+            pruned = cur.rowcount
+            mismatches = (await _one(
+                db,
+                """SELECT COUNT(*) FROM users u LEFT JOIN balance_snapshots s ON s.tg_id = u.tg_id
+                   WHERE s.balance IS NOT u.balance"""
+            ))[0]
+            return {"folded_accounts": folded, "pruned": pruned, "mismatches": mismatches}
+
+        return await self._write(op)
+
+    async def ledger_entries(self, tg_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+        """Newest ledger entries of one account (only what compaction has not pruned)."""
+        async with self._analytics() as db:
+            rows = await db.execute_fetchall(
+                "SELECT id, amount, kind, ref, created_at FROM ledger WHERE tg_id = ? ORDER BY id DESC LIMIT ?",
+                (tg_id, limit)
+            )
+            return [dict(r) for r in rows]
+
+    async def get_meta(self, key: str) -> Optional[str]:
+        async with self._read() as db:
+            row = await _one(db, "SELECT value FROM meta WHERE key = ?", (key,))
+            return row[0] if row else None
+
+    async def set_meta(self, key: str, value: str) -> None:
+        async def op(db):
+            await db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+        await self._write(op)
+
+    # ---------------- Leaderboards ----------------
+    async def top_balances(self, limit: int) -> List[Dict[str, Any]]:
+        """
+        Highest available balances first. Only users with holds have
+        available < balance, so the top `limit` by available are among the
+        top limit + (users with holds) by balance: an idx_users_balance walk
+        of that length, not a sort of the table.
+        """
+        async with self._analytics() as db:
+            holders = (await _one(db, "SELECT COUNT(*) FROM hold_totals"))[0]
+            rows = await db.execute_fetchall(
+                f"SELECT tg_id, username, available AS balance FROM ({USER_SELECT} ORDER BY u.balance DESC LIMIT ?)",
+                (limit + holders,)
+            )
+            return sorted((dict(r) for r in rows), key=lambda r: -r["balance"])[:limit]
+
+    async def _bump_user_rollups(self, db, tg_id: int, game: str, wagered: int, net: int) -> None:
+        now = clock.now_ms()
+        rows = [
+            (period, bucket_start(period, now), g, tg_id, wagered, net)
+            for period in LEADERBOARD_PERIODS
+            for g in (game, ALL_GAMES)
+        ]
+        await db.executemany(
+            """INSERT INTO user_rollups (period, bucket, game, tg_id, rounds, wagered, net)
+               VALUES (?, ?, ?, ?, 1, ?, ?)
+               ON CONFLICT (period, bucket, game, tg_id) DO UPDATE SET
+                   rounds = rounds + 1,
+                   wagered = wagered + excluded.wagered,
+                   net = net + excluded.net""",
+            rows
+        )
+
+    async def top_net(self, period: str, game: str = ALL_GAMES, limit: int = 10,
+                      at_ms: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Best net winnings in the current day/week bucket (index range scan, O(limit))."""
+        bucket = bucket_start(period, clock.now_ms() if at_ms is None else at_ms)
+        async with self._analytics() as db:
+            rows = await db.execute_fetchall(
+                """SELECT r.tg_id, u.username, r.net, r.rounds, r.wagered
+                   FROM user_rollups r
+                   LEFT JOIN users u ON u.tg_id = r.tg_id
+                   WHERE r.period = ? AND r.bucket = ? AND r.game = ?
+                   ORDER BY r.net DESC LIMIT ?""",
+                (period, bucket, game, limit)
+            )
+            return [dict(r) for r in rows]
+
+    async def prune_user_rollups(self, keep_weeks: int = 4) -> int:
+        """Drop rollup buckets older than keep_weeks; returns deleted row count."""
+        cutoff = bucket_start("week", clock.now_ms()) - keep_weeks * WEEK_MS
+
+        async def op(db):
+            cur = await db.execute("DELETE FROM user_rollups WHERE bucket < ?", (cutoff,))
+            return cur.rowcount
+
+        return await self._write(op)
+
+    # ---------------- Game rollups / stats ----------------
+    async def _bump_game_rollup(self, db, game: str, wagered: int, paid: int, result: str) -> None:
+        await db.execute(
+            """INSERT INTO game_rollups (span, bucket, game, rounds, wagered, paid, net, wins, losses, pushes)
+               VALUES ('hour', ?, ?, 1, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (span, bucket, game) DO UPDATE SET
+                   rounds = rounds + 1,
+                   wagered = wagered + excluded.wagered,
+                   paid = paid + excluded.paid,
+                   net = net + excluded.net,
+                   wins = wins + excluded.wins,
+                   losses = losses + excluded.losses,
+                   pushes = pushes + excluded.pushes""",
+            (bucket_start("hour", clock.now_ms()), game, wagered, paid, paid - wagered,
+             int(result == "win"), int(result == "loss"), int(result == "push"))
+        )
+
+    async def game_stats(self, since_ms: Optional[int] = None, game: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Totals from game_rollups since since_ms (None = all time), per game.
+        Hours that were already compacted are counted by whole day, so the
+        window start is exact for recent data and day-granular for older data.
+        Cost is bounded by the number of rollup rows, not by bets.
+        """
+        where = ""
+        args: list = []
+        if since_ms is not None:
+            where = "WHERE ((span = 'hour' AND bucket >= ?) OR (span = 'day' AND bucket >= ?))"
+            args += [bucket_start("hour", since_ms), bucket_start("day", since_ms)]
+        if game:
+            where += (" AND " if where else "WHERE ") + "game = ?"
+            args.append(game)
+        async with self._analytics() as db:
+            rows = await db.execute_fetchall(
+                f"""SELECT game, SUM(rounds) AS rounds, SUM(wagered) AS wagered, SUM(paid) AS paid,
+                           SUM(net) AS net, SUM(wins) AS wins, SUM(losses) AS losses, SUM(pushes) AS pushes
+                    FROM game_rollups {where}
+                    GROUP BY game ORDER BY game""",
+                args
+            )
+            return {r["game"]: dict(r) for r in rows}
+
+    async def compact_rollups(self, hourly_keep_days: int = 14) -> Dict[str, int]:
+        """
+        Periodic rollup maintenance:
+        1. Re-derive every closed hour since the last run from bets, so the
+           incremental counters are backed by the source rows.
+        2. Fold hourly rows older than hourly_keep_days into daily rows.
+        Step 1 never reaches further back than hourly_keep_days, which config
+        keeps below the bet retention, so it only reads bets not yet archived.
+        """
+        now = clock.now_ms()
+        current_hour = bucket_start("hour", now)
+        fold_before = bucket_start("day", now) - hourly_keep_days * DAY_MS
+
+        async def op(db):
+            row = await _one(db, "SELECT value FROM meta WHERE key = 'rollups_reconciled_to'")
+            since = int(row["value"]) if row else None
+            if since is None:
+                first = (await _one(db, "SELECT MIN(created_at) AS m FROM bets"))["m"]
+                since = bucket_start("hour", first) if first is not None else current_hour
+            since = max(since, fold_before)
+
+            reconciled = 0
+            if since < current_hour:
+                await db.execute(
+                    "DELETE FROM game_rollups WHERE span = 'hour' AND bucket >= ? AND bucket < ?",
+                    (since, current_hour)
+                )
+                cur = await db.execute(
+                    """INSERT INTO game_rollups (span, bucket, game, rounds, wagered, paid, net, wins, losses, pushes)
+                        SELECT 'hour', (created_at / ?) * ?, game, COUNT(*), SUM(amount), SUM(amount + delta), SUM(delta),
+                               SUM(result = 'win'), SUM(result = 'loss'), SUM(result = 'push')
+                        FROM bets
+                        WHERE created_at >= ? AND created_at < ?
+                        GROUP BY 2, game""",
+                    (HOUR_MS, HOUR_MS, since, current_hour)
+                )
+                reconciled = cur.rowcount
+
+            cur = await db.execute(
+                """INSERT INTO game_rollups (span, bucket, game, rounds, wagered, paid, net, wins, losses, pushes)
+                   SELECT 'day', (bucket / ?) * ?, game, SUM(rounds), SUM(wagered), SUM(paid), SUM(net),
+                          SUM(wins), SUM(losses), SUM(pushes)
+                   FROM game_rollups WHERE span = 'hour' AND bucket < ?
+                   GROUP BY 2, game
+                   ON CONFLICT (span, bucket, game) DO UPDATE SET
+                       rounds = rounds + excluded.rounds,
+                       wagered = wagered + excluded.wagered,
+                       paid = paid + excluded.paid,
+                       net = net + excluded.net,
+                       wins = wins + excluded.wins,
+                       losses = losses + excluded.losses,
+                       pushes = pushes + excluded.pushes""",
+                (DAY_MS, DAY_MS, fold_before)
+            )
+            folded = cur.rowcount
+            await db.execute("DELETE FROM game_rollups WHERE span = 'hour' AND bucket < ?", (fold_before,))
+            await db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('rollups_reconciled_to', ?)",
+                (str(current_hour),)
+            )
+            return {"reconciled_hours": reconciled, "folded_days": folded}
+
+        return await self._write(op)
+
+    # ---------------- Archival ----------------
+    async def archive_bets(self, retention_days: int, batch_size: int = 5000) -> int:
+        """
+        Move bets older than retention_days into monthly segment files
+        (storage.archive), batch by batch: append + fsync the block first,
+        then delete the same rows. Returns the number of rows archived.
+
+        The append and the delete are not one transaction. A crash between
+        them leaves the batch in both places, and the next run selects it
+        again. That is safe because append_rows skips ids up to the highest
+        id already in the segment (ids only grow, and segments are written in
+        id order), so the rows are deleted without being written twice.
+        """
+        if not self.archive_dir:
+            return 0
+        cutoff = clock.now_ms() - retention_days * DAY_MS
+        moved = 0
+        while True:
+            async with self._analytics() as db:
+                rows = [dict(r) for r in await db.execute_fetchall(
+                    """SELECT b.id, u.tg_id, u.username, b.game, b.amount, b.result, b.delta, b.created_at
+                       FROM bets b JOIN users u ON u.id = b.user_id
+                       WHERE b.created_at < ?
+                       ORDER BY b.id LIMIT ?""",
+                    (cutoff, batch_size)
+                )]
+            if not rows:
+                return moved
+            for name, group in groupby(rows, key=lambda r: archive.segment_name(r["created_at"])):
+                await asyncio.to_thread(archive.append_rows, self.archive_dir, name, list(group))
+
+            async def op(db, ids=[(r["id"],) for r in rows]):
+                # Exactly the archived ids: bets whose user row is gone were not copied.
+                await db.executemany("DELETE FROM bets WHERE id = ?", ids)
+
+            await self._write(op)
+            moved += len(rows)
+            if len(rows) < batch_size:
+                return moved
+
+    async def recent_bets(self, tg_id: int, limit: int = 5) -> List[Dict[str, Any]]:
+        """Newest bets first, reading the live table and then the archive segments."""
+        async with self._analytics() as db:
+            rows = await db.execute_fetchall(
+                """SELECT b.id, b.game, b.amount, b.result, b.delta, b.created_at
+                   FROM bets b
+                   JOIN users u ON u.id = b.user_id
+                   WHERE u.tg_id = ?
+                   ORDER BY b.id DESC LIMIT ?""",
+                (tg_id, limit)
+            )
+            out = [dict(r) for r in rows]
+        if len(out) < limit and self.archive_dir:
+            out += await asyncio.to_thread(self._archived_tail, tg_id, limit - len(out))
+        return out
+
+    def _archived_tail(self, tg_id: int, need: int) -> List[Dict[str, Any]]:
+        found: List[Dict[str, Any]] = []
+        for path in reversed(archive.list_segments(self.archive_dir)):
+            tail = collections.deque(maxlen=need - len(found))
+            with archive.Segment(path) as seg:
+                for row in seg.rows():
+                    if row["tg_id"] == tg_id:
+                        tail.append(row)
+            found += reversed(tail)
+            if len(found) >= need:
+                break
+        return found
+
+    # ---------------- Export ----------------
+    async def iter_bets(self, tg_id: Optional[int] = None, since_ms: Optional[int] = None,
+                        until_ms: Optional[int] = None, page_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Yield pages of live bets joined with users, ascending id, using keyset
+        pagination (b.id > last_id) on the analytics pool. Every page is its
+        own short read, so no snapshot is held between pages and WAL
+        checkpoints / gameplay writes are never blocked by an export.
+        since_ms/until_ms are epoch ms (inclusive / exclusive).
+        """
+        where = ["b.id > ?"]
+        args: List[Any] = []
+        if tg_id is not None:
+            where.append("u.tg_id = ?")
+            args.append(tg_id)
+        if since_ms is not None:
+            where.append("b.created_at >= ?")
+            args.append(since_ms)
+        if until_ms is not None:
+            where.append("b.created_at < ?")
+            args.append(until_ms)
+        sql = (
+            "SELECT b.id, u.tg_id, u.username, b.game, b.amount, b.result, b.delta, b.created_at "
+            "FROM bets b JOIN users u ON u.id = b.user_id "
+            f"WHERE {' AND '.join(where)} ORDER BY b.id LIMIT ?"
+        )
+        last_id = 0
+        while True:
+            # One analytics borrow per page: the consumer may take its time between pages.
+            async with self._analytics() as db:
+                page = [dict(r) for r in await db.execute_fetchall(sql, (last_id, *args, page_size))]
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            last_id = page[-1]["id"]
+
@@ -0,0 +1,323 @@
+"""
+In-memory storage engine (storage.base.Storage) for tests, benchmarks and
+simulations.
+
+Rows have the same shape as the SQLite tables (ids, epoch-ms timestamps), so
+handlers and services.recovery see no difference. A round's hold is its
+bet; each user keeps the sum of their holds in "held". Every method body runs
+without awaiting anything, which on a single event loop makes each call
+atomic: the checks and writes of start_active_round,
+adjust_active_round_bet, save_active_round and resolve_active_round can
+never interleave with another call, matching the writer-task
+transactions of the SQLite engine. Listeners are notified after the
+change is applied.
+
+Nothing is persisted; the state lives as long as the object.
+"""
+
+import heapq
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+from services import clock
+from storage.base import Storage
+
+
+class MemoryStorage(Storage):
+    def __init__(self, starting_balance: int):
+        super().__init__(starting_balance)
+        self.archive_dir = None  # no archive segments behind this engine
+        self._users: Dict[int, Dict[str, Any]] = {}
+        self._names: Dict[str, Set[int]] = defaultdict(set)
+        self._bets: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+        self._rounds: Dict[int, Dict[str, Dict[str, Any]]] = defaultdict(dict)  # tg_id -> game -> round
+        self._user_seq = 0
+        self._bet_seq = 0
+        self._round_seq = 0
+
+    # ---------------- Users ----------------
+    def _create_user(self, tg_id: int, username: Optional[str]) -> Dict[str, Any]:
+        self._user_seq += 1
+        user = {
+            "id": self._user_seq,
+            "tg_id": tg_id,
+            "username": username,
+            "balance": self.starting_balance,
+            "created_at": clock.now_ms(),
+            "last_bonus_at": None,
+            "held": 0,
+        }
+        self._users[tg_id] = user
+        if username:
+            self._names[username.lower()].add(tg_id)
+        return user
+
+    @staticmethod
+    def _row(user: Dict[str, Any]) -> Dict[str, Any]:
+        return {**user, "available": user["balance"] - user["held"]}
+
+    @staticmethod
+    def _available(user: Dict[str, Any]) -> int:
+        return user["balance"] - user["held"]
+
+    async def get_or_create_user(self, tg_id: int, username: Optional[str]) -> Dict[str, Any]:
+        user = self._users.get(tg_id)
+        if user is None:
+            user = self._create_user(tg_id, username)
+            self._notify_balance(tg_id, self._available(user), username)
+            return self._row(user)
+        if username and username != user["username"]:
+            old = user["username"]
+            if old:
+                self._names[old.lower()].discard(tg_id)
+            self._names[username.lower()].add(tg_id)
+            user["username"] = username
+            self._notify_rename(tg_id, old, username)
+            self._notify_balance(tg_id, self._available(user), username)
+        return self._row(user)
+
+    async def find_user(self, tg_id: Optional[int] = None, username: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        if tg_id is not None:
+            user = self._users.get(tg_id)
+        else:
+            ids = self._names.get((username or "").lower())
+            user = max((self._users[t] for t in ids), key=lambda u: u["id"]) if ids else None
+        return self._row(user) if user else None
+
+    async def update_balance(self, tg_id: int, delta: int, kind: str = "adjust", ref: Optional[int] = None) -> int:
+        user = self._users.get(tg_id)
+        if user is None:
+            # Same as the SQLite engine: a missing user is recreated, delta dropped.
+            user = self._create_user(tg_id, None)
+        else:
+            user["balance"] += delta
+        self._notify_balance(tg_id, self._available(user))
+        return self._available(user)
+
+    async def set_balance(self, tg_id: int, amount: int, ref: Optional[int] = None) -> Optional[int]:
+        user = self._users.get(tg_id)
+        if user is None:
+            return None
+        old, user["balance"] = user["balance"], amount
+        self._notify_balance(tg_id, self._available(user))
+        return old
+
+    async def get_balances(self, tg_ids: List[int]) -> Dict[int, int]:
+        return {t: self._available(self._users[t]) for t in tg_ids if t in self._users}
+
+    async def top_balances(self, limit: int) -> List[Dict[str, Any]]:
+        top = heapq.nlargest(limit, self._users.values(), key=self._available)
+        return [{"tg_id": u["tg_id"], "username": u["username"], "balance": self._available(u)} for u in top]
+
+    # ---------------- Bets history ----------------
+    def _add_bet(self, user: Dict[str, Any], game: str, amount: int, result: str, delta: int, now: int) -> None:
+        self._bet_seq += 1
+        self._bets[user["tg_id"]].append({
+            "id": self._bet_seq,
+            "user_id": user["id"],
+            "game": game,
+            "amount": amount,
+            "result": result,
+            "delta": delta,
+            "created_at": now,
+        })
+
+    async def record_bet(self, tg_id: int, game: str, amount: int, result: str, delta: int) -> None:
+        user = self._users.get(tg_id)
+        if user is not None:
+            self._add_bet(user, game, amount, result, delta, clock.now_ms())
+
+    async def recent_bets(self, tg_id: int, limit: int = 5) -> List[Dict[str, Any]]:
+        bets = self._bets.get(tg_id, [])[-limit:] if limit > 0 else []
+        return [{k: b[k] for k in ("id", "game", "amount", "result", "delta", "created_at")}
+                for b in reversed(bets)]
+
+    # ---------------- Active round lifecycle ----------------
+    def _find(self, tg_id: int, game: Optional[str]) -> Optional[Dict[str, Any]]:
+        rounds = self._rounds.get(tg_id)
+        if not rounds:
+            return None
+        if game is not None:
+            return rounds.get(game)
+        return max(rounds.values(), key=lambda r: (r["updated_at"], r["id"]))
+
+    def _drop(self, ar: Dict[str, Any]) -> None:
+        rounds = self._rounds[ar["tg_id"]]
+        del rounds[ar["game"]]
+        if not rounds:
+            del self._rounds[ar["tg_id"]]
+
+    def _close_hold(self, ar: Dict[str, Any], payout: Optional[int]) -> Optional[Dict[str, Any]]:
+        """Same as Database._close_holds for one round; payout None releases the hold."""
+        user = self._users.get(ar["tg_id"])
+        if user is None:
+            return None
+        user["held"] -= ar["bet"]
+        if payout is not None:
+            user["balance"] += payout - ar["bet"]
+        return user
+
+    async def start_active_round(self, tg_id: int, game: str, bet: int, state_json: str) -> bool:
+        if self._find(tg_id, game) is not None:
+            return False
+        user = self._users.get(tg_id)
+        if user is None or self._available(user) < bet:
+            return False
+        if bet > 0:
+            user["held"] += bet
+        now = clock.now_ms()
+        self._round_seq += 1
+        self._rounds[tg_id][game] = {
+            "id": self._round_seq,
+            "tg_id": tg_id,
+            "game": game,
+            "bet": bet,
+            "state_json": state_json,
+            "created_at": now,
+            "updated_at": now,
+            "version": 0,
+        }
+        if bet > 0:
+            self._notify_balance(tg_id, self._available(user))
+        return True
+
+    async def adjust_active_round_bet(self, tg_id: int, delta: int, game: Optional[str] = None) -> bool:
+        if delta <= 0:
+            return False
+        ar = self._find(tg_id, game)
+        user = self._users.get(tg_id)
+        if ar is None or user is None or self._available(user) < delta:
+            return False
+        user["held"] += delta
+        ar["bet"] += delta
+        ar["updated_at"] = clock.now_ms()
+        ar["version"] += 1
+        self._notify_balance(tg_id, self._available(user))
+        return True
+
+    async def get_active_round(self, tg_id: int, game: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        ar = self._find(tg_id, game)
+        return dict(ar) if ar else None
+
+    async def update_active_round(self, tg_id: int, state_json: str, game: Optional[str] = None) -> None:
+        ar = self._find(tg_id, game)
+        if ar is not None:
+            ar["state_json"] = state_json
+            ar["updated_at"] = clock.now_ms()
+            ar["version"] += 1
+
+    async def save_active_round(self, tg_id: int, state_json: str, version: int, stake: int = 0,
+                                game: Optional[str] = None) -> Dict[str, Any]:
+        ar = self._find(tg_id, game)
+        if ar is None:
+            return {"ok": False, "reason": "missing"}
+        if ar["version"] != version:
+            return {"ok": False, "reason": "conflict"}
+        balance = None
+        if stake > 0:
+            user = self._users.get(tg_id)
+            if user is None or self._available(user) < stake:
+                return {"ok": False, "reason": "funds"}
+            user["held"] += stake
+            ar["bet"] += stake
+            balance = self._available(user)
+        ar["state_json"] = state_json
+        ar["updated_at"] = clock.now_ms()
+        ar["version"] += 1
+        if balance is not None:
+            self._notify_balance(tg_id, balance)
+        return {"ok": True, "version": ar["version"], "balance": balance}
+
+    async def resolve_active_round(self, tg_id: int, result: str, total_payout: int,
+                                   game: Optional[str] = None) -> None:
+        active = self._find(tg_id, game)
+        if active is None:
+            return
+        self._drop(active)
+        user = self._close_hold(active, total_payout)
+        if user is None:
+            return
+        self._add_bet(user, active["game"], active["bet"], result, total_payout - active["bet"], clock.now_ms())
+        self._notify_balance(tg_id, self._available(user))
+
+    async def delete_active_round(self, tg_id: int, game: Optional[str] = None) -> None:
+        active = self._find(tg_id, game)
+        if active is not None:
+            self._drop(active)
+            self._close_hold(active, 0)
+
+    async def cancel_active_round(self, tg_id: int, refund: bool = True, game: Optional[str] = None) -> Optional[int]:
+        if game is None:
+            closing = list(self._rounds.get(tg_id, {}).values())
+        else:
+            closing = [ar for ar in [self._find(tg_id, game)] if ar is not None]
+        if not closing:
+            return None
+        user = None
+        for active in closing:
+            self._drop(active)
+            user = self._close_hold(active, None if refund else 0)
+        if not refund:
+            return 0
+        refunded = sum(ar["bet"] for ar in closing)
+        if user is not None and refunded:
+            self._notify_balance(tg_id, self._available(user))
+        return refunded
+
+    async def reset_active_round(self, tg_id: int, state_json: str, game: Optional[str] = None) -> Optional[int]:
+        active = self._find(tg_id, game)
+        user = self._users.get(tg_id)
+        if active is None or user is None:
+            return None
+        bet, active["bet"] = active["bet"], 0
+        active["state_json"] = state_json
+        active["updated_at"] = clock.now_ms()
+        active["version"] += 1
+        if bet:
+            user["held"] -= bet
+            self._notify_balance(tg_id, self._available(user))
+        return self._available(user)
+
+    def _all_rounds(self) -> List[Dict[str, Any]]:
+        return [r for rounds in self._rounds.values() for r in rounds.values()]
+
+    async def iter_active_rounds(self, batch_size: int = 200) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Same paging contract as the SQLite engine: id order, resumes after the last id seen."""
+        last_id = 0
+        while True:
+            batch = sorted((r for r in self._all_rounds() if r["id"] > last_id), key=lambda r: r["id"])
+            batch = [dict(r) for r in batch[:batch_size]]
+            if not batch:
+                return
+            yield batch
+            if len(batch) < batch_size:
+                return
+            last_id = batch[-1]["id"]
+
+    async def stale_active_rounds(self, idle_s: float, limit: int = 200) -> List[Dict[str, Any]]:
+        cutoff = clock.now_ms() - int(idle_s * 1000)
+        stale = [r for r in self._all_rounds() if r["updated_at"] < cutoff]
+        return [dict(r) for r in sorted(stale, key=lambda r: r["updated_at"])[:limit]]
+
+    async def settle_rounds(self, items: List[tuple]) -> List[tuple]:
+        """See Database.settle_rounds; rows changed since they were read are skipped."""
+        closed = []
+        for row, result, payout in items:
+            current = self._find(row["tg_id"], row["game"])
+            if current is None or current["id"] != row["id"] or current["version"] != row["version"]:
+                continue
+            closed.append((row, result, payout))
+        now = clock.now_ms()
+        touched = set()
+        for row, result, payout in closed:
+            active = self._find(row["tg_id"], row["game"])
+            self._drop(active)
+            user = self._close_hold(active, None if result is None else payout)
+            if user is None:
+                continue
+            touched.add(row["tg_id"])
+            if result is not None:
+                self._add_bet(user, row["game"], row["bet"], result, payout - row["bet"], now)
+        for tg in touched:
+            self._notify_balance(tg, self._available(self._users[tg]))
+        return closed
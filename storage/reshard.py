@@ -0,0 +1,259 @@
+"""
+Offline resharding: copy a database laid out as N shards into M shards.
+
+    python -m storage.reshard --db data/casino.db --from 1 --to 4 --archive-dir data/archive
+    python -m storage.reshard --db data/casino.db --from 4 --to 1
+
+Stop the bot first. Sources are upgraded to the current schema (as the
+bot's own start would) and otherwise only read; targets must not exist yet.
+main() reads the totals of the sources (users, total balance and holds,
+live and archived bets, open rounds) before copying and compares the
+targets against them. When they match, set DB_SHARDS=M and start the
+bot; remove the old files afterwards.
+
+What moves where:
+- users, active_rounds, bets, user_rollups, admin_audit -> shard tg_id % M
+  (users and rounds get new ids in the target; bets follow through user_id)
+- holds and hold_totals -> shard tg_id % M (holds follow their round's new id)
+- game_rollups -> summed into target shard 0 (game_stats sums all shards)
+- archived bets -> the target's archive dir, renumbered so that ids stay
+  ascending per segment and below every live bet id of that target
+- ledger entries -> shard tg_id % M (new ids, same order per account);
+  balance snapshots are re-taken from the copied balances
+- meta: the rollup reconcile watermark (minimum over the sources) and the
+  new "i/M" shard marker
+"""
+
+import argparse
+import asyncio
+import sqlite3
+import sys
+from itertools import groupby
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from storage import archive
+from storage.db import Database
+from storage.sharded import shard_archive_dir, shard_path
+
+Layout = List[Tuple[str, Optional[str]]]  # [(db path, archive dir)]
+
+
+def layout(path: str, count: int, archive_dir: Optional[str]) -> Layout:
+    if count == 1:
+        return [(path, archive_dir)]
+    return [(shard_path(path, i, count), shard_archive_dir(archive_dir, i, count)) for i in range(count)]
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _copy_by_tg(src: sqlite3.Connection, targets: List[sqlite3.Connection], table: str,
+                upsert: Optional[str] = None) -> int:
+    cols = [c for c in _columns(src, table) if c != "id"]
+    sql = f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))}) {upsert or ''}"
+    n = 0
+    tg_pos = cols.index("tg_id")
+    for row in src.execute(f"SELECT {', '.join(cols)} FROM {table}"):
+        targets[row[tg_pos] % len(targets)].execute(sql, row)
+        n += 1
+    return n
+
+
+def upgrade(path: str, count: int, archive_dir: Optional[str] = None) -> None:
+    """Bring every file of an existing layout to the current schema (Database.init)."""
+    for p, _a in layout(path, count, archive_dir):
+        if not Path(p).exists():
+            raise SystemExit(f"source {p} does not exist")
+
+    async def run():
+        for p, a in layout(path, count, archive_dir):
+            db = Database(p, 0, archive_dir=a)
+            await db.init()
+            await db.close()
+    asyncio.run(run())
+
+
+def reshard(path: str, src_count: int, dst_count: int, archive_dir: Optional[str] = None) -> Dict[str, int]:
+    sources = layout(path, src_count, archive_dir)
+    dests = layout(path, dst_count, archive_dir)
+    for p, a in dests:
+        if Path(p).exists() or (a and archive.list_segments(a)):
+            raise SystemExit(f"target {p} (or its archive) already exists; refusing to overwrite")
+
+    upgrade(path, src_count, archive_dir)
+
+    async def create():
+        for i, (p, a) in enumerate(dests):
+            db = Database(p, 0, archive_dir=a)
+            await db.init()
+            if dst_count > 1:
+                await db.set_meta("shard", f"{i}/{dst_count}")
+            await db.close()
+    asyncio.run(create())
+
+    src = [sqlite3.connect(p) for p, _a in sources]
+    dst = [sqlite3.connect(p) for p, _a in dests]
+    counts = {"users": 0, "bets": 0, "archived": 0, "active_rounds": 0, "balance": 0, "held": 0}
+    try:
+        for c in dst:
+            c.execute("BEGIN")
+
+        # users -> new ids per target
+        user_cols = [c for c in _columns(src[0], "users") if c != "id"]
+        user_sql = f"INSERT INTO users ({', '.join(user_cols)}) VALUES ({', '.join('?' * len(user_cols))})"
+        tg_pos = user_cols.index("tg_id")
+        new_user_id: Dict[int, int] = {}  # tg_id -> id in its target
+        for s in src:
+            for row in s.execute(f"SELECT {', '.join(user_cols)} FROM users ORDER BY id"):
+                cur = dst[row[tg_pos] % dst_count].execute(user_sql, row)
+                new_user_id[row[tg_pos]] = cur.lastrowid
+                counts["users"] += 1
+                counts["balance"] += row[user_cols.index("balance")]
+
+        # archived bets first, so live bet ids can continue after them
+        next_bet_id = [0] * dst_count
+        for _p, a in sources:
+            if not a:
+                continue
+            for seg_path in archive.list_segments(a):
+                with archive.Segment(seg_path) as seg:
+                    rows = list(seg.rows())
+                by_target: Dict[int, List[dict]] = {}
+                for r in rows:
+                    by_target.setdefault(r["tg_id"] % dst_count, []).append(r)
+                for t, trows in by_target.items():
+                    for r in trows:
+                        next_bet_id[t] += 1
+                        r["id"] = next_bet_id[t]
+                    for name, group in groupby(trows, key=lambda r: archive.segment_name(r["created_at"])):
+                        archive.append_rows(dests[t][1], name, list(group))
+                    counts["archived"] += len(trows)
+
+        # live bets, in source id order
+        for s in src:
+            for _id, tg, game, amount, result, delta, created_at in s.execute(
+                """SELECT b.id, u.tg_id, b.game, b.amount, b.result, b.delta, b.created_at
+                   FROM bets b JOIN users u ON u.id = b.user_id ORDER BY b.id"""
+            ):
+                t = tg % dst_count
+                next_bet_id[t] += 1
+                dst[t].execute(
+                    "INSERT INTO bets (id, user_id, game, amount, result, delta, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (next_bet_id[t], new_user_id[tg], game, amount, result, delta, created_at)
+                )
+                counts["bets"] += 1
+
+        for s in src:
+            # rounds -> new ids per target; their holds are keyed by round id
+            round_cols = [c for c in _columns(s, "active_rounds") if c != "id"]
+            round_sql = f"INSERT INTO active_rounds ({', '.join(round_cols)}) VALUES ({', '.join('?' * len(round_cols))})"
+            tg_pos = round_cols.index("tg_id")
+            new_round_id: Dict[int, int] = {}
+            for old_id, *row in s.execute(f"SELECT id, {', '.join(round_cols)} FROM active_rounds ORDER BY id"):
+                new_round_id[old_id] = dst[row[tg_pos] % dst_count].execute(round_sql, row).lastrowid
+                counts["active_rounds"] += 1
+            for round_id, tg, game, amount, created_at in s.execute(
+                "SELECT round_id, tg_id, game, amount, created_at FROM holds"
+            ):
+                dst[tg % dst_count].execute(
+                    "INSERT INTO holds (round_id, tg_id, game, amount, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (new_round_id[round_id], tg, game, amount, created_at)
+                )
+            counts["held"] += s.execute("SELECT COALESCE(SUM(held), 0) FROM hold_totals").fetchone()[0]
+            _copy_by_tg(s, dst, "hold_totals")
+            _copy_by_tg(s, dst, "admin_audit")
+            _copy_by_tg(s, dst, "ledger")
+            _copy_by_tg(
+                s, dst, "user_rollups",
+                upsert="""ON CONFLICT (period, bucket, game, tg_id) DO UPDATE SET
+                            rounds = rounds + excluded.rounds,
+                            wagered = wagered + excluded.wagered,
+                            net = net + excluded.net"""
+            )
+            for row in s.execute(
+                "SELECT span, bucket, game, rounds, wagered, paid, net, wins, losses, pushes FROM game_rollups"
+            ):
+                dst[0].execute(
+                    """INSERT INTO game_rollups (span, bucket, game, rounds, wagered, paid, net, wins, losses, pushes)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT (span, bucket, game) DO UPDATE SET
+                           rounds = rounds + excluded.rounds,
+                           wagered = wagered + excluded.wagered,
+                           paid = paid + excluded.paid,
+                           net = net + excluded.net,
+                           wins = wins + excluded.wins,
+                           losses = losses + excluded.losses,
+                           pushes = pushes + excluded.pushes""",
+                    row
+                )
+
+        # Snapshot every account at its last copied ledger entry.
+        for c in dst:
+            c.execute(
+                """INSERT OR REPLACE INTO balance_snapshots (tg_id, ledger_id, balance, taken_at)
+                   SELECT u.tg_id, COALESCE((SELECT MAX(l.id) FROM ledger l WHERE l.tg_id = u.tg_id), 0),
+                          u.balance, CAST(strftime('%s', 'now') AS INTEGER) * 1000
+                   FROM users u"""
+            )
+
+        # Hours after the oldest watermark are re-derived per shard from its own bets.
+        marks = [r[0] for s in src for r in s.execute("SELECT value FROM meta WHERE key = 'rollups_reconciled_to'")]
+        if marks:
+            mark = str(min(int(m) for m in marks))
+            for c in dst:
+                c.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('rollups_reconciled_to', ?)", (mark,))
+
+        for c in dst:
+            c.commit()
+    except BaseException:
+        for c in dst:
+            c.rollback()
+        raise
+    finally:
+        for c in src + dst:
+            c.close()
+    return counts
+
+
+def verify(path: str, count: int, archive_dir: Optional[str] = None) -> Dict[str, int]:
+    """Totals read straight from the files of a layout, to compare two layouts."""
+    totals = {"users": 0, "bets": 0, "archived": 0, "active_rounds": 0, "balance": 0, "held": 0}
+    for p, a in layout(path, count, archive_dir):
+        for seg_path in archive.list_segments(a) if a else []:
+            with archive.Segment(seg_path) as seg:
+                totals["archived"] += sum(1 for _row in seg.rows())
+        with sqlite3.connect(p) as c:
+            totals["users"] += c.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            totals["balance"] += c.execute("SELECT COALESCE(SUM(balance), 0) FROM users").fetchone()[0]
+            totals["held"] += c.execute("SELECT COALESCE(SUM(held), 0) FROM hold_totals").fetchone()[0]
+            totals["bets"] += c.execute("SELECT COUNT(*) FROM bets").fetchone()[0]
+            totals["active_rounds"] += c.execute("SELECT COUNT(*) FROM active_rounds").fetchone()[0]
+    return totals
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Copy the Casinon database into a different number of shards (offline).")
+    p.add_argument("--db", required=True, help="DATABASE_PATH as configured for the bot")
+    p.add_argument("--from", dest="src", type=int, required=True, help="current DB_SHARDS")
+    p.add_argument("--to", dest="dst", type=int, required=True, help="new DB_SHARDS")
+    p.add_argument("--archive-dir", help="ARCHIVE_DIR as configured for the bot")
+    args = p.parse_args(argv)
+    if args.src < 1 or args.dst < 1 or args.src == args.dst:
+        p.error("--from and --to must be different positive shard counts")
+
+    upgrade(args.db, args.src, args.archive_dir)
+    source = verify(args.db, args.src, args.archive_dir)
+    copied = reshard(args.db, args.src, args.dst, args.archive_dir)
+    check = verify(args.db, args.dst, args.archive_dir)
+    print(f"copied: {copied}")
+    print(f"source: {source}")
+    print(f"target: {check}")
+    ok = check == source
+    print("OK - set DB_SHARDS=%d and start the bot" % args.dst if ok else "MISMATCH - do not switch")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
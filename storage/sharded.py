@@ -0,0 +1,257 @@
+"""
+Sharded SQLite storage: users, active rounds, bets and per-user rollups
+are split across N database files by tg_id % N.
+
+    data/casino.db, 4 shards -> data/casino.shard0of4.db ... casino.shard3of4.db
+    archive segments          -> <archive_dir>/shard0of4/ ...
+
+Each shard is a plain storage.db.Database with its own file, WAL and
+writer task, so write batches of users on different shards run in
+parallel. Everything keyed by one user goes to exactly one shard
+and keeps its single-transaction guarantees.
+
+Global queries fan out to all shards concurrently and merge:
+top_balances / top_net (merge by score), game_stats (sum),
+username lookups (newest account wins), maintenance jobs (sum of counts).
+apply_admin_balances commits one transaction per shard, so a bulk change
+spanning shards is atomic per shard, not as a whole.
+
+Row ids (rounds, bets) are shard-local; callers must not compare them
+across users. services.recovery passes rows back unchanged, and
+settle_rounds routes them by tg_id.
+
+Changing N is an offline operation: python -m storage.reshard.
+Every shard records its "i/N" in meta and init() refuses to start with
+a different layout. backup() snapshots every shard file (storage.backup).
+"""
+
+import asyncio
+import heapq
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from storage.base import Storage
+from storage.db import ALL_GAMES, Database
+
+
+def shard_path(path: str, index: int, count: int) -> str:
+    p = Path(path)
+    return str(p.with_name(f"{p.stem}.shard{index}of{count}{p.suffix}"))
+
+
+def shard_archive_dir(archive_dir: Optional[str], index: int, count: int) -> Optional[str]:
+    return str(Path(archive_dir) / f"shard{index}of{count}") if archive_dir else None
+
+
+class ShardedStorage(Storage):
+    def __init__(self, path: str, shards: int, starting_balance: int, archive_dir: Optional[str] = None,
+                 read_pool: int = 4, write_batch: int = 64, analytics_pool: int = 2,
+                 analytics_cache_kib: int = 16384, analytics_max_query_ms: int = 10_000):
+        if shards < 1:
+            raise ValueError("shards must be >= 1")
+        super().__init__(starting_balance)
+        self.path = path
+        self.archive_dir = archive_dir
+        self.shards: List[Database] = [
+            Database(shard_path(path, i, shards), starting_balance,
+                     archive_dir=shard_archive_dir(archive_dir, i, shards),
+                     read_pool=read_pool, write_batch=write_batch, analytics_pool=analytics_pool,
+                     analytics_cache_kib=analytics_cache_kib, analytics_max_query_ms=analytics_max_query_ms)
+            for i in range(shards)
+        ]
+        for shard in self.shards:
+            # One listener list for all shards: subscribers see every shard's changes.
+            shard.balance_listeners = self.balance_listeners
+            shard.username_listeners = self.username_listeners
+
+    def shard_for(self, tg_id: int) -> Database:
+        return self.shards[tg_id % len(self.shards)]
+
+    async def _all(self, method: str, *args, **kwargs) -> List[Any]:
+        return await asyncio.gather(*(getattr(s, method)(*args, **kwargs) for s in self.shards))
+
+    async def init(self) -> None:
+        await self._all("init")
+        n = len(self.shards)
+        for i, shard in enumerate(self.shards):
+            layout = await shard.get_meta("shard")
+            if layout is None:
+                await shard.set_meta("shard", f"{i}/{n}")
+            elif layout != f"{i}/{n}":
+                await self.close()
+                raise RuntimeError(
+                    f"{shard.path} belongs to shard layout {layout}, expected {i}/{n}; "
+                    "run python -m storage.reshard to change the shard count"
+                )
+
+    async def close(self) -> None:
+        await self._all("close")
+
+    async def checkpoint(self, mode: str = "PASSIVE") -> None:
+        await self._all("checkpoint", mode)
+
+    async def backup(self, backup_dir: str, keep: int = 8, pages: int = 256,
+                     step_sleep_s: float = 0.005) -> List[Dict[str, Any]]:
+        """One snapshot per shard, taken one after another to bound the extra disk I/O."""
+        return [await shard.backup(backup_dir, keep, pages, step_sleep_s) for shard in self.shards]
+
+    # ---------------- Users ----------------
+    async def get_or_create_user(self, tg_id: int, username: Optional[str]) -> Dict[str, Any]:
+        return await self.shard_for(tg_id).get_or_create_user(tg_id, username)
+
+    async def find_user(self, tg_id: Optional[int] = None, username: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        if tg_id is not None:
+            return await self.shard_for(tg_id).find_user(tg_id=tg_id)
+        found = [r for r in await self._all("find_user", username=username) if r]
+        return max(found, key=lambda r: r["created_at"]) if found else None
+
+    async def update_balance(self, tg_id: int, delta: int, kind: str = "adjust", ref: Optional[int] = None) -> int:
+        return await self.shard_for(tg_id).update_balance(tg_id, delta, kind, ref)
+
+    async def set_balance(self, tg_id: int, amount: int, ref: Optional[int] = None) -> Optional[int]:
+        return await self.shard_for(tg_id).set_balance(tg_id, amount, ref)
+
+    async def get_balances(self, tg_ids: List[int]) -> Dict[int, int]:
+        groups: Dict[int, List[int]] = {}
+        for tg in tg_ids:
+            groups.setdefault(tg % len(self.shards), []).append(tg)
+        out: Dict[int, int] = {}
+        for part in await asyncio.gather(*(self.shards[i].get_balances(group) for i, group in groups.items())):
+            out.update(part)
+        return out
+
+    async def resolve_usernames(self, names: List[str]) -> Dict[str, int]:
+        # Same rule as find_user: on a name taken in several shards the newest account wins.
+        best: Dict[str, tuple] = {}
+        for part in await self._all("_resolve_usernames", names):
+            for name, (tg_id, created_at) in part.items():
+                if name not in best or created_at > best[name][1]:
+                    best[name] = (tg_id, created_at)
+        return {name: tg_id for name, (tg_id, _created) in best.items()}
+
+    async def apply_admin_balances(self, admin_id: int, items: List[tuple], mode: str = "give") -> Dict[str, int]:
+        groups: Dict[int, List[tuple]] = {}
+        for tg, amt in items:
+            groups.setdefault(tg % len(self.shards), []).append((tg, amt))
+        parts = await asyncio.gather(
+            *(self.shards[i].apply_admin_balances(admin_id, group, mode) for i, group in groups.items())
+        )
+        totals = {"changes": 0, "users": 0, "created": 0, "total_delta": 0}
+        for part in parts:
+            for k in totals:
+                totals[k] += part[k]
+        return totals
+
+    async def claim_bonus(self, tg_id: int, amount: int, cooldown_hours: int) -> Dict[str, Any]:
+        return await self.shard_for(tg_id).claim_bonus(tg_id, amount, cooldown_hours)
+
+    async def grant_bonus_to_active(self, amount: int, cooldown_hours: int, active_days: int) -> int:
+        return sum(await self._all("grant_bonus_to_active", amount, cooldown_hours, active_days))
+
+    # ---------------- Bets history ----------------
+    async def record_bet(self, tg_id: int, game: str, amount: int, result: str, delta: int) -> None:
+        await self.shard_for(tg_id).record_bet(tg_id, game, amount, result, delta)
+
+    async def recent_bets(self, tg_id: int, limit: int = 5) -> List[Dict[str, Any]]:
+        return await self.shard_for(tg_id).recent_bets(tg_id, limit)
+
+    async def iter_bets(self, tg_id: Optional[int] = None, since_ms: Optional[int] = None,
+                        until_ms: Optional[int] = None, page_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Live bets shard by shard (ids ascend within a shard only)."""
+        shards = [self.shard_for(tg_id)] if tg_id is not None else self.shards
+        for shard in shards:
+            async for page in shard.iter_bets(tg_id, since_ms, until_ms, page_size):
+                yield page
+
+    async def archive_bets(self, retention_days: int, batch_size: int = 5000) -> int:
+        return sum(await self._all("archive_bets", retention_days, batch_size))
+
+    # ---------------- Active round lifecycle ----------------
+    async def start_active_round(self, tg_id: int, game: str, bet: int, state_json: str) -> bool:
+        return await self.shard_for(tg_id).start_active_round(tg_id, game, bet, state_json)
+
+    async def adjust_active_round_bet(self, tg_id: int, delta: int, game: Optional[str] = None) -> bool:
+        return await self.shard_for(tg_id).adjust_active_round_bet(tg_id, delta, game)
+
+    async def get_active_round(self, tg_id: int, game: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        return await self.shard_for(tg_id).get_active_round(tg_id, game)
+
+    async def update_active_round(self, tg_id: int, state_json: str, game: Optional[str] = None) -> None:
+        await self.shard_for(tg_id).update_active_round(tg_id, state_json, game)
+
+    async def save_active_round(self, tg_id: int, state_json: str, version: int, stake: int = 0,
+                                game: Optional[str] = None) -> Dict[str, Any]:
+        return await self.shard_for(tg_id).save_active_round(tg_id, state_json, version, stake, game)
+
+    async def resolve_active_round(self, tg_id: int, result: str, total_payout: int,
+                                   game: Optional[str] = None) -> None:
+        await self.shard_for(tg_id).resolve_active_round(tg_id, result, total_payout, game)
+
+    async def delete_active_round(self, tg_id: int, game: Optional[str] = None) -> None:
+        await self.shard_for(tg_id).delete_active_round(tg_id, game)
+
+    async def cancel_active_round(self, tg_id: int, refund: bool = True, game: Optional[str] = None) -> Optional[int]:
+        return await self.shard_for(tg_id).cancel_active_round(tg_id, refund, game)
+
+    async def reset_active_round(self, tg_id: int, state_json: str, game: Optional[str] = None) -> Optional[int]:
+        return await self.shard_for(tg_id).reset_active_round(tg_id, state_json, game)
+
+    async def iter_active_rounds(self, batch_size: int = 200) -> AsyncIterator[List[Dict[str, Any]]]:
+        for shard in self.shards:
+            async for batch in shard.iter_active_rounds(batch_size):
+                yield batch
+
+    async def stale_active_rounds(self, idle_s: float, limit: int = 200) -> List[Dict[str, Any]]:
+        parts = await self._all("stale_active_rounds", idle_s, limit)
+        return list(heapq.merge(*parts, key=lambda r: r["updated_at"]))[:limit]
+
+    async def settle_rounds(self, items: List[tuple]) -> List[tuple]:
+        groups: Dict[int, List[tuple]] = {}
+        for item in items:
+            groups.setdefault(item[0]["tg_id"] % len(self.shards), []).append(item)
+        parts = await asyncio.gather(*(self.shards[i].settle_rounds(g) for i, g in groups.items()))
+        return [item for part in parts for item in part]
+
+    # ---------------- Leaderboards / stats ----------------
+    async def top_balances(self, limit: int) -> List[Dict[str, Any]]:
+        parts = await self._all("top_balances", limit)
+        return list(heapq.merge(*parts, key=lambda r: -r["balance"]))[:limit]
+
+    async def top_net(self, period: str, game: str = ALL_GAMES, limit: int = 10,
+                      at_ms: Optional[int] = None) -> List[Dict[str, Any]]:
+        parts = await self._all("top_net", period, game, limit, at_ms)
+        return list(heapq.merge(*parts, key=lambda r: -r["net"]))[:limit]
+
+    async def prune_user_rollups(self, keep_weeks: int = 4) -> int:
+        return sum(await self._all("prune_user_rollups", keep_weeks))
+
+    async def game_stats(self, since_ms: Optional[int] = None, game: Optional[str] = None) -> Dict[str, Any]:
+        out: Dict[str, Dict[str, Any]] = {}
+        for part in await self._all("game_stats", since_ms, game):
+            for g, row in part.items():
+                acc = out.setdefault(g, {"game": g})
+                for k, v in row.items():
+                    if k != "game":
+                        acc[k] = acc.get(k, 0) + (v or 0)
+        return dict(sorted(out.items()))
+
+    async def compact_rollups(self, hourly_keep_days: int = 14) -> Dict[str, int]:
+        return _sum_counts(await self._all("compact_rollups", hourly_keep_days))
+
+    # ---------------- Ledger ----------------
+    async def ledger_balance(self, tg_id: int) -> Optional[int]:
+        return await self.shard_for(tg_id).ledger_balance(tg_id)
+
+    async def ledger_entries(self, tg_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+        return await self.shard_for(tg_id).ledger_entries(tg_id, limit)
+
+    async def compact_ledger(self, keep_days: int = 90) -> Dict[str, int]:
+        return _sum_counts(await self._all("compact_ledger", keep_days))
+
+
+def _sum_counts(parts: List[Dict[str, int]]) -> Dict[str, int]:
+    totals: Dict[str, int] = {}
+    for part in parts:
+        for k, v in part.items():
+            totals[k] = totals.get(k, 0) + v
+    return totals
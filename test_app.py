@@ -0,0 +1,221 @@
+"""
+App factory, settings and command-argument checks: several apps in one process share no state.
+
+    python -m pytest -q test_app.py
+"""
+
+import asyncio
+import dataclasses
+import datetime
+import gzip
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from aiogram.types import Chat, Message, Update, User  # noqa: E402
+
+import bot  # noqa: E402
+from services import clock  # noqa: E402
+from config import Settings  # noqa: E402
+
+
+def settings_in(tmp: str, starting_balance: int) -> Settings:
+    return Settings(bot_token="42:TEST", db_path=os.path.join(tmp, "casino.db"), starting_balance=starting_balance,
+                    daily_bonus_amount=100, daily_bonus_cooldown_hours=24, min_bet=1, max_bet=1000,
+                    archive_dir=os.path.join(tmp, "archive"), backup_dir=os.path.join(tmp, "backups"))
+
+
+def command(update_id: int, text: str, tg_id: int = 1) -> Update:
+    user = User(id=tg_id, is_bot=False, first_name="u")
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id, date=datetime.datetime.now(datetime.timezone.utc),
+        chat=Chat(id=tg_id, type="private"), from_user=user, text=text,
+    ))
+
+
+def test_two_apps_in_one_process(monkeypatch):
+    replies = []
+
+    async def answer(self, text, **kwargs):
+        replies.append(text)
+
+    monkeypatch.setattr(Message, "answer", answer)
+
+    with tempfile.TemporaryDirectory(prefix="casinon-test-") as tmp1, \
+            tempfile.TemporaryDirectory(prefix="casinon-test-") as tmp2:
+        one = bot.create_app(settings_in(tmp1, 100))
+        two = bot.create_app(settings_in(tmp2, 200))  # a second router/dispatcher must not clash
+
+        async def go():
+            for app in (one, two):
+                await app.db.init()
+            try:
+                # the same update id and user on both: no dedup cache or balance cache is shared
+                await one.dp.feed_update(one.bot, command(1, "/balance"))
+                await two.dp.feed_update(two.bot, command(1, "/balance"))
+            finally:
+                for app in (one, two):
+                    await app.db.close()
+                    await app.bot.session.close()
+
+        asyncio.run(go())
+
+    assert one.db is not two.db and one.dp.sub_routers[0] is not two.dp.sub_routers[0]
+    assert one.dp["db"] is one.db and two.dp["balances"] is two.balances
+    # action seqs are per app: a round advanced in one does not outdate buttons in the other
+    assert one.dp["actions"] is one.actions and one.actions is not two.actions
+    one.actions.advance(1, {"rid": "ab", "seq": 5})
+    assert one.actions.is_stale(1, ("ab", 4)) and not two.actions.is_stale(1, ("ab", 4))
+    assert replies == ["💰 Balance: 100 credits", "💰 Balance: 200 credits"]
+    assert not hasattr(bot, "db") and not hasattr(bot, "router")
+
+
+def test_hourly_rollups_must_not_outlive_bet_retention():
+    with tempfile.TemporaryDirectory(prefix="casinon-test-") as tmp:
+        ok = settings_in(tmp, 100)
+        dataclasses.replace(ok, rollup_hourly_keep_days=14, bet_retention_days=15)
+        with pytest.raises(ValueError, match="ROLLUP_HOURLY_KEEP_DAYS"):
+            dataclasses.replace(ok, rollup_hourly_keep_days=14, bet_retention_days=14)
+
+
+def test_export_arguments(monkeypatch):
+    replies, documents = [], []
+
+    async def reply(self, text, **kwargs):
+        replies.append(text)
+
+    async def answer_document(self, document, caption=None, **kwargs):
+        with gzip.open(document.path, "rt", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+        documents.append((document.filename, caption, [(r["tg_id"], r["amount"]) for r in rows]))
+
+    monkeypatch.setattr(Message, "reply", reply)
+    monkeypatch.setattr(Message, "answer_document", answer_document)
+    monkeypatch.setattr(bot, "ADMIN_IDS", {1})
+
+    with tempfile.TemporaryDirectory(prefix="casinon-test-") as tmp:
+        app = bot.create_app(settings_in(tmp, 100))
+        day = clock.iso_to_ms("2025-03-14T00:00:00")
+
+        async def go():
+            await app.db.init()
+            try:
+                for tg, name, at, amount in ((2, "bob", day - 1, 1), (2, "bob", day, 2), (3, "cat", day + 1, 3),
+                                             (3, "cat", day + 86_400_000, 4)):
+                    with clock.frozen(at):
+                        await app.db.get_or_create_user(tg, name)
+                        await app.db.record_bet(tg, "dice", amount, "win", amount)
+                for i, text in enumerate((
+                    "/export 2025-03-14 jsonl",  # a leading date: every user, from that day on
+                    "/export 2025-03-14 2025-03-14 jsonl",  # both ends inclusive
+                    "/export @bob 2025-03-14 jsonl",
+                    "/export all jsonl",
+                    "/export all 2025-13-01",
+                    "/export @nobody",
+                ), start=1):
+                    await app.dp.feed_update(app.bot, command(i, text))
+            finally:
+                await app.db.close()
+                await app.bot.session.close()
+
+        asyncio.run(go())
+
+    assert documents == [
+        ("bets-all-2025-03-14-now.jsonl.gz", "📤 3 bets", [(2, 2), (3, 3), (3, 4)]),
+        ("bets-all-2025-03-14-2025-03-14.jsonl.gz", "📤 2 bets", [(2, 2), (3, 3)]),
+        ("bets-bob-2025-03-14-now.jsonl.gz", "📤 1 bets", [(2, 2)]),
+        ("bets-all-start-now.jsonl.gz", "📤 4 bets", [(2, 1), (2, 2), (3, 3), (3, 4)]),
+    ]
+    assert len(replies) == 2 and replies[0].startswith("Usage: /export") and replies[1] == "User not found."
+
+
+def test_parse_bulk_keeps_good_lines_and_reports_bad_ones():
+    items, errors = bot._parse_bulk("tg_id,amount\n1,50\n@bob 20\n3\n@ -5\n4,abc\n1 70; @ghost 10")
+    assert items == [("1", 50), ("@bob", 20), ("1", 70), ("@ghost", 10)]  # repeats are kept in order
+    assert errors == ["line 4: expected <target> <amount>", "line 5: bad target '@'", "line 6: bad amount 'abc'"]
+
+
+def test_bulk_commands_apply_good_lines_with_one_audit_and_ledger_row_each(monkeypatch):
+    replies = []
+
+    async def reply(self, text, **kwargs):
+        replies.append(text)
+
+    monkeypatch.setattr(Message, "reply", reply)
+    monkeypatch.setattr(bot, "ADMIN_IDS", {9})
+
+    with tempfile.TemporaryDirectory(prefix="casinon-test-") as tmp:
+        app = bot.create_app(settings_in(tmp, 100))
+
+        async def go():
+            await app.db.init()
+            try:
+                await app.db.get_or_create_user(1, "amy")
+                await app.db.get_or_create_user(2, "bob")
+                # set: the last line per user wins; the bad amount, the unknown name and the garbage line are skipped
+                await app.dp.feed_update(app.bot, command(1, "/setbulk 1 50; @bob 20; 1 -5; @ghost 10; 1 70; 4 x", 9))
+                # give: every good line counts, even for a user who also has a bad one
+                await app.dp.feed_update(app.bot, command(2, "/givebulk 1 10; 1 -5; @AMY 15; 2 0", 9))
+                async with app.db._read() as conn:
+                    audit = await conn.execute_fetchall("SELECT tg_id, action, amount, delta FROM admin_audit ORDER BY id")
+                ledger = {tg: await app.db.ledger_entries(tg) for tg in (1, 2)}
+                return [tuple(r) for r in audit], ledger, await app.db.get_balances([1, 2])
+            finally:
+                await app.db.close()
+                await app.bot.session.close()
+
+        audit, ledger, balances = asyncio.run(go())
+
+    assert replies == [
+        "✅ Set 2 entries for 2 users (0 new accounts). Net change: -110.\n⚠️ Skipped 3:\n"
+        "line 6: bad amount 'x'\n1: amount must be >= 0\n@ghost: user not found",
+        "✅ Credited 2 entries for 1 users (0 new accounts). Net change: +25.\n⚠️ Skipped 2:\n"
+        "1: amount must be > 0\n2: amount must be > 0",
+    ]
+    assert audit == [(1, "set", 70, -30), (2, "set", 20, -80), (1, "give", 10, 10), (1, "give", 15, 15)]
+    assert [(e["amount"], e["kind"], e["ref"]) for e in reversed(ledger[1])][1:] == [(-30, "admin", 9), (10, "admin", 9),
+                                                                                     (15, "admin", 9)]
+    assert [(e["amount"], e["kind"], e["ref"]) for e in reversed(ledger[2])][1:] == [(-80, "admin", 9)]
+    assert balances == {1: 95, 2: 20}
+
+
+def test_setbal_delta_comes_from_the_write(monkeypatch):
+    replies = []
+
+    async def reply(self, text, **kwargs):
+        replies.append(text)
+
+    monkeypatch.setattr(Message, "reply", reply)
+    monkeypatch.setattr(bot, "ADMIN_IDS", {9})
+
+    with tempfile.TemporaryDirectory(prefix="casinon-test-") as tmp:
+        app = bot.create_app(settings_in(tmp, 100))
+        resolve = app.directory.resolve
+
+        async def resolve_then_settle(target, **kwargs):
+            row = await resolve(target, **kwargs)
+            await app.db.update_balance(row["tg_id"], 40)  # a round settles between the lookup and the write
+            return row
+
+        monkeypatch.setattr(app.directory, "resolve", resolve_then_settle)
+
+        async def go():
+            await app.db.init()
+            try:
+                await app.db.get_or_create_user(1, "amy")
+                await app.dp.feed_update(app.bot, command(1, "/setbal @amy 30", 9))
+                return await app.db.ledger_entries(1)
+            finally:
+                await app.db.close()
+                await app.bot.session.close()
+
+        ledger = asyncio.run(go())
+
+    assert replies == ["✅ Set balance to 30 (delta -110)."]
+    assert ledger[0]["amount"] == -110 and ledger[0]["kind"] == "admin"
@@ -0,0 +1,262 @@
+"""
+Middleware checks that need no bot or network: callback dedup, action tags,
+rate limiting and draining before shutdown.
+
+    python -m pytest -q test_middlewares.py
+"""
+
+import asyncio
+import os
+import signal
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from aiogram.types import CallbackQuery, Update, User  # noqa: E402
+
+from middlewares import idempotency as idem  # noqa: E402
+from middlewares.drain import DrainMiddleware  # noqa: E402
+from middlewares.idempotency import ActionTracker, CallbackDedupMiddleware, TTLCache, parse_tag  # noqa: E402
+from middlewares.throttling import RateLimiter, parse_limits  # noqa: E402
+from services.lifecycle import Lifecycle  # noqa: E402
+from storage.db import Database  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def callback(cb_id: str, data: str, tg_id: int = 1) -> CallbackQuery:
+    return CallbackQuery(id=cb_id, from_user=User(id=tg_id, is_bot=False, first_name="u"),
+                         chat_instance="c", data=data)
+
+
+@pytest.fixture
+def answers(monkeypatch):
+    """Record CallbackQuery.answer() instead of calling the Bot API."""
+    seen = []
+
+    async def answer(self, text=None, **kwargs):
+        seen.append((self.id, text))
+
+    monkeypatch.setattr(CallbackQuery, "answer", answer)
+    return seen
+
+
+def test_parse_tag():
+    assert parse_tag("blackjack:hit~a1b2c3.4") == ("blackjack:hit", ("a1b2c3", 4))
+    assert parse_tag("blackjack:hit") == ("blackjack:hit", None)
+    # malformed suffixes are left in place, not half-parsed
+    assert parse_tag("blackjack:hit~a1b2c3.") == ("blackjack:hit~a1b2c3.", None)
+    assert parse_tag("blackjack:hit~.4") == ("blackjack:hit~.4", None)
+    assert parse_tag("blackjack:hit~a1b2c3.x") == ("blackjack:hit~a1b2c3.x", None)
+
+
+def test_ttl_cache_expiry_and_size():
+    t = FakeClock()
+    cache = TTLCache(maxsize=2, ttl_s=10, clock=t)
+    assert cache.add("a") and not cache.add("a")
+    t.now += 9.9
+    assert not cache.add("a")  # still inside the TTL
+    t.now += 0.1
+    assert cache.add("a")  # expired -> seen as new
+    assert cache.add("b") and not cache.add("a")  # full, but "a" is still caught
+    assert cache.add("c")  # "a" is evicted to stay at maxsize
+    assert cache.add("a") and not cache.add("c")
+
+
+def test_stale_tags():
+    actions = ActionTracker()
+    state = {}
+    idem.init_tag(state)
+    rid = state["rid"]
+    assert not actions.is_stale(1, (rid, 0))  # nothing known yet (e.g. after a restart)
+    state["seq"] = 2
+    actions.advance(1, state)
+    assert actions.is_stale(1, (rid, 1))
+    assert not actions.is_stale(1, (rid, 2))
+    assert not actions.is_stale(1, ("other", 0))  # a new round is not stale
+    assert not actions.is_stale(2, (rid, 0))
+    assert idem.tag_matches(state, (rid, 2)) and not idem.tag_matches(state, (rid, 1))
+
+
+def test_bump_and_unbump():
+    actions = ActionTracker()
+    state = {}
+    idem.init_tag(state)
+    actions.bump(1, state)
+    assert idem.tag(state) == f"~{state['rid']}.1" and actions.is_stale(1, (state["rid"], 0))
+    actions.unbump(1, state)  # the save was refused: seq 0 is current again
+    assert state["seq"] == 0 and not actions.is_stale(1, (state["rid"], 0))
+    legacy = {}
+    actions.bump(1, legacy)
+    assert legacy == {} and idem.tag(legacy) == ""
+
+
+def test_duplicate_claim_is_answered_without_the_handler(answers):
+    mw = CallbackDedupMiddleware(actions=ActionTracker())
+    calls = []
+    release = asyncio.Event()
+
+    async def handler(event, data):
+        calls.append((event.data, data["action_tag"]))
+        await release.wait()
+
+    async def go():
+        first = asyncio.create_task(mw(handler, callback("1", "blackjack:hit~ab.3"), {}))
+        await asyncio.sleep(0)
+        await mw(handler, callback("2", "blackjack:hit~ab.3"), {})  # double tap, other callback id
+        await mw(handler, callback("1", "blackjack:hit~ab.3"), {})  # re-delivered callback id
+        release.set()
+        await first
+
+    asyncio.run(go())
+    assert calls == [("blackjack:hit", ("ab", 3))]
+    assert answers == [("2", None)]
+
+
+def test_claim_released_when_the_handler_fails(answers):
+    actions = ActionTracker()
+    mw = CallbackDedupMiddleware(actions=actions)
+
+    async def boom(event, data):
+        raise RuntimeError("handler failed")
+
+    async def ok(event, data):
+        return "handled"
+
+    async def go():
+        with pytest.raises(RuntimeError):
+            await mw(boom, callback("1", "roul:spin~ab.0"), {})
+        return await mw(ok, callback("2", "roul:spin~ab.0"), {})
+
+    assert asyncio.run(go()) == "handled"
+    assert answers == []
+    assert actions.claim(1, ("ab", 0))  # nothing left in flight
+
+
+def test_stale_tag_is_refused(answers):
+    actions = ActionTracker()
+    actions.advance(1, {"rid": "ab", "seq": 5})
+    mw = CallbackDedupMiddleware(actions=actions)
+
+    async def handler(event, data):
+        raise AssertionError("stale action reached the handler")
+
+    asyncio.run(mw(handler, callback("1", "blackjack:stand~ab.4"), {}))
+    assert answers == [("1", "This button is outdated.")]
+
+
+def test_parse_limits():
+    rules = parse_limits(" *=25/5; bjbet:add=8/2 ,roul:num=8/2.5,, roul=10/1")
+    assert rules == [("bjbet:add", 8, 2.0), ("roul:num", 8, 2.5), ("roul", 10, 1.0), ("*", 25, 5.0)]
+    assert parse_limits("") == []
+    for bad in ("bjbet:add=8", "=8/2", "x=0/2", "x=8/0", "x=eight/2", "x"):
+        with pytest.raises(ValueError, match="bad throttle rule"):
+            parse_limits(bad)
+
+
+def test_rule_for_longest_prefix():
+    limiter = RateLimiter(parse_limits("roul=10/1,roul:num=8/2"))
+    assert limiter.rule_for("roul:num:17")[0] == "roul:num"
+    assert limiter.rule_for("roul:spin")[0] == "roul"
+    assert limiter.rule_for("nav:menu") is None  # no "*" rule: unlimited
+    assert all(limiter.allow(1, "nav:menu") for _ in range(100))
+
+
+def test_sliding_window():
+    t = FakeClock()
+    limiter = RateLimiter(parse_limits("*=3/1"), buckets=10, clock=t)
+    assert [limiter.allow(1, "x") for _ in range(4)] == [True, True, True, False]
+    assert limiter.allow(2, "x")  # per user
+    t.now += 0.5
+    assert not limiter.allow(1, "x")  # the first presses are still in the window
+    t.now += 0.6
+    # the first presses have left the window, the rejected one at +0.5 s still counts
+    assert [limiter.allow(1, "x") for _ in range(3)] == [True, True, False]
+
+
+def test_abuse_strikes_flag_once_per_cooldown():
+    t = FakeClock()
+    limiter = RateLimiter([], abuse_strikes=3, abuse_window_s=60, abuse_cooldown_s=600, clock=t)
+    assert [limiter.strike(1) for _ in range(4)] == [None, None, 3, None]
+    t.now += 90  # strikes have left the window
+    assert [limiter.strike(1) for _ in range(3)] == [None, None, None]  # still cooling down
+    t.now += 600
+    assert [limiter.strike(1) for _ in range(3)] == [None, None, 3]
+
+
+def test_drain_refuses_new_rounds_and_shutdown_waits_before_closing(answers):
+    with tempfile.TemporaryDirectory(prefix="casinon-test-") as tmp:
+        path = os.path.join(tmp, "casino.db")
+        db = Database(path, starting_balance=100)
+        lifecycle = Lifecycle(deadline_s=5)
+        mw = DrainMiddleware(lifecycle)
+        steps, stops = [], []
+        release = asyncio.Event()
+
+        async def handler(event, data):
+            action = event.callback_query.data
+            steps.append(action)
+            if action == "blackjack:hit":
+                await release.wait()  # the dealer reveal of a round opened before the signal
+                await db.update_balance(1, 5)
+                steps.append("hit settled")
+
+        async def stop_polling():
+            stops.append("stop polling")
+
+        class Scheduler:
+            async def stop(self, timeout_s):
+                steps.append("scheduler stopped")
+
+        def record(name, fn):
+            async def wrapped(*args):
+                steps.append(" ".join((name, *args)))
+                return await fn(*args)
+            return wrapped
+
+        db.checkpoint = record("checkpoint", db.checkpoint)
+
+        def update(n, data):
+            return Update(update_id=n, callback_query=callback(str(n), data))
+
+        async def go():
+            await db.init()
+            try:
+                await db.get_or_create_user(1, "a")
+                db._writer.stop = record("writer flushed", db._writer.stop)
+                hit = asyncio.create_task(mw(handler, update(1, "blackjack:hit"), {}))
+                await asyncio.sleep(0)
+                lifecycle._on_signal(signal.SIGTERM, stop_polling)
+                await mw(handler, update(2, "game:blackjack"), {})  # rest of the fetched batch: refused
+                await mw(handler, update(3, "blackjack:stand"), {})  # an open round may still finish
+                shutdown = asyncio.create_task(lifecycle.shutdown(db, Scheduler()))
+                await asyncio.sleep(0.05)
+                waiting = (shutdown.done(), lifecycle.inflight, list(steps))
+                release.set()
+                await asyncio.gather(hit, shutdown)
+                return waiting
+            finally:
+                if db._writer.running:
+                    await db.close()
+
+        waiting = asyncio.run(go())
+        assert waiting == (False, 1, ["blackjack:hit", "blackjack:stand"])
+        assert stops == ["stop polling"] and lifecycle.draining
+        assert answers == [("2", "The bot is restarting, try again in a moment.")]
+        assert steps == ["blackjack:hit", "blackjack:stand", "hit settled", "scheduler stopped", "writer flushed",
+                         "checkpoint TRUNCATE"]
+        wal = path + "-wal"
+        assert not os.path.exists(wal) or os.path.getsize(wal) == 0  # the WAL was folded into the main file
+        with sqlite3.connect(path) as conn:
+            assert conn.execute("SELECT balance FROM users WHERE tg_id = 1").fetchone() == (105,)
@@ -0,0 +1,904 @@
+"""
+Storage conformance suite: the same checks run against every engine.
+
+    python -m pytest -q test_storage.py
+"""
+
+import asyncio
+import csv
+import gzip
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from services import clock, export  # noqa: E402
+from services.balance_cache import BalanceCache  # noqa: E402
+from services.leaderboard import Leaderboard  # noqa: E402
+from services.recovery import reap_stale_rounds, recover_rounds  # noqa: E402
+from services.user_directory import UserDirectory  # noqa: E402
+from storage import archive, backup  # noqa: E402
+from storage.db import Database  # noqa: E402
+from storage.memory import MemoryStorage  # noqa: E402
+from storage.reshard import reshard, verify  # noqa: E402
+from storage.sharded import ShardedStorage  # noqa: E402
+
+START = 1000
+T0 = 1_741_946_400_000  # 2025-03-14T10:00:00Z
+
+
+@pytest.fixture(params=["sqlite", "memory", "sharded"])
+def store(request):
+    if request.param == "memory":
+        yield MemoryStorage(starting_balance=START)
+        return
+    with tempfile.TemporaryDirectory(prefix="casinon-test-") as tmp:
+        if request.param == "sharded":
+            yield ShardedStorage(os.path.join(tmp, "test.db"), 3, starting_balance=START)
+        else:
+            yield Database(os.path.join(tmp, "test.db"), starting_balance=START)
+
+
+def run(store, coro_fn):
+    async def go():
+        await store.init()
+        try:
+            return await coro_fn()
+        finally:
+            await store.close()
+    return asyncio.run(go())
+
+
+def test_user_created_once_and_renamed(store):
+    renames = []
+    store.username_listeners.append(lambda tg, old, new: renames.append((tg, old, new)))
+
+    async def go():
+        a = await store.get_or_create_user(1, "alice")
+        b = await store.get_or_create_user(1, None)
+        c = await store.get_or_create_user(1, "Alicia")
+        found = await store.find_user(username="alicia")
+        missing = await store.find_user(username="alice")
+        return a, b, c, found, missing
+
+    a, b, c, found, missing = run(store, go)
+    assert a["balance"] == START and a["id"] == b["id"] == c["id"]
+    assert c["username"] == "Alicia"
+    assert found["tg_id"] == 1 and missing is None
+    assert renames == [(1, "alice", "Alicia")]
+
+
+def test_balances_and_listeners(store):
+    seen = []
+    store.balance_listeners.append(lambda tg, bal, _u: seen.append((tg, bal)))
+
+    async def go():
+        await store.get_or_create_user(1, "a")
+        await store.get_or_create_user(2, "b")
+        assert await store.update_balance(1, 250) == START + 250
+        assert await store.set_balance(2, 5) == START  # the balance it replaced
+        await store.update_balance(2, 7)
+        assert await store.set_balance(2, 5) == 12
+        assert await store.set_balance(99, 5) is None
+        assert await store.find_user(tg_id=99) is None
+        return await store.top_balances(2)
+
+    top = run(store, go)
+    assert [r["tg_id"] for r in top] == [1, 2]
+    assert seen[-4:] == [(1, START + 250), (2, 5), (2, 12), (2, 5)]
+
+
+def test_balance_cache_write_through_and_reconcile(store):
+    cache = BalanceCache(store)
+
+    async def go():
+        await cache.get_user(1, "a")
+        await cache.get_user(2, "b")
+        await store.start_active_round(1, "blackjack", 100, "{}")
+        hit = await cache.get_user(1, None)
+        # A change the cache never heard about shows up as drift.
+        store.balance_listeners.remove(cache.update)
+        await store.update_balance(2, 40)
+        store.balance_listeners.append(cache.update)
+        stale = await cache.get_user(2, "b")
+        counts = await cache.reconcile()
+        fixed = await cache.get_user(2, "b")
+        renamed = await cache.get_user(2, "bee")
+        return hit, stale, counts, fixed, renamed, await store.get_balances([1, 2, 99])
+
+    hit, stale, counts, fixed, renamed, stored = run(store, go)
+    assert hit["available"] == START - 100 and cache.misses == 3
+    assert stale["available"] == START and fixed["available"] == START + 40
+    assert counts == {"checked": 2, "drift": 1, "evicted": 0}
+    assert renamed["username"] == "bee"
+    assert stored == {1: START - 100, 2: START + 40}
+
+
+def test_start_round_debits_and_is_exclusive(store):
+    async def go():
+        await store.get_or_create_user(1, "a")
+        assert await store.start_active_round(1, "blackjack", 100, "{}")
+        assert not await store.start_active_round(1, "blackjack", 0, "{}")
+        assert not await store.start_active_round(2, "roulette", 0, "{}")  # unknown user
+        user = await store.find_user(tg_id=1)
+        ar = await store.get_active_round(1)
+        return user, ar
+
+    user, ar = run(store, go)
+    assert (user["balance"], user["held"], user["available"]) == (START, 100, START - 100)
+    assert ar["game"] == "blackjack" and ar["bet"] == 100
+
+
+def test_start_round_rejects_uncovered_bet(store):
+    async def go():
+        await store.get_or_create_user(1, "a")
+        ok = await store.start_active_round(1, "blackjack", START + 1, "{}")
+        return ok, await store.find_user(tg_id=1), await store.get_active_round(1)
+
+    ok, user, ar = run(store, go)
+    assert not ok and user["balance"] == START and ar is None
+
+
+def test_concurrent_starts_open_one_round(store):
+    async def go():
+        await store.get_or_create_user(1, "a")
+        results = await asyncio.gather(*(store.start_active_round(1, "blackjack", 100, "{}") for _ in range(5)))
+        return results, await store.find_user(tg_id=1)
+
+    results, user = run(store, go)
+    assert sum(results) == 1
+    assert user["available"] == START - 100
+
+
+def test_rounds_of_different_games_hold_side_by_side(store):
+    async def go():
+        await store.get_or_create_user(1, "a")
+        assert await store.start_active_round(1, "blackjack", 600, "{}")
+        assert await store.start_active_round(1, "roulette", 0, "{}")
+        assert not await store.adjust_active_round_bet(1, 500, game="roulette")  # only 400 available
+        assert await store.adjust_active_round_bet(1, 300, game="roulette")
+        held = await store.find_user(tg_id=1)
+        await store.resolve_active_round(1, "win", 1200, game="blackjack")
+        after_bj = await store.find_user(tg_id=1)
+        refunded = await store.cancel_active_round(1)
+        return held, after_bj, refunded, await store.find_user(tg_id=1), await store.get_active_round(1)
+
+    held, after_bj, refunded, user, ar = run(store, go)
+    assert (held["balance"], held["held"], held["available"]) == (START, 900, START - 900)
+    assert (after_bj["balance"], after_bj["held"], after_bj["available"]) == (START + 600, 300, START + 300)
+    assert refunded == 300 and ar is None
+    assert (user["balance"], user["held"], user["available"]) == (START + 600, 0, START + 600)
+
+
+def test_adjust_bet_is_all_or_nothing(store):
+    async def go():
+        await store.get_or_create_user(1, "a")
+        assert not await store.adjust_active_round_bet(1, 10)  # no round yet
+        await store.start_active_round(1, "roulette", 0, "{}")
+        assert await store.adjust_active_round_bet(1, 300)
+        assert not await store.adjust_active_round_bet(1, START)  # cannot cover
+        assert not await store.adjust_active_round_bet(1, 0)
+        return await store.find_user(tg_id=1), await store.get_active_round(1)
+
+    user, ar = run(store, go)
+    assert user["available"] == START - 300
+    assert ar["bet"] == 300
+
+
+def test_save_round_is_compare_and_swap(store):
+    async def go():
+        await store.get_or_create_user(1, "a")
+        await store.start_active_round(1, "roulette", 0, "{}")
+        v0 = (await store.get_active_round(1))["version"]
+        first = await store.save_active_round(1, '{"n": 1}', v0, stake=100)
+        stale = await store.save_active_round(1, '{"n": 2}', v0)  # lost the race
+        broke = await store.save_active_round(1, '{"n": 3}', first["version"], stake=START)
+        missing = await store.save_active_round(2, "{}", 0)
+        return v0, first, stale, broke, missing, await store.get_active_round(1), await store.find_user(tg_id=1)
+
+    v0, first, stale, broke, missing, ar, user = run(store, go)
+    assert first == {"ok": True, "version": v0 + 1, "balance": START - 100}
+    assert stale == {"ok": False, "reason": "conflict"}
+    assert broke == {"ok": False, "reason": "funds"}
+    assert missing == {"ok": False, "reason": "missing"}
+    assert (ar["state_json"], ar["bet"], ar["version"]) == ('{"n": 1}', 100, v0 + 1)
+    assert user["available"] == START - 100
+
+
+def test_resolve_credits_records_and_closes(store):
+    async def go():
+        await store.get_or_create_user(1, "a")
+        await store.start_active_round(1, "blackjack", 100, "{}")
+        await store.update_active_round(1, '{"x": 1}')
+        assert (await store.get_active_round(1))["state_json"] == '{"x": 1}'
+        await store.resolve_active_round(1, "win", 250)
+        await store.resolve_active_round(1, "win", 250)  # second resolve is a no-op
+        return await store.find_user(tg_id=1), await store.get_active_round(1), await store.recent_bets(1)
+
+    user, ar, bets = run(store, go)
+    assert user["balance"] == START - 100 + 250
+    assert ar is None
+    assert len(bets) == 1
+    assert (bets[0]["game"], bets[0]["amount"], bets[0]["result"], bets[0]["delta"]) == ("blackjack", 100, "win", 150)
+
+
+def test_duplicate_username_resolves_to_newest_account(store):
+    if isinstance(store, MemoryStorage):
+        pytest.skip("resolve_usernames is SQLite-only")
+
+    async def go():
+        with clock.frozen(T0):
+            await store.get_or_create_user(5, "bob")  # shard 2 of 3
+        with clock.frozen(T0 + 1000):
+            await store.get_or_create_user(1, "Bob")  # shard 1 of 3, newer
+        return await store.resolve_usernames(["BOB"]), await store.find_user(username="bob")
+
+    resolved, found = run(store, go)
+    assert resolved == {"bob": 1} and found["tg_id"] == 1
+
+
+def test_directory_resolves_fresh_rows(store):
+    directory = UserDirectory(store)
+
+    async def go():
+        await store.get_or_create_user(1, "Alice")
+        first = await directory.resolve("@ALICE")
+        await store.get_or_create_user(1, "alicia")
+        await store.update_balance(1, 5)
+        return (first, await directory.resolve("@alice"), await directory.resolve(" @Alicia "),
+                await directory.resolve("2"), await directory.resolve("2", create=True), await directory.resolve("@"))
+
+    first, renamed, found, missing, created, empty = run(store, go)
+    assert first["tg_id"] == 1 and renamed is None
+    assert found["tg_id"] == 1 and found["balance"] == START + 5
+    assert missing is None and created["tg_id"] == 2 and empty is None
+
+
+def test_bonus_claim_pays_once_per_cooldown(store):
+    if isinstance(store, MemoryStorage):
+        pytest.skip("claim_bonus is SQLite-only")
+    day = 24 * 3_600_000
+
+    async def go():
+        with clock.frozen(T0) as t:
+            await store.get_or_create_user(1, "a")
+            burst = await asyncio.gather(*(store.claim_bonus(1, 100, 24) for _ in range(5)))
+            t.set(T0 + day - 1)
+            early = await store.claim_bonus(1, 100, 24)
+            t.set(T0 + day)
+            due = await store.claim_bonus(1, 100, 24)
+        return burst, early, due, await store.ledger_balance(1)
+
+    burst, early, due, ledger = run(store, go)
+    assert [r["ok"] for r in burst].count(True) == 1
+    assert [r["balance"] for r in burst] == [START + 100] * 5
+    assert [r["next_at"] for r in burst if not r["ok"]] == [T0 + day] * 4
+    assert early == {"ok": False, "balance": START + 100, "next_at": T0 + day}
+    assert due == {"ok": True, "balance": START + 200, "next_at": None}
+    assert ledger == START + 200  # one ledger row per paid claim
+
+
+def test_scheduled_bonus_credits_only_active_users(store):
+    if isinstance(store, MemoryStorage):
+        pytest.skip("grant_bonus_to_active is SQLite-only")
+    day = 24 * 3_600_000
+
+    async def play(tg):
+        await store.get_or_create_user(tg, None)
+        await store.start_active_round(tg, "roulette", 10, "{}")
+        await store.resolve_active_round(tg, "win", 10)
+
+    async def go():
+        with clock.frozen(T0 - 2 * day):
+            await play(2)  # active, but before today's day bucket
+        with clock.frozen(T0) as t:
+            await play(1)
+            await play(4)
+            await store.claim_bonus(4, 100, 24)  # active, still cooling down
+            await store.get_or_create_user(3, None)  # never played
+            t.advance(3_600_000)
+            first = await store.grant_bonus_to_active(50, 24, 1)
+            again = await store.grant_bonus_to_active(50, 24, 1)
+            wider = await store.grant_bonus_to_active(50, 24, 3)
+        return first, again, wider, await store.get_balances([1, 2, 3, 4])
+
+    first, again, wider, balances = run(store, go)
+    assert (first, again, wider) == (1, 0, 1)
+    assert balances == {1: START + 50, 2: START + 50, 3: START, 4: START + 100}
+
+
+def test_leaderboard_evicts_readmits_and_rebuilds(store):
+    board = Leaderboard(capacity=3)
+    store.balance_listeners.append(board.update)
+
+    async def go():
+        for tg in range(1, 6):
+            await store.get_or_create_user(tg, f"u{tg}")
+            await store.update_balance(tg, tg * 100)  # 1100 .. 1500
+        await board.rebuild(store)
+        seen = [[tg for tg, _b, _n in await board.get(store, 3)]]
+        await store.update_balance(5, -1000)  # drops below the floor: evicted
+        seen.append(board.top(3))  # two left and u3 may be next: needs a rebuild
+        seen.append([tg for tg, _b, _n in await board.get(store, 3)])
+        await store.update_balance(1, 1000)  # climbs back in past the floor
+        seen.append([tg for tg, _b, _n in await board.get(store, 3)])
+        return seen
+
+    seen = run(store, go)
+    assert seen == [[5, 4, 3], None, [4, 3, 2], [1, 4, 3]]
+
+
+def test_leaderboard_matches_top_balances_under_random_updates(store):
+    rng = random.Random(7)
+    board = Leaderboard(capacity=6)
+    store.balance_listeners.append(board.update)
+
+    async def go():
+        for tg in range(1, 11):
+            await store.get_or_create_user(tg, None)
+        await board.rebuild(store)
+        mismatches = []
+        for step in range(300):
+            tg = rng.randint(1, 25)
+            op = rng.random()
+            if op < 0.6:
+                await store.get_or_create_user(tg, None)
+                await store.update_balance(tg, rng.randint(-400, 400))
+            elif op < 0.8:
+                await store.get_or_create_user(tg, None)
+                await store.start_active_round(tg, "roulette", rng.randint(1, 300), "{}")
+            else:
+                await store.cancel_active_round(tg)
+            k = rng.randint(1, 6)
+            got = await board.get(store, k)
+            want = await store.top_balances(k)
+            actual = await store.get_balances([t for t, _b, _n in got])
+            if [b for _t, b, _n in got] != [r["balance"] for r in want] or any(actual[t] != b for t, b, _n in got):
+                mismatches.append((step, got, want))
+        return mismatches
+
+    assert run(store, go) == []
+
+
+def test_recent_bets_newest_first(store):
+    async def go():
+        await store.get_or_create_user(1, "a")
+        for i in range(4):
+            await store.record_bet(1, "roulette", 10 + i, "loss", -(10 + i))
+        await store.record_bet(2, "roulette", 10, "loss", -10)  # unknown user: ignored
+        return await store.recent_bets(1, limit=3), await store.recent_bets(2)
+
+    bets, none = run(store, go)
+    assert [b["amount"] for b in bets] == [13, 12, 11]
+    assert none == []
+
+
+def test_iter_and_settle_rounds(store):
+    async def go():
+        # One frozen millisecond: only the version token can tell round 5 was touched.
+        with clock.frozen(T0):
+            for tg in range(1, 6):
+                await store.get_or_create_user(tg, None)
+                await store.start_active_round(tg, "roulette", 10, "{}")
+            pages = [page async for page in store.iter_active_rounds(batch_size=2)]
+            rows = [r for page in pages for r in page]
+            await store.update_active_round(5, "{}")  # touched after being read -> skipped
+            items = [(r, None if r["tg_id"] % 2 else "win", 10 if r["tg_id"] % 2 else 30) for r in rows]
+            closed = await store.settle_rounds(items)
+        left = [r async for page in store.iter_active_rounds() for r in page]
+        return pages, closed, left, await store.find_user(tg_id=2), await store.recent_bets(1)
+
+    pages, closed, left, user2, bets1 = run(store, go)
+    assert all(len(p) <= 2 for p in pages) and sum(len(p) for p in pages) == 5
+    assert sorted(r["tg_id"] for r, _res, _p in closed) == [1, 2, 3, 4]
+    assert user2["balance"] == START - 10 + 30
+    assert bets1 == []  # refunds are not recorded as bets
+    assert [r["tg_id"] for r in left] == [5]
+
+
+def test_stale_active_rounds(store):
+    async def go():
+        with clock.frozen(T0) as t:
+            await store.get_or_create_user(1, None)
+            await store.start_active_round(1, "roulette", 0, "{}")
+            fresh = await store.stale_active_rounds(3600)
+            t.advance(3601 * 1000)
+            stale = await store.stale_active_rounds(3600)
+        return fresh, stale
+
+    fresh, stale = run(store, go)
+    assert fresh == []
+    assert [r["tg_id"] for r in stale] == [1]
+    assert stale[0]["updated_at"] == T0
+
+
+def test_cancel_and_reset_refund_the_stake(store):
+    async def go():
+        await store.get_or_create_user(1, "a")
+        assert await store.cancel_active_round(1) is None  # nothing to cancel
+        await store.start_active_round(1, "roulette", 0, "{}")
+        await store.adjust_active_round_bet(1, 200)
+        assert await store.reset_active_round(1, '{"fresh": 1}') == START
+        reset = await store.get_active_round(1)
+        await store.adjust_active_round_bet(1, 50)
+        assert await store.cancel_active_round(1) == 50
+        await store.start_active_round(1, "blackjack", 70, "{}")
+        assert await store.cancel_active_round(1, refund=False) == 0
+        assert await store.reset_active_round(1, "{}") is None
+        return reset, await store.get_active_round(1), await store.find_user(tg_id=1)
+
+    reset, ar, user = run(store, go)
+    assert reset["bet"] == 0 and reset["state_json"] == '{"fresh": 1}'
+    assert ar is None
+    assert user["balance"] == START - 70
+
+
+def _bj_state(hands, dealer, deck, current_hand, bet=10):
+    n = len(hands)
+    return json.dumps({
+        "deck": deck, "player_hands": hands, "bets": [bet] * n, "current_hand": current_hand,
+        "dealer": dealer, "dealer_visible": [dealer[0], "🂠"], "doubled": [False] * n,
+        "surrendered": [False] * n, "finished": False, "result": None, "original_bet": bet,
+        "split_count": n - 1,
+    })
+
+
+def _roulette_state(spun, result=None):
+    return json.dumps({"bets": [{"type": "straight", "value": "17", "amount": 10}], "last_chip": 10,
+                       "spun": spun, "result": result})
+
+
+def test_startup_recovery_settles_or_refunds_each_kind(store):
+    ttl_s = 3600
+    # dealer 10+6 draws the 2 off the end of the deck and stands on 18
+    dealer, deck = ["10♦", "6♣"], ["K♠", "2♥"]
+
+    async def go():
+        with clock.frozen(T0) as t:
+            rounds = {
+                1: ("roulette", 10, _roulette_state(True, 17)),  # spun: straight 17 pays 36x
+                2: ("blackjack", 10, _bj_state([["10♠", "9♥"]], dealer, deck, 1)),  # played, 19 beats 18
+                3: ("roulette", 10, _roulette_state(False)),  # never spun, idle past the TTL
+                5: ("roulette", 10, _roulette_state(True)),  # spin interrupted before a number
+                6: ("blackjack", 20, _bj_state([["10♠", "9♥"], ["10♣", "7♦"]], dealer, deck, 2)),  # win + loss
+            }
+            for tg, (game, bet, state) in rounds.items():
+                await store.get_or_create_user(tg, None)
+                assert await store.start_active_round(tg, game, bet, state)
+            t.advance(ttl_s * 1000 // 2)
+            await store.get_or_create_user(4, None)  # blackjack in progress, recently touched
+            await store.start_active_round(4, "blackjack", 10, _bj_state([["10♠", "5♥"]], dealer, deck, 0))
+            t.set(T0 + ttl_s * 1000 + 1)
+            counts = await recover_rounds(store, ttl_s)
+        users = {tg: await store.find_user(tg_id=tg) for tg in range(1, 7)}
+        bets = {tg: await store.recent_bets(tg, 5) for tg in range(1, 7)}
+        left = [r["tg_id"] async for page in store.iter_active_rounds() for r in page]
+        return counts, users, bets, left
+
+    counts, users, bets, left = run(store, go)
+    assert counts == {"scanned": 6, "settled": 3, "refunded": 2, "kept": 1}
+    assert left == [4]
+    assert {tg: u["balance"] for tg, u in users.items()} == {
+        1: START - 10 + 360, 2: START - 10 + 20, 3: START, 4: START, 5: START, 6: START - 20 + 20,
+    }
+    # every closed round released its hold; only the kept one still holds its stake
+    assert {tg: u["held"] for tg, u in users.items()} == {1: 0, 2: 0, 3: 0, 4: 10, 5: 0, 6: 0}
+    assert {tg: [(b["result"], b["delta"]) for b in rows] for tg, rows in bets.items()} == {
+        1: [("win", 350)], 2: [("win", 10)], 3: [], 4: [], 5: [], 6: [("mixed", 0)],
+    }
+
+
+def test_reaper_cutoff_releases_and_ledgers_holds(store):
+    ttl_s = 3600
+    notified = []
+
+    async def notify(tg_id, text):
+        notified.append(tg_id)
+
+    async def go():
+        with clock.frozen(T0) as t:
+            for tg, state in ((1, _roulette_state(False)), (3, _roulette_state(True, 17))):
+                await store.get_or_create_user(tg, None)
+                await store.start_active_round(tg, "roulette", 10, state)
+            t.advance(1)
+            await store.get_or_create_user(2, None)
+            await store.start_active_round(2, "roulette", 10, _roulette_state(False))
+            t.set(T0 + 1 + ttl_s * 1000)  # rounds 1 and 3 idle 1 ms past the TTL, round 2 exactly at it
+            reaped = await reap_stale_rounds(store, ttl_s, notify=notify)
+            sweep = await recover_rounds(store, ttl_s)  # the startup sweep draws the line at the same age
+        users = {tg: await store.find_user(tg_id=tg) for tg in (1, 2, 3)}
+        ledger = {tg: await store.ledger_balance(tg) for tg in (1, 3)} if hasattr(store, "ledger_balance") else None
+        return reaped, sweep, users, ledger
+
+    reaped, sweep, users, ledger = run(store, go)
+    assert reaped == {"settled": 1, "refunded": 1} and sorted(notified) == [1, 3]
+    assert sweep["kept"] == 1 and sweep["scanned"] == 1
+    assert (users[1]["balance"], users[1]["held"]) == (START, 0)
+    assert (users[3]["balance"], users[3]["held"]) == (START - 10 + 360, 0)
+    assert (users[2]["balance"], users[2]["held"]) == (START, 10)
+    if ledger is not None:
+        assert ledger == {1: START, 3: START - 10 + 360}
+
+
+def test_rollups_fold_hours_into_days_and_rank_net(store):
+    if isinstance(store, MemoryStorage):
+        pytest.skip("rollups are SQLite-only")
+    hour, day = 3_600_000, 86_400_000
+
+    async def play(tg, bet, payout):
+        await store.get_or_create_user(tg, f"u{tg}")
+        await store.start_active_round(tg, "roulette", bet, "{}")
+        await store.resolve_active_round(tg, "win" if payout > bet else "loss" if payout < bet else "push", payout)
+
+    async def go():
+        with clock.frozen(T0) as t:
+            await play(1, 10, 30)
+            await play(2, 20, 0)
+            t.advance(hour)
+            await play(3, 10, 10)
+            await play(1, 10, 0)
+            t.advance(hour)
+            await store.compact_rollups(14)
+            hourly = await store.game_stats()
+            top = await store.top_net("day", limit=3)
+            t.set(T0 + 16 * day)
+            first = await store.compact_rollups(14)
+            second = await store.compact_rollups(14)
+            return hourly, top, first, second, await store.game_stats(), await store.game_stats(since_ms=T0)
+
+    hourly, top, first, second, daily, since = run(store, go)
+    assert hourly["roulette"]["rounds"] == 4 and hourly["roulette"]["net"] == 20 - 20 + 0 - 10
+    assert (hourly["roulette"]["wins"], hourly["roulette"]["losses"], hourly["roulette"]["pushes"]) == (1, 2, 1)
+    assert [(r["tg_id"], r["net"], r["rounds"]) for r in top] == [(1, 10, 2), (3, 0, 1), (2, -20, 1)]
+    assert first["folded_days"] >= 1 and second["folded_days"] == 0  # folded once, not re-added
+    assert daily == hourly and since == hourly
+
+
+def test_iso_text_schema_is_migrated_to_epoch_ms():
+    with tempfile.TemporaryDirectory(prefix="casinon-test-") as tmp:
+        path = os.path.join(tmp, "old.db")
+        with sqlite3.connect(path) as c:
+            c.executescript(
+                """
+                CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, tg_id INTEGER UNIQUE NOT NULL,
+                                    username TEXT, balance INTEGER NOT NULL, created_at TEXT NOT NULL);
+                CREATE TABLE bets (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, game TEXT NOT NULL,
+                                   amount INTEGER NOT NULL, result TEXT NOT NULL, delta INTEGER NOT NULL,
+                                   created_at TEXT NOT NULL, FOREIGN KEY (user_id) REFERENCES users(id));
+                CREATE TABLE active_rounds (id INTEGER PRIMARY KEY AUTOINCREMENT, tg_id INTEGER NOT NULL,
+                                            game TEXT NOT NULL, bet INTEGER NOT NULL, state_json TEXT NOT NULL,
+                                            created_at TEXT NOT NULL, updated_at TEXT NOT NULL);
+                INSERT INTO users VALUES (1, 7, 'old', 990, '2025-03-14T10:00:00');
+                INSERT INTO bets VALUES (41, 1, 'blackjack', 10, 'loss', -10, '2025-03-14T10:00:00.250000');
+                INSERT INTO active_rounds VALUES (3, 7, 'roulette', 0, '{}', '2025-03-14T10:00:00', '2025-03-14T10:00:00');
+                UPDATE sqlite_sequence SET seq = 50 WHERE name = 'bets';  -- ids 42..50 were archived
+                """
+            )
+        c.close()
+        db = Database(path, starting_balance=START)
+
+        async def go():
+            await db.record_bet(7, "blackjack", 10, "win", 10)
+            return await db.recent_bets(7, 5), await db.get_active_round(7)
+
+        with clock.frozen(T0 + 60_000):
+            bets, active = run(db, go)
+        assert [(b["id"], b["created_at"]) for b in bets] == [(51, T0 + 60_000), (41, T0 + 250)]
+        assert active["updated_at"] == T0 and active["version"] == 0
+        with sqlite3.connect(path) as c:
+            assert c.execute("SELECT typeof(created_at) FROM users").fetchone()[0] == "integer"
+            assert c.execute("SELECT created_at FROM bets_iso WHERE id = 41").fetchone()[0] == "2025-03-14T10:00:00.250"
+        c.close()
+        assert archive.segment_name(T0) == "bets-2025-03.seg"
+
+
+def test_resolve_without_user_releases_the_hold():
+    with tempfile.TemporaryDirectory(prefix="casinon-test-") as tmp:
+        db = Database(os.path.join(tmp, "test.db"), starting_balance=START)
+
+        async def drop_user(conn):
+            await conn.execute("DELETE FROM users WHERE tg_id = 1")
+
+        async def go():
+            await db.get_or_create_user(1, "a")
+            await db.start_active_round(1, "blackjack", 100, "{}")
+            await db._write(drop_user)
+            await db.resolve_active_round(1, "win", 200)
+            async with db._read() as conn:
+                return [
+                    (await conn.execute_fetchall(f"SELECT COUNT(*) FROM {t}"))[0][0]
+                    for t in ("active_rounds", "holds", "hold_totals")
+                ]
+
+        assert run(db, go) == [0, 0, 0]
+
+
+def test_archive_deletes_only_archived_bets():
+    with tempfile.TemporaryDirectory(prefix="casinon-test-") as tmp:
+        db = Database(os.path.join(tmp, "test.db"), starting_balance=START, archive_dir=os.path.join(tmp, "archive"))
+
+        async def orphan(conn):
+            await conn.execute(
+                "INSERT INTO bets (user_id, game, amount, result, delta, created_at) VALUES (999, 'dice', 1, 'loss', -1, ?)",
+                (T0,)
+            )
+
+        async def go():
+            with clock.frozen(T0):
+                await db.get_or_create_user(1, "a")
+                await db.record_bet(1, "dice", 10, "win", 10)
+                await db._write(orphan)
+                await db.record_bet(1, "dice", 20, "loss", -20)
+            with clock.frozen(T0 + 10 * 86_400_000):
+                moved = await db.archive_bets(retention_days=1)
+            async with db._read() as conn:
+                left = await conn.execute_fetchall("SELECT user_id FROM bets")
+            return moved, [r[0] for r in left]
+
+        moved, left = run(db, go)
+        assert moved == 2 and left == [999]
+
+
+def test_archive_rerun_after_crash_does_not_duplicate():
+    with tempfile.TemporaryDirectory(prefix="casinon-test-") as tmp:
+        archive_dir = os.path.join(tmp, "archive")
+        db = Database(os.path.join(tmp, "test.db"), starting_balance=START, archive_dir=archive_dir)
+
+        async def go():
+            for at in (T0 - 20 * 86_400_000, T0, T0 + 1):  # February and March segments
+                with clock.frozen(at):
+                    await db.get_or_create_user(1, "a")
+                    await db.record_bet(1, "dice", 10, "win", 10)
+            write = db._write
+
+            async def crash(op):
+                raise RuntimeError("killed between append and delete")
+
+            with clock.frozen(T0 + 10 * 86_400_000):
+                db._write = crash
+                with pytest.raises(RuntimeError):
+                    await db.archive_bets(retention_days=1)
+                db._write = write
+                moved = await db.archive_bets(retention_days=1)
+            return moved, await db.recent_bets(1, 10)
+
+        moved, recent = run(db, go)
+        raw = []
+        for path in archive.list_segments(archive_dir):
+            with archive.Segment(path) as seg:
+                raw += [i for block in seg.blocks(["id"]) for i in block["id"]]
+        assert moved == 3
+        assert sorted(raw) == [1, 2, 3]  # the re-run appended nothing twice
+        assert [b["id"] for b in recent] == [3, 2, 1]
+        assert [r["id"] for r in archive.iter_archived_bets(archive_dir)] == [1, 2, 3]
+
+
+def test_iter_bets_pages_through_equal_timestamps(store):
+    if isinstance(store, MemoryStorage):
+        pytest.skip("iter_bets is SQLite-only")
+
+    async def go():
+        with clock.frozen(T0) as t:
+            for tg in (1, 2):
+                await store.get_or_create_user(tg, None)
+            for i in range(7):  # one millisecond for all of them: only the id orders the pages
+                await store.record_bet(1 + i % 2, "dice", i + 1, "win", i + 1)
+            t.advance(86_400_000)
+            await store.record_bet(1, "dice", 100, "loss", -100)
+        pages = [p async for p in store.iter_bets(page_size=2)]
+        mine = [p async for p in store.iter_bets(1, T0, T0 + 1, page_size=2)]
+        return pages, mine
+
+    pages, mine = run(store, go)
+    assert all(len(p) <= 2 for p in pages)
+    assert sorted(r["amount"] for p in pages for r in p) == [1, 2, 3, 4, 5, 6, 7, 100]  # none skipped or repeated
+    assert [len(p) for p in mine] == [2, 2]  # a full last page ends on the empty one after it
+    assert [r["amount"] for p in mine for r in p] == [1, 3, 5, 7]
+    assert {r["tg_id"] for p in mine for r in p} == {1}
+
+
+def test_export_merges_archive_segments_then_live_rows():
+    with tempfile.TemporaryDirectory(prefix="casinon-test-") as tmp:
+        db = Database(os.path.join(tmp, "test.db"), starting_balance=START, archive_dir=os.path.join(tmp, "archive"))
+        later = T0 + 10 * 86_400_000
+
+        def read(path, fmt):
+            with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+                rows = list(csv.DictReader(f)) if fmt == "csv" else [json.loads(line) for line in f]
+            return [int(r["amount"]) for r in rows]
+
+        async def go():
+            for at, tg, amount in ((T0 - 20 * 86_400_000, 1, 1), (T0 - 20 * 86_400_000, 2, 2), (T0, 1, 3)):
+                with clock.frozen(at):
+                    await db.get_or_create_user(tg, None)
+                    await db.record_bet(tg, "dice", amount, "win", amount)
+            with clock.frozen(later):
+                moved = await db.archive_bets(retention_days=1)
+                await db.record_bet(1, "dice", 4, "win", 4)
+                await db.record_bet(2, "dice", 5, "win", 5)
+            out = {}
+            for name, fmt, tg_id, since, until in (
+                ("all", "jsonl", None, None, None),
+                ("mine", "csv", 1, T0, None),
+                ("before", "jsonl", 1, None, T0),
+                ("window", "csv", None, T0, later),
+            ):
+                path = os.path.join(tmp, f"{name}.{fmt}.gz")
+                count = await export.export_bets(db, path, fmt, tg_id, since, until)
+                out[name] = count, read(path, fmt)
+            return moved, out
+
+        moved, out = run(db, go)
+        assert moved == 3
+        assert out["all"] == (5, [1, 2, 3, 4, 5])  # archived rows first, then live ones
+        assert out["mine"] == (2, [3, 4])  # an archived and a live row of user 1
+        assert out["before"] == (1, [1])
+        assert out["window"] == (1, [3])  # until is exclusive
+
+
+def test_ledger_matches_balances_across_compaction():
+    with tempfile.TemporaryDirectory(prefix="casinon-test-") as tmp:
+        db = Database(os.path.join(tmp, "test.db"), starting_balance=START)
+
+        async def go():
+            await db.get_or_create_user(1, "a")
+            await db.get_or_create_user(2, "b")
+            await db.start_active_round(1, "blackjack", 100, "{}")
+            await db.resolve_active_round(1, "win", 250)
+            await db.set_balance(2, 40, ref=7)
+            await db.update_balance(2, 5)
+            first = await db.compact_ledger(keep_days=-1)
+            await db.start_active_round(2, "roulette", 0, "{}")
+            await db.adjust_active_round_bet(2, 30)
+            await db.cancel_active_round(2)
+            await db.update_balance(1, -50, kind="admin", ref=7)
+            derived = [await db.ledger_balance(tg) for tg in (1, 2)]
+            second = await db.compact_ledger()
+            return first, second, derived, await db.top_balances(2), await db.ledger_entries(2)
+
+        first, second, derived, top, entries = run(db, go)
+        balances = {r["tg_id"]: r["balance"] for r in top}
+        assert balances == {1: START + 100, 2: 45}
+        assert derived == [balances[1], balances[2]]
+        assert first["mismatches"] == second["mismatches"] == 0
+        assert first["pruned"] == 6  # keep_days=-1 drops every folded row
+        assert entries == []  # a cancelled round only released its hold
+
+
+def test_writer_batches_and_isolates_failures():
+    with tempfile.TemporaryDirectory(prefix="casinon-test-") as tmp:
+        db = Database(os.path.join(tmp, "test.db"), starting_balance=START)
+
+        async def boom(conn):
+            await conn.execute("UPDATE users SET balance = 0")
+            raise ValueError("boom")
+
+        async def go():
+            for tg in range(1, 11):
+                await db.get_or_create_user(tg, None)
+            before = db._writer.batches
+            results = await asyncio.gather(
+                *(db.update_balance(tg, 5) for tg in range(1, 11)),
+                db._write(boom),
+                return_exceptions=True,
+            )
+            return results, db._writer.batches - before, await db.top_balances(10)
+
+        results, batches, top = run(db, go)
+        assert results[:10] == [START + 5] * 10
+        assert isinstance(results[10], ValueError)
+        assert batches < 11  # queued ops share transactions
+        assert all(r["balance"] == START + 5 for r in top)  # the failed op was rolled back alone
+
+
+def test_analytics_pool_interrupts_long_scans():
+    with tempfile.TemporaryDirectory(prefix="casinon-test-") as tmp:
+        db = Database(os.path.join(tmp, "test.db"), starting_balance=START, analytics_max_query_ms=50)
+        endless = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+
+        async def go():
+            await db.get_or_create_user(1, "alice")
+            async with db._analytics() as conn:
+                with pytest.raises(sqlite3.OperationalError, match="interrupted"):
+                    await conn.execute_fetchall(endless)
+            # the deadline is per borrow: the next one starts fresh, gameplay reads never had one
+            return await db.top_balances(1), await db.get_or_create_user(1, "alice")
+
+        top, user = run(db, go)
+        assert top[0]["tg_id"] == 1 and user["balance"] == START
+
+
+def test_online_backup_verify_and_restore():
+    with tempfile.TemporaryDirectory(prefix="casinon-test-") as tmp:
+        path = os.path.join(tmp, "casino.db")
+        backups = os.path.join(tmp, "backups")
+        db = Database(path, starting_balance=START)
+
+        async def go():
+            for tg in range(1, 51):
+                await db.get_or_create_user(tg, None)
+            before = await db.top_balances(100)
+
+            async def play():
+                for tg in range(1, 51):
+                    await db.update_balance(tg, 1)
+
+            # One page per step: the writes land between steps and must not restart the copy.
+            info, _ = await asyncio.gather(db.backup(backups, keep=2, pages=1, step_sleep_s=0.001), play())
+            return before, info
+
+        before, info = run(db, go)
+        assert info["steps"] == info["pages"] > 1
+        check = backup.verify(info["path"])
+        assert check["ok"] and check["users"] == 50
+        assert check["balance"] - sum(r["balance"] for r in before) in range(51)  # some of the concurrent +1s
+
+        restored = os.path.join(tmp, "restored.db")
+        assert backup.restore(info["path"], restored) == {k: check[k] for k in ("users", "balance", "bets", "active_rounds")}
+        with pytest.raises(FileExistsError):
+            backup.restore(info["path"], restored)
+        backup.restore(info["path"], restored, force=True)
+        assert os.path.exists(restored + ".before-restore")
+
+        for stamp in ("20250101T000000Z", "20250102T000000Z", "20250103T000000Z"):
+            Path(backups, f"casino-{stamp}.db.gz").touch()
+        assert backup.prune(backups, path, keep=2) == 2
+        assert backup.list_snapshots(backups, path)[-1].name == Path(info["path"]).name
+
+
+def test_reshard_round_trip():
+    with tempfile.TemporaryDirectory(prefix="casinon-test-") as tmp:
+        path = os.path.join(tmp, "casino.db")
+
+        archive_dir = os.path.join(tmp, "archive")
+
+        async def fill():
+            db = Database(path, starting_balance=START, archive_dir=archive_dir)
+            await db.init()
+            try:
+                for tg in range(1, 21):
+                    with clock.frozen(T0 if tg <= 8 else T0 + 10 * 86_400_000):
+                        await db.get_or_create_user(tg, f"u{tg}")
+                        await db.start_active_round(tg, "blackjack", 10, "{}")
+                        if tg % 4:
+                            await db.resolve_active_round(tg, "win", 20)
+                with clock.frozen(T0 + 10 * 86_400_000):
+                    assert await db.archive_bets(retention_days=1) == 6  # users 1-8
+                return await db.top_balances(3)
+            finally:
+                await db.close()
+
+        top = asyncio.run(fill())
+        before = verify(path, 1, archive_dir)
+        copied = reshard(path, 1, 4, archive_dir)
+        after = verify(path, 4, archive_dir)
+        assert before == after
+        assert before["archived"] == copied["archived"] == 6 and before["bets"] == copied["bets"] == 9
+        assert copied["users"] == 20 and copied["active_rounds"] == 5
+        assert before["held"] == copied["held"] == 50
+
+        async def read():
+            db = ShardedStorage(path, 4, starting_balance=START)
+            await db.init()
+            try:
+                return await db.top_balances(3), await db.recent_bets(13), await db.game_stats()
+            finally:
+                await db.close()
+
+        top4, bets5, stats = asyncio.run(read())
+        assert [r["balance"] for r in top4] == [r["balance"] for r in top]
+        assert len(bets5) == 1 and bets5[0]["delta"] == 10
+        assert stats["blackjack"]["rounds"] == 15
+
+        # shard files of the 4-way layout opened as a 2-way layout
+        wrong = ShardedStorage(path, 4, starting_balance=START)
+        wrong.shards = wrong.shards[:2]
+        with pytest.raises(RuntimeError):
+            asyncio.run(wrong.init())
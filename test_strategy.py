@@ -0,0 +1,55 @@
+"""
+Basic-strategy hints: situation() keys and table lookups.
+
+    python -m pytest -q test_strategy.py
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from games import strategy  # noqa: E402
+
+
+def test_situation_keys():
+    assert strategy.situation(["10♠", "6♥"], "K♦", True, False) == "h16.T.d"
+    assert strategy.situation(["A♠", "7♥"], "4♦", False, False) == "s18.4"
+    assert strategy.situation(["8♠", "8♥"], "A♦", True, True) == "p8.A.dp"
+    assert strategy.situation(["Q♠", "K♥"], "2♦", False, True) == "pT.2.p"
+    # a soft hand that would bust with the ace as 11 is hard
+    assert strategy.situation(["A♠", "9♥", "5♦"], "7♣", False, False) == "h15.7"
+
+
+def test_advise_table_lookups():
+    assert strategy.advise("h16.T.d") == "Surrender"
+    assert strategy.advise("h16.T") == "Surrender"
+    assert strategy.advise("p8.A.dp") == "Split"
+    assert strategy.advise("p8.A.d") == "Surrender"  # no split: played as hard 16
+    assert strategy.advise("pA.6") == "Hit"  # no split: played as soft 12
+    # "d" = double, else stand
+    assert strategy.advise("s18.4.d") == "Double"
+    assert strategy.advise("s18.4") == "Stand"
+    # "D" = double, else hit
+    assert strategy.advise("h11.6.d") == "Double"
+    assert strategy.advise("h11.6") == "Hit"
+    assert strategy.advise("p4.6.dp") == "Split" and strategy.advise("p4.2.dp") == "Hit"
+
+
+def test_double_else_surrender_code(monkeypatch):
+    # the current rules produce no "r" cell; a rerun with other rules may
+    monkeypatch.setitem(strategy.HARD, "16", "SSSSSHHRRr")
+    assert strategy.advise("h16.A.d") == "Double"
+    assert strategy.advise("h16.A") == "Surrender"
+    assert strategy.advise("h16.T.d") == "Surrender"
+
+
+def test_hint_text():
+    assert strategy.hint("h16.T.d") == "💡 Hard 16 vs 10: Surrender"
+    assert strategy.hint("pT.6.dp") == "💡 Pair of 10s vs 6: Stand"
+
+
+def test_no_hint_for_busted_or_malformed_keys():
+    for key in ("h24.5", "h22.T.d", "p11.5.p", "x16.5", "h16.Z", "h16.", "h16", "", "h.5", "hx.5"):
+        assert strategy.advise(key) is None, key
+        assert strategy.hint(key) == "No hint for this hand.", key